@@ -1,7 +1,8 @@
 from django.contrib import admin
 from .models import ClansModel, PlayersModel, VoevodaModel, PersonsModel
 from .models import PresetsModel, PersonPresetModel, FightsModel, FightEventModel
-from .models import InviteModel
+from .models import InviteModel, ReparseRunModel, ReparseCheckpointModel, PlayerStatsHistoryModel
+from .models import FightsArchiveModel, FightEventArchiveModel, InviteArchiveModel
 from .servises import KeyLogic
 
 
@@ -143,4 +144,88 @@ class InviteModelAdmin(admin.ModelAdmin):
 
     list_filter = ["state"]
 
-    search_fields = ["date", "event_id", "person_id"]
\ No newline at end of file
+    search_fields = ["date", "event_id", "person_id"]
+
+@admin.register(ReparseRunModel)
+class ReparseRunModelAdmin(admin.ModelAdmin):
+    list_display = [
+        "id",
+        "started_at",
+        "finished_at",
+        "state",
+        "offline",
+    ]
+
+    list_filter = ["state"]
+
+
+@admin.register(ReparseCheckpointModel)
+class ReparseCheckpointModelAdmin(admin.ModelAdmin):
+    list_display = [
+        "id",
+        "run",
+        "clan",
+        "state",
+        "error",
+        "updated_at",
+    ]
+
+    list_filter = ["run", "state"]
+
+
+@admin.register(PlayerStatsHistoryModel)
+class PlayerStatsHistoryModelAdmin(admin.ModelAdmin):
+    list_display = [
+        "id",
+        "player",
+        "date",
+        "changes",
+    ]
+
+    search_fields = ["player__id", "player__name"]
+
+
+@admin.register(FightsArchiveModel)
+class FightsArchiveModelAdmin(admin.ModelAdmin):
+    list_display = [
+        "id",
+        "date",
+        "name",
+        "type",
+        "voevoda_id",
+        "result",
+    ]
+
+    list_filter = ['voevoda_id', "type"]
+
+    search_fields = ['name']
+
+
+@admin.register(FightEventArchiveModel)
+class FightEventArchiveModelAdmin(admin.ModelAdmin):
+    list_display = [
+        "id",
+        "date",
+        "name",
+        "type",
+        "voevoda_id",
+        "enemy",
+        "state"
+    ]
+
+    list_filter = ['voevoda_id', "type"]
+
+    search_fields = ['name']
+
+
+@admin.register(InviteArchiveModel)
+class InviteArchiveModelAdmin(admin.ModelAdmin):
+    list_display = [
+        "id",
+        "date",
+        "event_id",
+        "person_id",
+        "state"
+    ]
+
+    list_filter = ["state"]
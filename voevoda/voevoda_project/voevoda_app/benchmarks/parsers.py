@@ -0,0 +1,158 @@
+"""Офлайн бенчмарк парсеров сайта ГВД по сохраненному корпусу страниц"""
+import json
+import logging
+import re
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, List, Union
+
+from .. import parser as parser_module
+from ..parser import ClansParser, PlayerParser
+
+CORPUS_DIR = Path(__file__).resolve().parent / "corpus"
+BASELINE_PATH = Path(__file__).resolve().parent / "parsers_baseline.json"
+
+# идентификатор клана, с которого сохранены страницы игроков и информации о клане
+CORPUS_CLAN_ID = 495
+
+# текст ячеек таблицы для калибровочной нагрузки
+CALIBRATION_PATTERN = re.compile(r"<td[^>]*>(.*?)</td>", re.S)
+
+
+def _count_rows(data: Union[list, str, None]) -> int:
+    """Сколько строк данных вернул парсер (для страницы клана - найден ли альянс)"""
+    if data is None:
+        return 0
+    if isinstance(data, list):
+        return len(data)
+    return 1
+
+
+def calibration_workload(html_data: str) -> int:
+    """Эталонная нагрузка, не зависящая от кода парсеров: поиск ячеек регуляркой и разбор их текста"""
+    words = 0
+    for match in CALIBRATION_PATTERN.finditer(html_data):
+        words += len(match.group(1).strip().lower().split())
+    return words
+
+
+class ParserBenchmark:
+    """Замер скорости парсеров на страницах из CORPUS_DIR.
+
+    Для каждой страницы считает страниц/сек, строк/сек, мкс на строку и пиковую память
+    одного разбора, а также сравнивает результат с сохраненным базовым замером.
+    Абсолютная скорость зависит от машины, поэтому сравнивается relative - скорость парсера
+    относительно калибровочной нагрузки calibration_workload, замеренной тем же запуском
+    """
+
+    calibration_page = "players_full.html"
+
+    cases = (
+        ("clans_list", "clans_list.html", lambda html: ClansParser.parse_clans_html(html_data=html)),
+        ("clan_info_alliance", "clan_info_alliance.html",
+         lambda html: ClansParser.parse_alliance_html(html_data=html, clan_id=CORPUS_CLAN_ID)),
+        ("clan_info_no_alliance", "clan_info_no_alliance.html",
+         lambda html: ClansParser.parse_alliance_html(html_data=html, clan_id=CORPUS_CLAN_ID)),
+        ("players_full", "players_full.html",
+         lambda html: PlayerParser().parse_page_html(html_data=html, clan_id=CORPUS_CLAN_ID)),
+        ("players_empty", "players_empty.html",
+         lambda html: PlayerParser().parse_page_html(html_data=html, clan_id=CORPUS_CLAN_ID)),
+    )
+
+    def __init__(self, repeat: int = 50, min_time: float = 0.2):
+        """
+        Args:
+            repeat: минимальное количество разборов каждой страницы
+            min_time: минимальное время замера одной страницы в секундах
+        """
+        self.repeat = repeat
+        self.min_time = min_time
+
+    @staticmethod
+    def load_page(file_name: str) -> str:
+        with open(CORPUS_DIR / file_name, encoding="utf-8") as file:
+            return file.read()
+
+    def measure(self, func: Callable, html_data: str) -> float:
+        """Сколько раз в секунду выполняется func(html_data)"""
+        passes = 0
+        start = time.perf_counter()
+        while passes < self.repeat or time.perf_counter() - start < self.min_time:
+            func(html_data)
+            passes += 1
+        return passes / (time.perf_counter() - start)
+
+    def calibrate(self) -> float:
+        """Скорость калибровочной нагрузки на этой машине (проходов/сек)"""
+        return self.measure(func=calibration_workload, html_data=self.load_page(file_name=self.calibration_page))
+
+    def run_case(self, name: str, file_name: str, parse: Callable, calibration: float) -> dict:
+        """Замер одного парсера на одной странице"""
+        html_data = self.load_page(file_name=file_name)
+
+        # пиковая память одного разбора, отдельно от замера времени (tracemalloc сильно замедляет код)
+        tracemalloc.start()
+        rows = _count_rows(parse(html_data))
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        pages_per_sec = self.measure(func=parse, html_data=html_data)
+        seconds = 1 / pages_per_sec
+
+        return {
+            "name": name,
+            "rows": rows,
+            "pages_per_sec": round(pages_per_sec, 1),
+            "relative": round(pages_per_sec / calibration, 4),
+            "rows_per_sec": round(pages_per_sec * rows, 1),
+            "us_per_page": round(seconds * 1e6, 1),
+            "us_per_row": round(seconds / rows * 1e6, 2) if rows else None,
+            "peak_memory_kb": round(peak_memory / 1024, 1),
+        }
+
+    def run(self) -> List[dict]:
+        # парсеры логируют каждую страницу, в замере это только мешает
+        parser_logger = logging.getLogger(parser_module.__name__)
+        level = parser_logger.level
+        parser_logger.setLevel(logging.WARNING)
+        try:
+            calibration = self.calibrate()
+            return [
+                self.run_case(name=name, file_name=file_name, parse=parse, calibration=calibration)
+                for name, file_name, parse in self.cases
+            ]
+        finally:
+            parser_logger.setLevel(level)
+
+    @staticmethod
+    def load_baseline(path: Path = BASELINE_PATH) -> dict:
+        try:
+            with open(path) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    @staticmethod
+    def save_baseline(results: List[dict], path: Path = BASELINE_PATH):
+        with open(path, "w") as file:
+            json.dump({result["name"]: result for result in results}, file, indent=4, ensure_ascii=False)
+            file.write("\n")
+
+    @staticmethod
+    def find_regressions(results: List[dict], baseline: dict, threshold: float) -> List[str]:
+        """Список парсеров, чья относительная пропускная способность (relative) упала больше чем
+        на threshold (доля) от базовой. Замеры без relative (старый формат) не сравниваются
+        """
+        regressions = []
+        for result in results:
+            base = baseline.get(result["name"])
+            if not base or not base.get("relative"):
+                continue
+            limit = base["relative"] * (1 - threshold)
+            if result["relative"] < limit:
+                regressions.append(
+                    f"{result['name']}: {result['relative']} от калибровки при базовых {base['relative']} "
+                    f"(допустимо не ниже {limit:.4f})"
+                )
+        return regressions
@@ -0,0 +1,191 @@
+"""Бенчмарк одновременного чтения API и записи перепарсинга в SQLite"""
+import json
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import List, Union
+
+from django.conf import settings
+
+from ..metrics import summarize
+
+SCHEMA = """
+CREATE TABLE players (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    clan_id INTEGER,
+    stats TEXT NOT NULL,
+    fingerprint TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX players_clan_id ON players (clan_id);
+"""
+
+UPSERT = """
+INSERT INTO players (id, name, level, clan_id, stats, fingerprint) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (id) DO UPDATE SET name = excluded.name, level = excluded.level, clan_id = excluded.clan_id,
+    stats = excluded.stats, fingerprint = excluded.fingerprint
+"""
+
+# границы корзин гистограмм времени чтения в секундах
+READ_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class SqliteBenchmark:
+    """Замер чтения и записи SQLite в профилях по умолчанию и production.
+
+    Писатели, как перепарсинг, upsert'ят пачки игроков одного клана транзакцией "прочитать отпечатки,
+    записать строки", а читатели, как PlayerView, выбирают игроков клана. Для каждого случая
+    считаются задержки чтения, ошибки "database is locked" и скорость записи
+    """
+
+    cases = (
+        ("default", False),
+        ("production", False),
+        ("production", True),
+    )
+
+    def __init__(self, duration: float = 5.0, readers: int = 4, writers: int = 2,
+                 clans: int = 200, clan_size: int = 100):
+        """
+        Args:
+            duration: длительность одного случая в секундах
+            readers: количество потоков чтения
+            writers: количество потоков записи
+            clans: количество кланов в тестовой таблице
+            clan_size: игроков в клане (размер одной транзакции записи)
+        """
+        self.duration = duration
+        self.readers = readers
+        self.writers = writers
+        self.clans = clans
+        self.clan_size = clan_size
+
+    @staticmethod
+    def get_profile(name: str) -> dict:
+        """Параметры соединения профиля: PRAGMA, режим начала транзакции и ожидание блокировки"""
+        if name == "production":
+            return {"pragmas": settings.SQLITE_PRAGMAS, "transaction_mode": "IMMEDIATE",
+                    "timeout": settings.SQLITE_TIMEOUT}
+        # значения, которые Django использует без OPTIONS
+        return {"pragmas": {}, "transaction_mode": "DEFERRED", "timeout": 5.0}
+
+    @staticmethod
+    def connect(path: Path, profile: dict) -> sqlite3.Connection:
+        conn = sqlite3.connect(path, timeout=profile["timeout"], isolation_level=None, check_same_thread=False)
+        for name, value in profile["pragmas"].items():
+            conn.execute(f"PRAGMA {name}={value}")
+        return conn
+
+    def make_rows(self, clan_id: int) -> list:
+        rows = []
+        for index in range(self.clan_size):
+            player_id = clan_id * self.clan_size + index
+            stats = json.dumps([random.randint(0, 15) for _ in range(22)])
+            rows.append((player_id, f"Игрок {player_id}", random.randint(1, 25), clan_id, stats, str(hash(stats))))
+        return rows
+
+    def create_db(self, path: Path):
+        conn = sqlite3.connect(path, isolation_level=None)
+        conn.executescript(SCHEMA)
+        conn.execute("BEGIN")
+        for clan_id in range(self.clans):
+            conn.executemany(UPSERT, self.make_rows(clan_id=clan_id))
+        conn.execute("COMMIT")
+        conn.close()
+
+    def write_clan(self, conn: sqlite3.Connection, profile: dict, clan_id: int) -> int:
+        """Одна транзакция записи состава клана, как PlayersLogic.upsert_players"""
+        rows = self.make_rows(clan_id=clan_id)
+        conn.execute(f"BEGIN {profile['transaction_mode']}")
+        try:
+            stored = dict(conn.execute("SELECT id, fingerprint FROM players WHERE clan_id = ?", (clan_id,)))
+            changed = [row for row in rows if stored.get(row[0]) != row[5]]
+            conn.executemany(UPSERT, changed)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return len(changed)
+
+    def run_case(self, profile_name: str, serialized: bool) -> dict:
+        """Замер одного случая на свежей копии БД"""
+        profile = self.get_profile(name=profile_name)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "bench.sqlite3"
+            self.create_db(path=path)
+            stop = threading.Event()
+            # с serialized писатели процесса выполняют транзакции по одной, как через DbWriter
+            writer_lock = threading.Lock() if serialized else None
+            read_latency: List[float] = []
+            counters = {"read_errors": 0, "write_errors": 0, "transactions": 0, "rows": 0}
+            counters_lock = threading.Lock()
+
+            def reader():
+                conn = self.connect(path=path, profile=profile)
+                latency = []
+                errors = 0
+                while not stop.is_set():
+                    start = time.perf_counter()
+                    try:
+                        conn.execute(
+                            "SELECT * FROM players WHERE clan_id = ?", (random.randrange(self.clans),)
+                        ).fetchall()
+                        latency.append(time.perf_counter() - start)
+                    except sqlite3.OperationalError:
+                        errors += 1
+                conn.close()
+                with counters_lock:
+                    read_latency.extend(latency)
+                    counters["read_errors"] += errors
+
+            def writer():
+                conn = self.connect(path=path, profile=profile)
+                done = {"write_errors": 0, "transactions": 0, "rows": 0}
+                while not stop.is_set():
+                    try:
+                        if writer_lock:
+                            with writer_lock:
+                                rows = self.write_clan(conn=conn, profile=profile, clan_id=random.randrange(self.clans))
+                        else:
+                            rows = self.write_clan(conn=conn, profile=profile, clan_id=random.randrange(self.clans))
+                        done["transactions"] += 1
+                        done["rows"] += rows
+                    except sqlite3.OperationalError:
+                        done["write_errors"] += 1
+                conn.close()
+                with counters_lock:
+                    for key, value in done.items():
+                        counters[key] += value
+
+            threads = [threading.Thread(target=reader) for _ in range(self.readers)]
+            threads += [threading.Thread(target=writer) for _ in range(self.writers)]
+            for thread in threads:
+                thread.start()
+            time.sleep(self.duration)
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        reads = summarize(read_latency, buckets=READ_BUCKETS)
+        return {
+            "name": f"{profile_name}{' + writer' if serialized else ''}",
+            "reads_per_sec": round(len(read_latency) / self.duration, 1),
+            "read_p50_ms": round(reads.get("p50", 0) * 1000, 2),
+            "read_p99_ms": round(reads.get("p99", 0) * 1000, 2),
+            "read_max_ms": round(reads.get("max", 0) * 1000, 2),
+            "read_errors": counters["read_errors"],
+            "write_tx_per_sec": round(counters["transactions"] / self.duration, 1),
+            "write_rows_per_sec": round(counters["rows"] / self.duration, 1),
+            "write_errors": counters["write_errors"],
+        }
+
+    def run(self, profiles: Union[List[str], None] = None) -> List[dict]:
+        return [
+            self.run_case(profile_name=profile_name, serialized=serialized)
+            for profile_name, serialized in self.cases
+            if profiles is None or profile_name in profiles
+        ]
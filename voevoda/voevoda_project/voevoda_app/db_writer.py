@@ -0,0 +1,59 @@
+"""Единственный поток записи в БД процесса"""
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Callable
+
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class DbWriter:
+    """Очередь записей в БД, которую выполняет один поток.
+
+    SQLite допускает только одного писателя: если записи из разных потоков процесса (конвейер перепарсинга,
+    прием страниц, сохранение альянсов) идут одновременно, они ждут друг друга на блокировке файла
+    и держат ее дольше. Через очередь записи выполняются по одной, короткими транзакциями,
+    а читатели API в режиме WAL работают параллельно с ними
+    """
+
+    def __init__(self, name: str = "db-writer"):
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        """Ставим запись в очередь. Результат или ошибка func придут в Future"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+        future = Future()
+        self._queue.put((future, func, args, kwargs))
+        return future
+
+    def call(self, func: Callable, *args, **kwargs):
+        """Выполняем запись в потоке писателя и ждем результата"""
+        if threading.current_thread() is self._thread:
+            # запись изнутри другой записи - выполняем сразу, иначе поток будет ждать сам себя
+            return func(*args, **kwargs)
+        return self.submit(func, *args, **kwargs).result()
+
+    def _run(self):
+        while True:
+            future, func, args, kwargs = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as _ex:
+                logger.error(f"Ошибка записи в БД {getattr(func, '__qualname__', func)} -> {_ex!r}")
+                future.set_exception(_ex)
+                # после ошибки соединение может быть в неисправном состоянии
+                connection.close_if_unusable_or_obsolete()
+
+
+db_writer = DbWriter()
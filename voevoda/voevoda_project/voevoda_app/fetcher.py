@@ -0,0 +1,199 @@
+"""Асинхронный движок загрузки страниц с сайта ГВД"""
+import asyncio
+import logging
+import random
+import time
+from typing import Callable, Dict, Union
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from .metrics import ReparseMetrics
+from .page_cache import PageCache, PageSchem
+
+logger = logging.getLogger(__name__)
+
+
+class FetchError(Exception):
+    """Страницу не удалось загрузить даже после всех повторных попыток"""
+
+
+class AdaptiveRateLimiter:
+    """Ограничитель частоты запросов к одному хосту.
+
+    Держит минимальный интервал между запросами и подстраивает его под ответы сервера:
+    каждый успешный ответ немного уменьшает интервал, а 429/5xx и таймауты увеличивают его вдвое
+    (или до значения из заголовка Retry-After).
+    """
+
+    def __init__(self, start_delay: float = 1.0, min_delay: float = 0.2, max_delay: float = 30.0,
+                 step: float = 0.05, jitter: float = 0.25):
+        self.delay = start_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.step = step
+        self.jitter = jitter
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        """Дожидаемся своей очереди на запрос"""
+        async with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.delay * (1 + random.uniform(0, self.jitter))
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def success(self):
+        """Сервер ответил нормально - можно ускоряться"""
+        self.delay = max(self.min_delay, self.delay - self.step)
+
+    def failure(self, retry_after: Union[float, None] = None):
+        """Сервер перегружен или ограничивает нас - замедляемся"""
+        if retry_after:
+            self.delay = min(self.max_delay, max(self.delay, retry_after))
+        else:
+            self.delay = min(self.max_delay, self.delay * 2)
+        self._next_slot = max(self._next_slot, time.monotonic() + self.delay)
+
+
+class AsyncFetcher:
+    """Асинхронный загрузчик страниц с общим и похостовым ограничением параллельности.
+
+    Используется как асинхронный контекстный менеджер:
+        async with AsyncFetcher() as fetcher:
+            html = await fetcher.fetch(url)
+
+    С переданным cache страницы сохраняются на диск и перезапрашиваются условно,
+    а с offline=True берутся только из кэша (повторное наполнение БД без обращения к сайту).
+    on_page вызывается после каждой полученной страницы (например для подсчета прогресса),
+    а в metrics записываются время, размер и код ответа каждого запроса.
+    """
+
+    retry_statuses = {429, 500, 502, 503, 504}
+
+    def __init__(self, headers: Union[dict, None] = None, max_concurrency: int = 8, max_per_host: int = 4,
+                 start_delay: float = 1.0, min_delay: float = 0.2, max_delay: float = 30.0,
+                 retries: int = 3, timeout: float = 30.0,
+                 cache: Union[PageCache, None] = None, offline: bool = False,
+                 on_page: Union[Callable[[PageSchem], None], None] = None,
+                 metrics: Union[ReparseMetrics, None] = None):
+        self.headers = headers or {}
+        self.max_concurrency = max_concurrency
+        self.max_per_host = max_per_host
+        self.limiter_params = {"start_delay": start_delay, "min_delay": min_delay, "max_delay": max_delay}
+        self.retries = retries
+        self.timeout = timeout
+        self.cache = cache
+        self.offline = offline
+        self.on_page = on_page
+        self.metrics = metrics
+        self.session: Union[aiohttp.ClientSession, None] = None
+        self._global_semaphore = asyncio.Semaphore(max_concurrency)
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._host_limiters: Dict[str, AdaptiveRateLimiter] = {}
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency, limit_per_host=self.max_per_host),
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+
+    def record(self, latency: float, status: Union[int, str], size: int = 0):
+        if self.metrics:
+            self.metrics.record_request(latency=latency, status=status, size=size)
+
+    def get_limiter(self, host: str) -> AdaptiveRateLimiter:
+        """Ограничитель частоты запросов для хоста"""
+        if host not in self._host_limiters:
+            self._host_limiters[host] = AdaptiveRateLimiter(**self.limiter_params)
+        return self._host_limiters[host]
+
+    def get_host_semaphore(self, host: str) -> asyncio.Semaphore:
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.max_per_host)
+        return self._host_semaphores[host]
+
+    async def fetch(self, url: str, binary: bool = False) -> Union[str, bytes]:
+        """Загружаем страницу по URL
+        Args:
+            url: адрес страницы
+            binary: вернуть сырые байты (например для картинок) вместо текста. Такие ответы не кэшируются
+        """
+        page = await self.fetch_page(url=url, use_cache=not binary)
+        return page.body if binary else page.text
+
+    async def fetch_page(self, url: str, use_cache: bool = True) -> PageSchem:
+        """Загружаем страницу с учетом дискового кэша.
+        Если страница есть в кэше, запрос делается условным (If-None-Match/If-Modified-Since),
+        и при ответе 304 тело берется из кэша. В режиме offline сеть не используется совсем
+        """
+        page = await self._fetch_page(url=url, use_cache=use_cache)
+        if self.on_page:
+            self.on_page(page)
+        return page
+
+    async def _fetch_page(self, url: str, use_cache: bool = True) -> PageSchem:
+        # кэш читает и пишет файлы - делаем это в потоке, чтобы не останавливать цикл событий
+        cache = self.cache if use_cache else None
+        if self.offline:
+            page = await asyncio.to_thread(self.cache.load, url=url, changed=True) if self.cache else None
+            if page is None:
+                raise FetchError(f"Страницы по URL: {url} нет в кэше")
+            self.record(latency=0.0, status="cache", size=len(page.body))
+            return page
+
+        host = urlsplit(url).netloc
+        limiter = self.get_limiter(host)
+        headers = await asyncio.to_thread(cache.conditional_headers, url=url) if cache else {}
+        for attempt in range(1, self.retries + 1):
+            async with self._global_semaphore, self.get_host_semaphore(host):
+                await limiter.wait()
+                start = time.monotonic()
+                try:
+                    logger.debug(f"Запрашиваю данные по URL: {url} (попытка {attempt})")
+                    async with self.session.get(url, headers=headers, allow_redirects=True) as response:
+                        if not 200 <= response.status < 300:
+                            # ответы без тела, тело успешного ответа учитывается после чтения
+                            self.record(latency=time.monotonic() - start, status=response.status)
+                        if response.status in self.retry_statuses:
+                            retry_after = response.headers.get("Retry-After")
+                            limiter.failure(float(retry_after) if retry_after and retry_after.isdigit() else None)
+                            logger.warning(f"URL: {url} ответил {response.status}, замедляюсь до {limiter.delay:.2f} сек")
+                            continue
+                        if response.status == 304 and cache:
+                            limiter.success()
+                            page = await asyncio.to_thread(cache.load, url=url, changed=False)
+                            if page is not None:
+                                await asyncio.to_thread(cache.touch, url=url)
+                                logger.debug(f"Данные по URL: {url} не изменились")
+                                return page
+                            # тело пропало из кэша - повторяем запрос безусловно
+                            headers = {}
+                            continue
+                        if response.status >= 400:
+                            raise FetchError(f"URL: {url} ответил {response.status}")
+                        body = await response.read()
+                        self.record(latency=time.monotonic() - start, status=response.status, size=len(body))
+                        encoding = response.get_encoding()
+                        limiter.success()
+                        logger.debug(f"Данные по URL: {url} -> пришли")
+                except (aiohttp.ClientError, asyncio.TimeoutError) as _ex:
+                    self.record(latency=time.monotonic() - start, status="error")
+                    limiter.failure()
+                    logger.warning(f"Ошибка при запросе URL: {url} (попытка {attempt}) -> {_ex!r}")
+                    continue
+            changed = True
+            if cache:
+                changed = await asyncio.to_thread(
+                    cache.store, url=url, body=body, encoding=encoding,
+                    etag=response.headers.get("ETag"), last_modified=response.headers.get("Last-Modified"),
+                )
+            return PageSchem(url=url, body=body, encoding=encoding, changed=changed)
+        raise FetchError(f"Не удалось загрузить URL: {url} за {self.retries} попыток")
@@ -0,0 +1,27 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from voevoda_app.servises import ArchiveLogic
+
+
+class Command(BaseCommand):
+    help = "Перенос завершенных ивентов с приглашениями и старых боев в архивные таблицы"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--age-days", type=int, default=None,
+            help="Переносить записи старше указанного числа дней (по умолчанию PARSER_SETTINGS['ARCHIVE_AGE_DAYS'])"
+        )
+        parser.add_argument("--batch-size", type=int, default=ArchiveLogic.batch_size,
+                            help="Сколько записей переносить одной транзакцией")
+
+    def handle(self, *args, **options):
+        cutoff = None
+        if options["age_days"] is not None:
+            cutoff = timezone.now() - datetime.timedelta(days=options["age_days"])
+        result = ArchiveLogic.archive(cutoff=cutoff, batch_size=options["batch_size"])
+        self.stdout.write(
+            f"Перенесено в архив: ивентов {result['events']}, приглашений {result['invites']}, боев {result['fights']}"
+        )
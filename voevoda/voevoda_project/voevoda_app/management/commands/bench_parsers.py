@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from voevoda_app.benchmarks.parsers import ParserBenchmark
+
+
+class Command(BaseCommand):
+    help = "Офлайн бенчмарк парсеров по сохраненному корпусу страниц сайта ГВД"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=50, help="Минимальное количество разборов каждой страницы")
+        parser.add_argument(
+            "--check", action="store_true",
+            help="Сравнить с базовым замером и завершиться ошибкой при падении производительности"
+        )
+        parser.add_argument(
+            "--threshold", type=float, default=0.25,
+            help="Допустимое падение скорости относительно калибровки по сравнению с базовым замером (доля)"
+        )
+        parser.add_argument("--update-baseline", action="store_true", help="Сохранить результаты как базовый замер")
+
+    def handle(self, *args, **options):
+        benchmark = ParserBenchmark(repeat=options["repeat"])
+        results = benchmark.run()
+
+        header = (f"{'парсер':<24}{'строк':>7}{'стр/сек':>12}{'к калибр.':>12}{'строк/сек':>12}"
+                  f"{'мкс/строку':>12}{'память, КБ':>12}")
+        self.stdout.write(header)
+        for result in results:
+            self.stdout.write(
+                f"{result['name']:<24}{result['rows']:>7}{result['pages_per_sec']:>12}{result['relative']:>12}"
+                f"{result['rows_per_sec']:>12}"
+                f"{result['us_per_row'] if result['us_per_row'] is not None else '-':>12}{result['peak_memory_kb']:>12}"
+            )
+
+        if options["update_baseline"]:
+            benchmark.save_baseline(results=results)
+            self.stdout.write(self.style.SUCCESS("Базовый замер обновлен"))
+            return
+        if not options["check"]:
+            return
+
+        regressions = benchmark.find_regressions(
+            results=results, baseline=benchmark.load_baseline(), threshold=options["threshold"]
+        )
+        if regressions:
+            raise CommandError("Падение производительности парсеров:\n" + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS("Регрессий производительности нет"))
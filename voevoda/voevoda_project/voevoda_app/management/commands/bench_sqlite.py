@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from voevoda_app.benchmarks.sqlite import SqliteBenchmark
+
+
+class Command(BaseCommand):
+    help = "Бенчмарк одновременного чтения и записи SQLite в профилях default и production"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--duration", type=float, default=5.0, help="Длительность одного случая в секундах")
+        parser.add_argument("--readers", type=int, default=4, help="Количество потоков чтения")
+        parser.add_argument("--writers", type=int, default=2, help="Количество потоков записи")
+
+    def handle(self, *args, **options):
+        benchmark = SqliteBenchmark(
+            duration=options["duration"], readers=options["readers"], writers=options["writers"]
+        )
+        header = (
+            f"{'профиль':<22}{'чтений/сек':>12}{'p50, мс':>10}{'p99, мс':>10}{'max, мс':>10}{'ошибок':>8}"
+            f"{'записей/сек':>13}{'строк/сек':>12}{'ошибок':>8}"
+        )
+        self.stdout.write(header)
+        for result in benchmark.run():
+            self.stdout.write(
+                f"{result['name']:<22}{result['reads_per_sec']:>12}{result['read_p50_ms']:>10}"
+                f"{result['read_p99_ms']:>10}{result['read_max_ms']:>10}{result['read_errors']:>8}"
+                f"{result['write_tx_per_sec']:>13}{result['write_rows_per_sec']:>12}{result['write_errors']:>8}"
+            )
@@ -0,0 +1,27 @@
+import csv
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from voevoda_app.servises import FightsImportLogic
+
+
+class Command(BaseCommand):
+    help = "Загрузка истории боев воеводы из файла CSV или JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("voevoda_id", type=int, help="ID воеводы")
+        parser.add_argument("path", type=Path, help="Файл с боями (.csv или .json)")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        try:
+            rows = FightsImportLogic.read_file(name=path.name, content=path.read_bytes())
+            data = FightsImportLogic.import_fights(voevoda_id=options["voevoda_id"], rows=rows)
+        except (OSError, ValueError, csv.Error) as _ex:
+            raise CommandError(str(_ex))
+        for error in data["errors"]:
+            self.stderr.write(f"строка {error['row']}: {error['errors']}")
+        if data["errors"]:
+            raise CommandError(f"Бои не загружены: ошибок в {len(data['errors'])} строках")
+        self.stdout.write(f"Загружено боев: {data['created']}")
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from voevoda_app.servises import EmblemLogic
+
+
+class Command(BaseCommand):
+    help = "Скачать значки кланов в локальное зеркало (обычно это делается во время перепарсинга)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force", action="store_true",
+            help="Скачать заново значки всех кланов, даже уже сохраненные"
+        )
+
+    def handle(self, *args, **options):
+        count = EmblemLogic().mirror_emblems(force=options["force"])
+        self.stdout.write(f"Скачано значков: {count}")
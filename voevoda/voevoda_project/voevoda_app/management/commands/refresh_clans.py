@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from voevoda_app.servises import ClansRefreshLogic
+
+
+class Command(BaseCommand):
+    help = "Планировщик: обновлять устаревшие данные кланов по приоритету (противники ивентов, кланы воевод, альянсы)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true",
+            help="Выполнить один проход и завершиться (например для запуска из cron)"
+        )
+
+    def handle(self, *args, **options):
+        ClansRefreshLogic().run_scheduler(once=options["once"])
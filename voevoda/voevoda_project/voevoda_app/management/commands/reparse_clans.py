@@ -0,0 +1,37 @@
+import os
+import socket
+
+from django.core.management.base import BaseCommand, CommandError
+
+from voevoda_app.servises import ClansLogic, ReparseLock
+
+
+class Command(BaseCommand):
+    help = "Перепарсить данные всех кланов и их игроков с сайта ГВД"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--offline", action="store_true",
+            help="Заполнить БД только из кэша страниц, не обращаясь к сайту"
+        )
+        parser.add_argument(
+            "--restart", action="store_true",
+            help="Начать новый запуск, даже если предыдущий был прерван"
+        )
+        parser.add_argument(
+            "--retry-failed", action="store_true",
+            help="Повторить только кланы, завершившиеся ошибкой в последнем запуске"
+        )
+
+    def handle(self, *args, **options):
+        # та же блокировка, что у фоновой задачи API и очереди воркеров
+        owner = f"cli:{socket.gethostname()}:{os.getpid()}"
+        lock = ReparseLock()
+        active = lock.acquire(owner=owner)
+        if active:
+            raise CommandError(f"Перепарсинг уже выполняется: {active}")
+        with lock.hold(owner=owner):
+            data = ClansLogic().reparse_clan_data(
+                offline=options["offline"], resume=not options["restart"], retry_failed=options["retry_failed"]
+            )
+        self.stdout.write(str(data["data"]))
@@ -0,0 +1,61 @@
+import multiprocessing
+import socket
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from voevoda_app.servises import ReparseQueueLogic
+
+
+def run_worker(worker_id: str, workers: int):
+    ReparseQueueLogic(worker_id=worker_id, workers=workers).run_worker()
+
+
+class Command(BaseCommand):
+    help = "Запустить воркеры, разбирающие очередь перепарсинга кланов (можно на нескольких машинах)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=1,
+            help="Количество процессов-воркеров на этой машине (лимиты загрузки из настроек делятся между ними)"
+        )
+        parser.add_argument(
+            "--enqueue", action="store_true",
+            help="Перед запуском воркеров поставить в очередь новый запуск перепарсинга"
+        )
+        parser.add_argument(
+            "--offline", action="store_true",
+            help="Заполнить БД только из кэша страниц, не обращаясь к сайту (вместе с --enqueue)"
+        )
+        parser.add_argument(
+            "--restart", action="store_true",
+            help="Начать новый запуск, даже если предыдущий был прерван (вместе с --enqueue)"
+        )
+        parser.add_argument(
+            "--retry-failed", action="store_true",
+            help="Повторить только кланы, завершившиеся ошибкой в последнем запуске (вместе с --enqueue)"
+        )
+
+    def handle(self, *args, **options):
+        queue = ReparseQueueLogic()
+        if options["enqueue"]:
+            queue.enqueue_run(
+                offline=options["offline"], resume=not options["restart"], retry_failed=options["retry_failed"]
+            )
+        self.stdout.write(f"Очередь перепарсинга: {queue.get_queue_state()}")
+
+        # соединения с БД нельзя разделять между процессами - каждый воркер откроет свое
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        host = socket.gethostname()
+        workers = [
+            context.Process(
+                target=run_worker, args=(f"{host}-{i}", options["workers"]), name=f"reparse-worker-{i}"
+            )
+            for i in range(options["workers"])
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.stdout.write(f"Очередь перепарсинга: {queue.get_queue_state()}")
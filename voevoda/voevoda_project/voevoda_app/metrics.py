@@ -0,0 +1,131 @@
+"""Замеры запуска перепарсинга: сеть, разбор страниц и запись в БД"""
+import math
+import threading
+import time
+from collections import Counter
+from typing import List, Union
+
+# границы корзин гистограмм времени в секундах
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def summarize(samples: List[float], buckets: tuple = LATENCY_BUCKETS) -> dict:
+    """Перцентили и гистограмма по списку замеров времени"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def percentile(share: float) -> float:
+        # метод ближайшего ранга
+        return round(ordered[max(0, math.ceil(share * len(ordered)) - 1)], 4)
+
+    histogram = {}
+    index = 0
+    for bound in buckets:
+        count = 0
+        while index < len(ordered) and ordered[index] <= bound:
+            count += 1
+            index += 1
+        histogram[f"<={bound}"] = count
+    histogram[f">{buckets[-1]}"] = len(ordered) - index
+    return {
+        "count": len(ordered),
+        "total": round(sum(ordered), 4),
+        "mean": round(sum(ordered) / len(ordered), 4),
+        "p50": percentile(0.5),
+        "p90": percentile(0.9),
+        "p99": percentile(0.99),
+        "max": round(ordered[-1], 4),
+        "histogram": histogram,
+    }
+
+
+class ReparseMetrics:
+    """Сборщик замеров одного запуска перепарсинга.
+
+    Загрузчик сообщает о каждом HTTP запросе, конвейер - о разборе страниц и записи в БД.
+    report() сводит все в JSON отчет с перцентилями и показывает, во что упирается перепарсинг:
+    у какой стадии выше загрузка (занятое время / (время запуска * число параллельных слотов стадии))
+    """
+
+    def __init__(self, network_slots: int = 1, cpu_slots: int = 1):
+        """
+        Args:
+            network_slots: сколько запросов может выполняться одновременно
+            cpu_slots: сколько страниц может разбираться одновременно
+        """
+        self.slots = {"network": max(network_slots, 1), "cpu": max(cpu_slots, 1), "db": 1}
+        self.started = time.monotonic()
+        self.finished: Union[float, None] = None
+        self.request_latency: List[float] = []
+        self.request_bytes = 0
+        self.statuses = Counter()
+        self.parse_time: List[float] = []
+        self.parse_rows = 0
+        self.write_time: List[float] = []
+        self.rows = Counter()
+        self._lock = threading.Lock()
+
+    def record_request(self, latency: float, status: Union[int, str], size: int = 0):
+        """HTTP запрос. status - код ответа, "error" для сетевой ошибки или "cache" для офлайн режима"""
+        with self._lock:
+            self.request_latency.append(latency)
+            self.request_bytes += size
+            self.statuses[str(status)] += 1
+
+    def record_parse(self, seconds: float, rows: int):
+        with self._lock:
+            self.parse_time.append(seconds)
+            self.parse_rows += rows
+
+    def record_write(self, seconds: float, changed: int = 0, unchanged: int = 0):
+        """Запись в БД: changed - записанные игроки, unchanged - пропущенные по совпавшему отпечатку"""
+        with self._lock:
+            self.write_time.append(seconds)
+            self.rows["changed"] += changed
+            self.rows["unchanged"] += unchanged
+
+    def record_rows(self, unchanged: int = 0, detached: int = 0):
+        """Игроки, которых не пришлось записывать (страницы не изменились), и открепленные от кланов"""
+        with self._lock:
+            self.rows["unchanged"] += unchanged
+            self.rows["detached"] += detached
+
+    def finish(self):
+        self.finished = time.monotonic()
+
+    def report(self) -> dict:
+        with self._lock:
+            elapsed = (self.finished or time.monotonic()) - self.started
+            network = summarize(self.request_latency)
+            parse = summarize(self.parse_time)
+            write = summarize(self.write_time)
+            busy = {
+                "network": network.get("total", 0.0),
+                "cpu": parse.get("total", 0.0),
+                "db": write.get("total", 0.0),
+            }
+            utilization = {
+                name: round(seconds / (elapsed * self.slots[name]), 3) if elapsed else 0.0
+                for name, seconds in busy.items()
+            }
+            return {
+                "elapsed_sec": round(elapsed, 3),
+                "requests": {
+                    "count": len(self.request_latency),
+                    "bytes": self.request_bytes,
+                    "status": dict(self.statuses),
+                    "latency": network,
+                },
+                "parse": {"pages": len(self.parse_time), "rows": self.parse_rows, "time": parse},
+                "db": {
+                    "writes": len(self.write_time),
+                    "changed": self.rows["changed"],
+                    "unchanged": self.rows["unchanged"],
+                    "detached": self.rows["detached"],
+                    "time": write,
+                },
+                "busy_sec": {name: round(seconds, 3) for name, seconds in busy.items()},
+                "utilization": utilization,
+                "bound": max(utilization, key=utilization.get) if any(busy.values()) else None,
+            }
@@ -0,0 +1,63 @@
+# Generated by Django 5.1.1 on 2026-10-18 07:06
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voevoda_app', '0011_alter_fighteventmodel_state_invitemodel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReparseRunModel',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Начало')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Окончание')),
+                ('state', models.IntegerField(choices=[(1, 'Выполняется'), (2, 'Завершен'), (3, 'Завершен с ошибками')], default=1, verbose_name='Состояние')),
+                ('offline', models.BooleanField(default=False, verbose_name='Из кэша страниц')),
+            ],
+            options={
+                'verbose_name_plural': 'Запуски перепарсинга',
+            },
+        ),
+        migrations.AlterField(
+            model_name='invitemodel',
+            name='state',
+            field=models.IntegerField(choices=[(1, 'Отправлено'), (2, 'Принято'), (3, 'Отказ'), (4, 'Выбран на бой')], default=1),
+        ),
+        migrations.AlterField(
+            model_name='personsmodel',
+            name='telegram_username',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='voevodamodel',
+            name='name',
+            field=models.CharField(max_length=50, unique=True, verbose_name='Имя'),
+        ),
+        migrations.AlterField(
+            model_name='voevodamodel',
+            name='telegram_username',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+        migrations.CreateModel(
+            name='ReparseCheckpointModel',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('state', models.IntegerField(choices=[(0, 'Ожидает'), (1, 'Загружается'), (2, 'Разобран'), (3, 'Сохранен'), (4, 'Ошибка')], default=0, verbose_name='Состояние')),
+                ('error', models.TextField(blank=True, null=True, verbose_name='Ошибка')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлен')),
+                ('clan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='voevoda_app.clansmodel', verbose_name='Клан')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='voevoda_app.reparserunmodel', verbose_name='Запуск')),
+            ],
+            options={
+                'verbose_name_plural': 'Чекпоинты перепарсинга',
+                'unique_together': {('run', 'clan')},
+            },
+        ),
+    ]
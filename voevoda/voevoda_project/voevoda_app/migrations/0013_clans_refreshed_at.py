@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 07:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voevoda_app', '0012_reparse_checkpoints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clansmodel',
+            name='refreshed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Данные обновлены'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-18 07:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voevoda_app', '0013_clans_refreshed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clansmodel',
+            name='emblem',
+            field=models.CharField(blank=True, max_length=80, null=True, verbose_name='Локальный значек'),
+        ),
+        migrations.AddField(
+            model_name='clansmodel',
+            name='emblem_url',
+            field=models.CharField(blank=True, max_length=50, null=True, verbose_name='Адрес скачанного значка'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 07:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voevoda_app', '0014_clans_emblem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reparserunmodel',
+            name='report',
+            field=models.JSONField(blank=True, null=True, verbose_name='Отчет'),
+        ),
+    ]
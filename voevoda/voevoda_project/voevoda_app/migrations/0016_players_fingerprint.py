@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 07:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voevoda_app', '0015_reparse_run_report'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playersmodel',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', max_length=32, verbose_name='Отпечаток данных'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.1 on 2026-10-18 07:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voevoda_app', '0016_players_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fighteventmodel',
+            index=models.Index(fields=['voevoda_id', 'state'], name='events_voevoda_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fightsmodel',
+            index=models.Index(fields=['voevoda_id', 'date'], name='fights_voevoda_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invitemodel',
+            index=models.Index(fields=['event_id', 'state'], name='invites_event_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='personpresetmodel',
+            index=models.Index(fields=['person_id', 'preset_id'], name='person_preset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='personsmodel',
+            index=models.Index(fields=['player_id', 'voevoda_id'], name='persons_player_voevoda_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='personsmodel',
+            index=models.Index(fields=['voevoda_id', 'activity'], name='persons_voevoda_activity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='personsmodel',
+            index=models.Index(fields=['telegram_id'], name='persons_telegram_id_idx'),
+        ),
+    ]
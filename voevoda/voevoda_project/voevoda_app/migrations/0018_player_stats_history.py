@@ -0,0 +1,28 @@
+# Generated by Django 5.1.1 on 2026-10-18 07:33
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voevoda_app', '0017_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerStatsHistoryModel',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('date', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата')),
+                ('changes', models.JSONField(verbose_name='Изменения')),
+                ('player', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='voevoda_app.playersmodel', verbose_name='Персонаж')),
+            ],
+            options={
+                'verbose_name_plural': 'История характеристик персонажей',
+                'indexes': [models.Index(fields=['player', 'date'], name='stats_history_player_date_idx')],
+            },
+        ),
+    ]
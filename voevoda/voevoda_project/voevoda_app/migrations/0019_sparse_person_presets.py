@@ -0,0 +1,31 @@
+# Generated by Django 5.1.1 on 2026-10-18 07:35
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def prune_default_rows(apps, schema_editor):
+    """Удаляем строки со значением по умолчанию и дубли пар (игрок, пресет)"""
+    PersonPresetModel = apps.get_model("voevoda_app", "PersonPresetModel")
+    PersonPresetModel.objects.filter(play_preset=False).delete()
+    keep_ids = PersonPresetModel.objects.values("person_id", "preset_id").annotate(keep_id=Max("id")).values("keep_id")
+    PersonPresetModel.objects.exclude(id__in=keep_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voevoda_app', '0018_player_stats_history'),
+    ]
+
+    operations = [
+        migrations.RunPython(prune_default_rows, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='personpresetmodel',
+            name='person_preset_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='personpresetmodel',
+            constraint=models.UniqueConstraint(fields=('person_id', 'preset_id'), name='person_preset_unique'),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.1.1 on 2026-10-18 07:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voevoda_app', '0019_sparse_person_presets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FightEventArchiveModel',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('date', models.DateTimeField(verbose_name='Дата')),
+                ('name', models.CharField(max_length=50, verbose_name='Название')),
+                ('type', models.IntegerField(choices=[(1, 'Атака'), (2, 'Защита')], default=1, verbose_name='Тип боя')),
+                ('state', models.IntegerField(choices=[(1, 'Первоначальный сбор'), (2, 'Выбор бойцов'), (3, 'Идет бой'), (4, 'Завершен')], default=4)),
+                ('enemy', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='voevoda_app.clansmodel', verbose_name='Противник')),
+                ('voevoda_id', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='voevoda_app.voevodamodel', verbose_name='Воевода')),
+            ],
+            options={
+                'verbose_name_plural': 'Архив ивентов',
+            },
+        ),
+        migrations.CreateModel(
+            name='FightsArchiveModel',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=50, verbose_name='Название')),
+                ('type', models.IntegerField(choices=[(1, 'Атака'), (2, 'Защита')], default=1, verbose_name='Тип боя')),
+                ('date', models.DateTimeField(verbose_name='Дата')),
+                ('result', models.IntegerField(choices=[(1, 'Победа стороны атаки'), (2, 'Победа стороны защиты')], verbose_name='Результат')),
+                ('description', models.TextField(verbose_name='Комментарий')),
+                ('attack_1_pers', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='voevoda_app.playersmodel', verbose_name='1-й игрок атаки')),
+                ('attack_1_pers_preset', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='voevoda_app.presetsmodel', verbose_name='пресет 1-го игрока атаки')),
+                ('attack_2_pers', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='voevoda_app.playersmodel', verbose_name='2-й игрок атаки')),
+                ('attack_2_pers_preset', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='voevoda_app.presetsmodel', verbose_name='пресет 2-го игрока атаки')),
+                ('defence_1_pers', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='voevoda_app.playersmodel', verbose_name='1-й игрок защиты')),
+                ('defence_1_pers_preset', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='voevoda_app.presetsmodel', verbose_name='пресет 1-го игрока защиты')),
+                ('defence_2_pers', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='voevoda_app.playersmodel', verbose_name='2-й игрок защиты')),
+                ('defence_2_pers_preset', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='voevoda_app.presetsmodel', verbose_name='пресет 2-го игрока защиты')),
+                ('voevoda_id', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='voevoda_app.voevodamodel', verbose_name='Воевода')),
+            ],
+            options={
+                'verbose_name_plural': 'Архив битв',
+            },
+        ),
+        migrations.CreateModel(
+            name='InviteArchiveModel',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('date', models.DateTimeField(verbose_name='Дата')),
+                ('state', models.IntegerField(choices=[(1, 'Отправлено'), (2, 'Принято'), (3, 'Отказ'), (4, 'Выбран на бой')], default=1)),
+                ('event_id', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='invites', to='voevoda_app.fighteventarchivemodel', verbose_name='Ивент')),
+                ('person_id', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='voevoda_app.personsmodel', verbose_name='Игрок')),
+            ],
+            options={
+                'verbose_name_plural': 'Архив приглашений на ивент',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='fighteventarchivemodel',
+            index=models.Index(fields=['voevoda_id', 'date'], name='events_arch_voevoda_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fightsarchivemodel',
+            index=models.Index(fields=['voevoda_id', 'date'], name='fights_arch_voevoda_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invitearchivemodel',
+            index=models.Index(fields=['event_id', 'state'], name='invites_arch_event_state_idx'),
+        ),
+    ]
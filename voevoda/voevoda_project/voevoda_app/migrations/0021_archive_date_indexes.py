@@ -0,0 +1,21 @@
+# Generated by Django 5.1.1 on 2026-10-18 07:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voevoda_app', '0020_archive_tables'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fighteventarchivemodel',
+            index=models.Index(fields=['date'], name='events_arch_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fightsarchivemodel',
+            index=models.Index(fields=['date'], name='fights_arch_date_idx'),
+        ),
+    ]
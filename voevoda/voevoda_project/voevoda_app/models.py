@@ -10,6 +10,10 @@ class ClansModel(models.Model):
     name = models.CharField(max_length=50, verbose_name="Название")
     label = models.CharField(verbose_name="Значек", max_length=50)
     alliance = models.ForeignKey("ClansModel", null=True, blank=True, on_delete=models.SET_NULL, verbose_name="Альянс")
+    refreshed_at = models.DateTimeField(null=True, blank=True, verbose_name="Данные обновлены")
+    # локальная копия значка: имя файла в PARSER_SETTINGS["EMBLEMS_DIR"] и адрес, с которого он скачан
+    emblem = models.CharField(max_length=80, null=True, blank=True, verbose_name="Локальный значек")
+    emblem_url = models.CharField(max_length=50, null=True, blank=True, verbose_name="Адрес скачанного значка")
 
     def __str__(self):
         return f"№{self.id} - {self.name}"
@@ -25,6 +29,7 @@ class PlayersModel(models.Model):
     level = models.IntegerField(default=1, verbose_name="Уровень")
     clan = models.ForeignKey("ClansModel", null=True, blank=True, on_delete=models.SET_NULL, verbose_name="Клан")
 
+    # поля умений и гильдий заполняются парсером по таблице колонок PLAYER_COLUMNS (parser.py)
     umka_knight = models.IntegerField(default=1, verbose_name="Рыцарь")
     umka_necro = models.IntegerField(default=1, verbose_name="Некромант")
     umka_mag = models.IntegerField(default=1, verbose_name="Маг")
@@ -48,6 +53,8 @@ class PlayersModel(models.Model):
     gild_leader = models.IntegerField(default=1, verbose_name="Гильдия Лидеров")
     gild_blacksmith = models.IntegerField(default=1, verbose_name="Гильдия Кузнецов")
     gild_gunsmith = models.IntegerField(default=1, verbose_name="Гильдия Оружейников")
+    # хэш всех разобранных полей игрока: при перепарсинге пишутся только строки с изменившимся хэшем
+    fingerprint = models.CharField(max_length=32, blank=True, default="", verbose_name="Отпечаток данных")
 
     def __str__(self):
         return f"№{self.id} - {self.name}"
@@ -56,6 +63,27 @@ class PlayersModel(models.Model):
         verbose_name_plural = "Персонажи"
 
 
+class PlayerStatsHistoryModel(models.Model):
+    """История характеристик персонажей: при перепарсинге добавляется строка только с изменившимися полями.
+    Первая строка персонажа содержит все поля, по остальным состояние на любую дату восстанавливается
+    последовательным применением изменений
+    """
+    id = models.BigAutoField(primary_key=True)
+    player = models.ForeignKey("PlayersModel", on_delete=models.CASCADE, db_index=False, verbose_name="Персонаж")
+    date = models.DateTimeField(default=timezone.now, verbose_name="Дата")
+    # {поле: новое значение} - ник, уровень, клан и поля умений и гильдий
+    changes = models.JSONField(verbose_name="Изменения")
+
+    def __str__(self):
+        return f"{self.player_id} - {self.date}"
+
+    class Meta:
+        verbose_name_plural = "История характеристик персонажей"
+        indexes = [
+            models.Index(fields=["player", "date"], name="stats_history_player_date_idx"),
+        ]
+
+
 class VoevodaModel(models.Model):
     """Класс отвечающий за данные самого воеводы, который является админом для своего клана"""
     id = models.AutoField(primary_key=True)
@@ -96,6 +124,13 @@ class PersonsModel(models.Model):
 
     class Meta:
         verbose_name_plural = "Игроки"
+        indexes = [
+            # игрок под воеводой (serialize_one_player_data) и активные игроки воеводы
+            models.Index(fields=["player_id", "voevoda_id"], name="persons_player_voevoda_idx"),
+            models.Index(fields=["voevoda_id", "activity"], name="persons_voevoda_activity_idx"),
+            # поиск игрока ботом по аккаунту телеграм
+            models.Index(fields=["telegram_id"], name="persons_telegram_id_idx"),
+        ]
 
 
 class PresetsModel(models.Model):
@@ -128,7 +163,9 @@ class PresetsModel(models.Model):
 
 
 class PersonPresetModel(models.Model):
-    """Данные о том, играет ли живой за пресет или нет"""
+    """Данные о том, играет ли живой за пресет или нет.
+    Хранятся только строки с play_preset=True, отсутствие строки означает значение по умолчанию
+    """
     id = models.AutoField(primary_key=True)
     person_id = models.ForeignKey("PersonsModel", null=True, blank=True, on_delete=models.CASCADE,
                                   verbose_name="Игрок")
@@ -138,6 +175,9 @@ class PersonPresetModel(models.Model):
 
     class Meta:
         verbose_name_plural = "Пресеты игроков"
+        constraints = [
+            models.UniqueConstraint(fields=["person_id", "preset_id"], name="person_preset_unique"),
+        ]
 
 
 class FightsModel(models.Model):
@@ -180,6 +220,9 @@ class FightsModel(models.Model):
 
     class Meta:
         verbose_name_plural = "Битвы"
+        indexes = [
+            models.Index(fields=["voevoda_id", "date"], name="fights_voevoda_date_idx"),
+        ]
 
 
 class FightEventModel(models.Model):
@@ -210,6 +253,9 @@ class FightEventModel(models.Model):
 
     class Meta:
         verbose_name_plural = "Боевые Ивенты"
+        indexes = [
+            models.Index(fields=["voevoda_id", "state"], name="events_voevoda_state_idx"),
+        ]
 
 
 class InviteModel(models.Model):
@@ -233,4 +279,135 @@ class InviteModel(models.Model):
         return f"{self.event_id} - {self.person_id}"
 
     class Meta:
-        verbose_name_plural = "Приглашение на ивент"
\ No newline at end of file
+        verbose_name_plural = "Приглашение на ивент"
+        indexes = [
+            models.Index(fields=["event_id", "state"], name="invites_event_state_idx"),
+        ]
+
+class ReparseRunModel(models.Model):
+    """Запуск полного перепарсинга кланов"""
+    STATE_CHOICES = [
+        (1, "Выполняется"),
+        (2, "Завершен"),
+        (3, "Завершен с ошибками"),
+    ]
+
+    id = models.AutoField(primary_key=True)
+    started_at = models.DateTimeField(default=timezone.now, verbose_name="Начало")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Окончание")
+    state = models.IntegerField(choices=STATE_CHOICES, default=1, verbose_name="Состояние")
+    offline = models.BooleanField(default=False, verbose_name="Из кэша страниц")
+    report = models.JSONField(null=True, blank=True, verbose_name="Отчет")
+
+    def __str__(self):
+        return f"№{self.id} - {self.started_at}"
+
+    class Meta:
+        verbose_name_plural = "Запуски перепарсинга"
+
+
+class ReparseCheckpointModel(models.Model):
+    """Состояние обработки одного клана в рамках запуска перепарсинга"""
+    STATE_CHOICES = [
+        (0, "Ожидает"),
+        (1, "Загружается"),
+        (2, "Разобран"),
+        (3, "Сохранен"),
+        (4, "Ошибка"),
+    ]
+
+    id = models.AutoField(primary_key=True)
+    run = models.ForeignKey("ReparseRunModel", on_delete=models.CASCADE, related_name="checkpoints",
+                            verbose_name="Запуск")
+    clan = models.ForeignKey("ClansModel", on_delete=models.CASCADE, verbose_name="Клан")
+    state = models.IntegerField(choices=STATE_CHOICES, default=0, verbose_name="Состояние")
+    error = models.TextField(null=True, blank=True, verbose_name="Ошибка")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Обновлен")
+
+    def __str__(self):
+        return f"{self.run} - {self.clan_id} - {self.state}"
+
+    class Meta:
+        verbose_name_plural = "Чекпоинты перепарсинга"
+        unique_together = ["run", "clan"]
+
+
+class FightsArchiveModel(models.Model):
+    """Архив старых боев. Поля и ID как у FightsModel"""
+    id = models.IntegerField(primary_key=True)
+    name = models.CharField(max_length=50, verbose_name="Название")
+    type = models.IntegerField(choices=FightsModel.FIGHT_TYPE_CHOICES, default=1, verbose_name="Тип боя")
+    date = models.DateTimeField(verbose_name="Дата")
+    voevoda_id = models.ForeignKey("VoevodaModel", null=True, blank=True, on_delete=models.SET_NULL,
+                                   verbose_name="Воевода", related_name="+")
+    attack_1_pers = models.ForeignKey("PlayersModel", null=True, blank=True, on_delete=models.SET_NULL,
+                                      verbose_name="1-й игрок атаки", related_name="+")
+    attack_2_pers = models.ForeignKey("PlayersModel", null=True, blank=True, on_delete=models.SET_NULL,
+                                      verbose_name="2-й игрок атаки", related_name="+")
+    defence_1_pers = models.ForeignKey("PlayersModel", null=True, blank=True, on_delete=models.SET_NULL,
+                                       verbose_name="1-й игрок защиты", related_name="+")
+    defence_2_pers = models.ForeignKey("PlayersModel", null=True, blank=True, on_delete=models.SET_NULL,
+                                       verbose_name="2-й игрок защиты", related_name="+")
+    attack_1_pers_preset = models.ForeignKey("PresetsModel", null=True, blank=True, on_delete=models.SET_NULL,
+                                             verbose_name="пресет 1-го игрока атаки", related_name="+")
+    attack_2_pers_preset = models.ForeignKey("PresetsModel", null=True, blank=True, on_delete=models.SET_NULL,
+                                             verbose_name="пресет 2-го игрока атаки", related_name="+")
+    defence_1_pers_preset = models.ForeignKey("PresetsModel", null=True, blank=True, on_delete=models.SET_NULL,
+                                              verbose_name="пресет 1-го игрока защиты", related_name="+")
+    defence_2_pers_preset = models.ForeignKey("PresetsModel", null=True, blank=True, on_delete=models.SET_NULL,
+                                              verbose_name="пресет 2-го игрока защиты", related_name="+")
+    result = models.IntegerField(choices=FightsModel.RESULT_CHOICER, verbose_name="Результат")
+    description = models.TextField(verbose_name="Комментарий")
+
+    def __str__(self):
+        return f"{self.name} - {self.voevoda_id}"
+
+    class Meta:
+        verbose_name_plural = "Архив битв"
+        indexes = [
+            models.Index(fields=["voevoda_id", "date"], name="fights_arch_voevoda_date_idx"),
+            models.Index(fields=["date"], name="fights_arch_date_idx"),
+        ]
+
+
+class FightEventArchiveModel(models.Model):
+    """Архив завершенных ивентов. Поля и ID как у FightEventModel"""
+    id = models.IntegerField(primary_key=True)
+    date = models.DateTimeField(verbose_name="Дата")
+    name = models.CharField(max_length=50, verbose_name="Название")
+    type = models.IntegerField(choices=FightEventModel.FIGHT_TYPE_CHOICES, default=1, verbose_name="Тип боя")
+    voevoda_id = models.ForeignKey("VoevodaModel", null=True, blank=True, on_delete=models.CASCADE,
+                                   verbose_name="Воевода", related_name="+")
+    enemy = models.ForeignKey("ClansModel", null=True, blank=True, on_delete=models.SET_NULL,
+                              verbose_name="Противник", related_name="+")
+    state = models.IntegerField(choices=FightEventModel.STATE_CHOICER, default=4)
+
+    def __str__(self):
+        return f"{self.name} - {self.voevoda_id}"
+
+    class Meta:
+        verbose_name_plural = "Архив ивентов"
+        indexes = [
+            models.Index(fields=["voevoda_id", "date"], name="events_arch_voevoda_date_idx"),
+            models.Index(fields=["date"], name="events_arch_date_idx"),
+        ]
+
+
+class InviteArchiveModel(models.Model):
+    """Архив приглашений на завершенные ивенты. Поля и ID как у InviteModel"""
+    id = models.IntegerField(primary_key=True)
+    date = models.DateTimeField(verbose_name="Дата")
+    event_id = models.ForeignKey("FightEventArchiveModel", null=True, blank=True,
+                                 on_delete=models.CASCADE, verbose_name="Ивент", related_name="invites")
+    person_id = models.ForeignKey("PersonsModel", null=True, blank=True,
+                                  on_delete=models.CASCADE, verbose_name="Игрок", related_name="+")
+    state = models.IntegerField(choices=InviteModel.STATE_CHOICES, default=1)
+
+    def __str__(self):
+        return f"{self.event_id} - {self.person_id}"
+
+    class Meta:
+        verbose_name_plural = "Архив приглашений на ивент"
+        indexes = [
+            models.Index(fields=["event_id", "state"], name="invites_arch_event_state_idx"),
+        ]
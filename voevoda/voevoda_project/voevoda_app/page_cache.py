@@ -0,0 +1,133 @@
+"""Сжатый дисковый кэш страниц, загруженных с сайта ГВД"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Union
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+
+class PageSchem(BaseModel):
+    """Загруженная страница
+    changed: False, если содержимое страницы не изменилось с прошлой загрузки
+    """
+    url: str
+    body: bytes
+    encoding: Union[str, None] = None
+    changed: bool = True
+
+    @property
+    def text(self) -> str:
+        return self.body.decode(self.encoding or "utf-8", errors="replace")
+
+
+class PageCache:
+    """Кэш страниц, адресуемый по содержимому.
+
+    Тела страниц хранятся сжатыми в blobs/<2 символа хэша>/<sha256>.gz, поэтому одинаковые
+    страницы (например пустые последние страницы кланов) лежат на диске один раз.
+    Для каждого URL в index/<sha1 от URL>.json хранится хэш текущего тела, ETag и Last-Modified
+    для условных запросов, а также произвольные метаданные парсера.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.blobs_path = self.path / "blobs"
+        self.index_path = self.path / "index"
+
+    def _entry_path(self, url: str) -> Path:
+        return self.index_path / f"{hashlib.sha1(url.encode()).hexdigest()}.json"
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.blobs_path / digest[:2] / f"{digest}.gz"
+
+    @staticmethod
+    def _write_atomic(path: Path, data: bytes):
+        """Пишем файл через временный, чтобы параллельный читатель не увидел его недописанным"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+
+    def get_entry(self, url: str) -> Union[dict, None]:
+        """Запись индекса для URL"""
+        try:
+            with open(self._entry_path(url)) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logger.error(f"Повреждена запись кэша для URL: {url}")
+            return None
+
+    def _save_entry(self, entry: dict):
+        self._write_atomic(self._entry_path(entry["url"]), json.dumps(entry, ensure_ascii=False).encode())
+
+    def conditional_headers(self, url: str) -> dict:
+        """Заголовки для условного запроса по данным прошлой загрузки"""
+        entry = self.get_entry(url)
+        headers = {}
+        if entry and self._blob_path(entry["sha256"]).exists():
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def load(self, url: str, changed: bool = False) -> Union[PageSchem, None]:
+        """Достаем страницу из кэша"""
+        entry = self.get_entry(url)
+        if not entry:
+            return None
+        try:
+            with gzip.open(self._blob_path(entry["sha256"]), "rb") as file:
+                body = file.read()
+        except FileNotFoundError:
+            logger.error(f"В кэше нет тела страницы {entry['sha256']} для URL: {url}")
+            return None
+        return PageSchem(url=url, body=body, encoding=entry.get("encoding"), changed=changed)
+
+    def store(self, url: str, body: bytes, encoding: Union[str, None] = None,
+              etag: Union[str, None] = None, last_modified: Union[str, None] = None) -> bool:
+        """Сохраняем свежезагруженную страницу.
+        Возвращает True, если содержимое отличается от сохраненного в прошлый раз
+        """
+        digest = hashlib.sha256(body).hexdigest()
+        blob_path = self._blob_path(digest)
+        if not blob_path.exists():
+            self._write_atomic(blob_path, gzip.compress(body))
+
+        entry = self.get_entry(url) or {"url": url, "meta": {}}
+        changed = entry.get("sha256") != digest
+        if changed:
+            # метаданные парсера относились к старому содержимому
+            entry["meta"] = {}
+        entry.update(sha256=digest, encoding=encoding, etag=etag, last_modified=last_modified, fetched_at=time.time())
+        self._save_entry(entry)
+        return changed
+
+    def touch(self, url: str):
+        """Сервер ответил 304 - отмечаем время проверки страницы"""
+        entry = self.get_entry(url)
+        if entry:
+            entry["fetched_at"] = time.time()
+            self._save_entry(entry)
+
+    def get_meta(self, url: str) -> dict:
+        """Метаданные, которые парсер сохранил для текущего содержимого страницы"""
+        entry = self.get_entry(url)
+        return entry.get("meta", {}) if entry else {}
+
+    def set_meta(self, url: str, **meta):
+        entry = self.get_entry(url)
+        if entry:
+            entry.setdefault("meta", {}).update(meta)
+            self._save_entry(entry)
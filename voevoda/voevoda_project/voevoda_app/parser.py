@@ -1,14 +1,17 @@
 from random import randint
-from typing import Union, List
+from typing import Iterator, Union, List
 import logging
-from pathlib import Path
 import time
 
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
 import requests
-from bs4 import BeautifulSoup, element
+import lxml.html
+from lxml import etree
 from fake_useragent import UserAgent
 
+from .fetcher import AsyncFetcher, FetchError
+from .page_cache import PageCache, PageSchem
+
 logger = logging.getLogger(__name__)
 
 
@@ -44,17 +47,99 @@ class PlayerSchem(BaseModel):
     gild_gunsmith: int
 
 
+# Таблица колонок страницы игроков клана: номер ячейки <td> в строке -> поле PlayerSchem.
+# Имена полей совпадают с полями PlayersModel, по этой же таблице сериализуются данные игроков
+PLAYER_ID_COLUMN = 1
+PLAYER_NAME_COLUMN = 2
+PLAYER_COLUMNS = (
+    (7, "umka_knight"),
+    (8, "umka_necro"),
+    (9, "umka_mag"),
+    (10, "umka_elf"),
+    (11, "umka_barbar"),
+    (12, "umka_black_elf"),
+    (13, "umka_demon"),
+    (14, "umka_dwarf"),
+    (15, "umka_step_barb"),
+    (16, "umka_pharaon"),
+
+    (18, "gild_hunt"),
+    (19, "gild_work"),
+    (20, "gild_card"),
+    (21, "gild_thief"),
+    (22, "gild_ranger"),
+    (23, "gild_mers"),
+    (24, "gild_tactic"),
+    (25, "gild_gard"),
+    (26, "gild_seekers"),
+    (27, "gild_leader"),
+    (28, "gild_blacksmith"),
+    (29, "gild_gunsmith"),
+)
+PLAYER_STATS_FIELDS = tuple(field for _, field in PLAYER_COLUMNS)
+
+# валидация сразу всей страницы игроков одним вызовом
+PLAYERS_PAGE_ADAPTER = TypeAdapter(List[PlayerSchem])
+
+# заранее скомпилированные XPath выражения для разбора страницы игроков
+TBODY_XPATH = etree.XPath("//tbody")
+ROWS_XPATH = etree.XPath("./tr")
+CELLS_XPATH = etree.XPath("./td")
+
+# XPath элемента с css классом (аналог find(tag, class_=name) из BeautifulSoup)
+CLASS_XPATH = "//{tag}[contains(concat(' ', normalize-space(@class), ' '), ' {name} ')]"
+
+
 class BaseParser:
     headers = {
         "User-Agent": UserAgent().random,
         "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/png,image/svg+xml,*/*;q=0.8"
     }
+    def __init__(self, cache: Union[PageCache, None] = None, offline: bool = False):
+        """
+        Args:
+            cache: дисковый кэш страниц. С ним запросы становятся условными
+            offline: брать страницы только из кэша, не обращаясь к сайту
+        """
+        self.cache = cache
+        self.offline = offline
+
     def get_data(self, url: str):
         """Данный метод данные посредством запроса"""
-        print(f"Запрашиваю данные по URL: {url}")
-        response = requests.get(url=url, headers=self.headers, allow_redirects=True)
-        print(f"Данные по URL: {url} -> пришли")
-        return response.text
+        return self.get_page(url=url).text
+
+    def get_page(self, url: str) -> PageSchem:
+        """Загрузка страницы с учетом дискового кэша"""
+        if self.offline:
+            page = self.cache.load(url=url, changed=True) if self.cache else None
+            if page is None:
+                raise FetchError(f"Страницы по URL: {url} нет в кэше")
+            return page
+
+        headers = dict(self.headers)
+        if self.cache:
+            headers.update(self.cache.conditional_headers(url=url))
+        logger.debug(f"Запрашиваю данные по URL: {url}")
+        start = time.monotonic()
+        response = requests.get(url=url, headers=headers, allow_redirects=True)
+        logger.debug(
+            f"Данные по URL: {url} -> {response.status_code}, {len(response.content)} байт "
+            f"за {time.monotonic() - start:.3f} с"
+        )
+        if response.status_code == 304 and self.cache:
+            page = self.cache.load(url=url, changed=False)
+            if page is not None:
+                self.cache.touch(url=url)
+                return page
+            response = requests.get(url=url, headers=self.headers, allow_redirects=True)
+
+        changed = True
+        if self.cache:
+            changed = self.cache.store(
+                url=url, body=response.content, encoding=response.encoding,
+                etag=response.headers.get("ETag"), last_modified=response.headers.get("Last-Modified"),
+            )
+        return PageSchem(url=url, body=response.content, encoding=response.encoding, changed=changed)
 
     def save_page(self, data: Union[str, bytes], name: str = "index.html", type: int = 1):
         """Сервисный метод для сохранения html страницы"""
@@ -65,53 +150,45 @@ class BaseParser:
             with open(name, "wb") as file:
                 file.write(data)
 
-    def open_page(self, file_path: str = "index.html"):
-        with open(file_path) as file:
-            src = file.read()
-        return src
-
 
 class ClansParser(BaseParser):
 
     def get_data(self, url: str, type: int = 1):
         """Данный метод данные посредством запроса"""
-        print(f"Запрашиваю данные по URL: {url}")
-        response = requests.get(url=url, headers=self.headers, allow_redirects=True)
-        print(f"Данные по URL: {url} -> пришли")
         if type == 1:
-            return response.text
-        else:
-            return response.content
-
-        # self.save_page(data=response.text)
+            return super().get_data(url=url)
+        logger.debug(f"Запрашиваю данные по URL: {url}")
+        start = time.monotonic()
+        response = requests.get(url=url, headers=self.headers, allow_redirects=True)
+        logger.debug(
+            f"Данные по URL: {url} -> {response.status_code}, {len(response.content)} байт "
+            f"за {time.monotonic() - start:.3f} с"
+        )
+        return response.content
 
-        # data = self.open_page()
-        #
-        # return data
+    clans_url = "https://daily.heroeswm.ru/bk"
+    clan_info_url = "https://www.heroeswm.ru/clan_info.php?id={clan_id}"
 
     def pars_clans_data(self) -> list:
         """Данный метод парсит данные обо всех кланах и возвращает из в виде списка словарей"""
-        # print(os.getcwd())
-        # print(Path(__file__).resolve().parent.parent)
-        data = self.get_data(url="https://daily.heroeswm.ru/bk")
+        data = self.get_data(url=self.clans_url)
+        return self.parse_clans_html(html_data=data)
 
-        soup = BeautifulSoup(data, "lxml")
-
-        clans = soup.find("table", class_="tab").find("tbody").find_all("tr")
+    @staticmethod
+    def parse_clans_html(html_data: str) -> list:
+        """Разбор страницы со списком всех кланов"""
+        tree = lxml.html.fromstring(html_data)
+        clans = tree.xpath(f"(({CLASS_XPATH.format(tag='table', name='tab')})[1]//tbody)[1]//tr")
 
         keys = ['clan_id', 'label', 'name']
 
         clans_data_list = []
         logger.info(f"Необходимой распарсить информацию о {len(clans)} кланах")
         for clan in clans:
-            one_clan_data = clan.find_all("td")
-            # print(one_clan_data)
             one_clan_list_data = []
-            for value in one_clan_data:
-                if value.find("img"):
-                    one_clan_list_data.append(value.find("img")["src"])
-                else:
-                    one_clan_list_data.append(value.text)
+            for value in clan.xpath(".//td"):
+                image_src = value.xpath("(.//img)[1]/@src")
+                one_clan_list_data.append(str(image_src[0]) if image_src else value.text_content())
             clans_data_list.append({key: value for key, value in zip(keys, one_clan_list_data)})
         return clans_data_list
 
@@ -119,50 +196,54 @@ class ClansParser(BaseParser):
         """Данный метод парсит данные об одном клане с сайта ГВД"""
 
         # формируем ссылку по которой обращаемся к клану
-        url = f"https://www.heroeswm.ru/clan_info.php?id={clan_id}"
+        url = self.clan_info_url.format(clan_id=clan_id)
 
         # непосредственно делаем запрос чтобы спасить данные о клане
-        response = requests.get(url=url, headers=self.headers)
-
-        # self.save_page(data=response.text, name=f"clan_{clan_id}.html")
-        # data = self.open_page(file_path=f"clan_{clan_id}.html")
-
-        soup = BeautifulSoup(response.text, "lxml")
-        data = soup.find_all("a", class_="pi")
-        for i in data:
-            allians_clan_name = i.find("b")
-            if allians_clan_name:
-                logger.info(f"Клан №{clan_id} находится в альянсе №{allians_clan_name.text.split()[0][1:]}")
-                return allians_clan_name.text.split()[0][1:]
+        return self.parse_alliance_html(html_data=self.get_data(url=url), clan_id=clan_id)
+
+    async def async_get_one_clan_allianse(self, fetcher: AsyncFetcher, clan_id: int) -> Union[int, None]:
+        """Асинхронный вариант get_one_clan_allianse через общий загрузчик"""
+        html_data = await fetcher.fetch(url=self.clan_info_url.format(clan_id=clan_id))
+        return self.parse_alliance_html(html_data=html_data, clan_id=clan_id)
+
+    @staticmethod
+    def parse_alliance_html(html_data: str, clan_id: int) -> Union[int, None]:
+        """Разбор страницы клана: ищем в ней ссылку на альянсовый клан"""
+        allians_clan_name = lxml.html.fromstring(html_data).xpath(f"({CLASS_XPATH.format(tag='a', name='pi')}//b)[1]")
+        if allians_clan_name:
+            alliance = allians_clan_name[0].text_content().split()[0][1:]
+            logger.info(f"Клан №{clan_id} находится в альянсе №{alliance}")
+            return alliance
         logger.info(f"Клан №{clan_id} находится без альянса")
 
-    def save_give(self, url: str, path: str = Path(__file__).resolve().parent.parent):
-        """
-        Скачиваем гифку относящуюся к определенному клану и
-        сохраняем ее в БД
-        Сохраняет гифку закрепленную за определенным кланом
-        НЕ НУЖНЫЙ МЕТОД
-        """
-        data = self.get_data(url=url, type=2)
-        name = url.split("/")[-1].split("?")[0]
-        self.save_page(data=data, name=f"{path}/static/voevoda_app/clans/{name}", type=2)
-
 
 class PlayerParser(BaseParser):
     """Класс для парсинга данных об игроках"""
 
     base_url = "https://daily.heroeswm.ru/players/l/5n/bc/"
 
-    def parse_one_clan_data(self, clan_id: int, page: int = 1, total_list = []) -> List[PlayerSchem]:
+    def parse_one_clan_data(self, clan_id: int) -> List[PlayerSchem]:
         """Данный метод парсит всех игроков из боевого клана под номером clan_id"""
-        one_page_data = self.parse_one_page(clan_id=clan_id, page=page)
-        time.sleep(randint(1, 3))
-        if one_page_data is not None:
+        total_list = []
+        for one_page_data in self.iter_clan_pages(clan_id=clan_id):
             total_list.extend(one_page_data)
-            return self.parse_one_clan_data(clan_id=clan_id, page=page + 1, total_list=total_list)
-        else:
-            return total_list
+        return total_list
 
+    def iter_clan_pages(self, clan_id: int, page: int = 1) -> Iterator[List[PlayerSchem]]:
+        """Генератор, который постранично отдает игроков боевого клана.
+        Следующая страница запрашивается только когда потребитель обработал предыдущую
+        """
+        while True:
+            one_page_data = self.parse_one_page(clan_id=clan_id, page=page)
+            if one_page_data is None:
+                return
+            yield one_page_data
+            time.sleep(randint(1, 3))
+            page += 1
+
+    def get_page_url(self, clan_id: int, page: int = 1) -> str:
+        """Ссылка на страницу с игроками клана"""
+        return self.base_url + str(clan_id) + "/p/" + str(page)
 
     def parse_one_page(self, clan_id: int, page: int = 1) -> Union[List[PlayerSchem], None]:
         """Данный метод парсит данные об игроках из боевого клана с одной страницы
@@ -170,92 +251,52 @@ class PlayerParser(BaseParser):
             clan_id: идентификатор боевого клана
             page: страница (не более 50 игроков на одной странице)
         """
-        url = self.base_url + str(clan_id) + "/p/" + str(page)
-        html_data = self.get_data(url=url)
-        # html_data = self.open_page(file_path=f"k{clan_id}_p{page}.html")
-        # self.save_page(data=one_page_data, name=f"k{clan_id}_p{page}.html")
-
-        soup = BeautifulSoup(html_data, "lxml")
+        html_data = self.get_data(url=self.get_page_url(clan_id=clan_id, page=page))
+        return self.parse_page_html(html_data=html_data, clan_id=clan_id)
 
+    @staticmethod
+    def parse_page_html(html_data: str, clan_id: int) -> Union[List[PlayerSchem], None]:
+        """Разбор одной страницы с игроками клана. Возвращает None, если на странице нет игроков.
+        Строки разбираются через XPath lxml, а вся страница валидируется одним вызовом pydantic
+        """
         # получаем html страницу с данные о героях
-        all_person_data = soup.find_all("tbody")
+        all_person_data = TBODY_XPATH(lxml.html.fromstring(html_data))
 
         # проверяем есть ли на странице данные о героях
-        page_len = len(all_person_data)
-        # print(f"page_len: {page_len}")
-        # print(all_person_data[1].text)
-        if not all_person_data[1].text:
+        if len(all_person_data) < 2 or not all_person_data[1].text_content():
             return
-        else:
-            # выбираем ту часть, которая относится к героям
-            persons_data = all_person_data[1]
-
-            #  преобразуем данные относящиеся к героям в список
-            persons_list_data = persons_data.find_all("tr")
 
-            return [self.parse_one_person_data(in_data=person_data, clan_id=clan_id) for person_data in persons_list_data]
-
-    def parse_one_person_data(self, in_data: element.Tag, clan_id: int) -> PlayerSchem:
-        """Данный метод парсит данные из html страницы относящиеся к персонажу
-        и преобразует их в словарь
+        #  преобразуем данные относящиеся к героям в список
+        persons_list_data = ROWS_XPATH(all_person_data[1])
+        if not persons_list_data:
+            return
+        return PLAYERS_PAGE_ADAPTER.validate_python(
+            [PlayerParser.parse_one_person_data(in_data=person_data, clan_id=clan_id) for person_data in persons_list_data]
+        )
+
+    @staticmethod
+    def parse_one_person_data(in_data: lxml.html.HtmlElement, clan_id: int) -> dict:
+        """Данный метод парсит данные из строки таблицы относящиеся к персонажу
+        и преобразует их в словарь по таблице колонок PLAYER_COLUMNS
         """
-        total_dict = {}
-        elements_list = in_data.find_all("td")
-        for index, element in enumerate(elements_list):
-            total_dict["clan"] = clan_id
-            if index == 1:
-                total_dict["id"] = int(element.text)
-            if index == 2:
-                split_name_lvl = element.text.split("[")
-                total_dict["level"] = int(split_name_lvl[1].split("]")[0])
-                total_dict["name"] = split_name_lvl[0].strip()
-            if index == 7:
-                total_dict["umka_knight"] = int(element.text)
-            if index == 8:
-                total_dict["umka_necro"] = int(element.text)
-            if index == 9:
-                total_dict["umka_mag"] = int(element.text)
-            if index == 10:
-                total_dict["umka_elf"] = int(element.text)
-            if index == 11:
-                total_dict["umka_barbar"] = int(element.text)
-            if index == 12:
-                total_dict["umka_black_elf"] = int(element.text)
-            if index == 13:
-                total_dict["umka_demon"] = int(element.text)
-            if index == 14:
-                total_dict["umka_dwarf"] = int(element.text)
-            if index == 15:
-                total_dict["umka_step_barb"] = int(element.text)
-            if index == 16:
-                total_dict["umka_pharaon"] = int(element.text)
-
-            if index == 18:
-                total_dict["gild_hunt"] = int(element.text)
-            if index == 19:
-                total_dict["gild_work"] = int(element.text)
-            if index == 20:
-                total_dict["gild_card"] = int(element.text)
-            if index == 21:
-                total_dict["gild_thief"] = int(element.text)
-            if index == 22:
-                total_dict["gild_ranger"] = int(element.text)
-            if index == 23:
-                total_dict["gild_mers"] = int(element.text)
-            if index == 24:
-                total_dict["gild_tactic"] = int(element.text)
-            if index == 25:
-                total_dict["gild_gard"] = int(element.text)
-            if index == 26:
-                total_dict["gild_seekers"] = int(element.text)
-            if index == 27:
-                total_dict["gild_leader"] = int(element.text)
-            if index == 28:
-                total_dict["gild_blacksmith"] = int(element.text)
-            if index == 29:
-                total_dict["gild_gunsmith"] = int(element.text)
-
-        return PlayerSchem(**total_dict)
+        # у ячейки без вложенных тегов текст берется напрямую, это заметно быстрее text_content()
+        cells = [cell.text_content() if len(cell) else (cell.text or "") for cell in CELLS_XPATH(in_data)]
+        name, level = cells[PLAYER_NAME_COLUMN].split("[")[:2]
+        total_dict = {
+            "clan": clan_id,
+            "id": int(cells[PLAYER_ID_COLUMN]),
+            "name": name.strip(),
+            "level": int(level.split("]")[0]),
+        }
+        for index, field in PLAYER_COLUMNS:
+            total_dict[field] = int(cells[index])
+        return total_dict
+
+
+def parse_players_page(html_data: str, clan_id: int) -> Union[List[PlayerSchem], None]:
+    """Разбор страницы игроков для пула процессов (функция уровня модуля, чтобы ее можно было передать в процесс)"""
+    return PlayerParser.parse_page_html(html_data=html_data, clan_id=clan_id)
+
 
 if __name__ == '__main__':
     obj = PersonParser()
@@ -0,0 +1,264 @@
+"""Конвейер перепарсинга игроков: загрузка -> разбор -> запись в БД"""
+import asyncio
+import logging
+import multiprocessing
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Tuple, Union
+
+from asgiref.sync import sync_to_async
+
+from .fetcher import AsyncFetcher
+from .metrics import ReparseMetrics
+from .page_cache import PageSchem
+from .parser import PlayerParser, PlayerSchem, parse_players_page
+
+logger = logging.getLogger(__name__)
+
+
+def timed_parse_players_page(html_data: str, clan_id: int) -> Tuple[Union[List[PlayerSchem], None], float]:
+    """Разбор страницы игроков с замером времени внутри процесса разбора (без ожидания в очереди пула)"""
+    start = time.perf_counter()
+    players = parse_players_page(html_data=html_data, clan_id=clan_id)
+    return players, time.perf_counter() - start
+
+
+class StageStats:
+    """Счетчики одной стадии конвейера"""
+
+    def __init__(self):
+        self.items = 0
+        self.rows = 0
+        self.busy = 0.0
+
+    def add(self, busy: float, rows: int = 0):
+        self.items += 1
+        self.rows += rows
+        self.busy += busy
+
+    def report(self, elapsed: float) -> dict:
+        return {
+            "items": self.items,
+            "rows": self.rows,
+            "busy_sec": round(self.busy, 3),
+            "items_per_sec": round(self.items / elapsed, 2) if elapsed else 0.0,
+            "rows_per_sec": round(self.rows / elapsed, 2) if elapsed else 0.0,
+        }
+
+
+class ReparsePipeline:
+    """Конвейер перепарсинга игроков кланов из трех стадий, связанных ограниченными очередями:
+
+        загрузка - корутины process_clan по одной на клан, страницы идут через общий AsyncFetcher
+        разбор   - страницы разбираются в пуле процессов (на всех ядрах), без пула - в потоке
+        запись   - единственный писатель собирает разобранных игроков клана и, когда все страницы
+                   клана разобраны, применяет состав клана в БД одним вызовом save_roster
+
+    До конца клана его игроки копятся в памяти стадии записи, а не пишутся пачками: читатели видят
+    либо прежний, либо новый состав клана, и БД блокируется на запись один раз на клан.
+    Если разбор или запись не успевают, очереди заполняются и загрузка ждет (память ограничена
+    размером очередей и количеством одновременно загружаемых кланов). Используется как асинхронный
+    контекстный менеджер:
+        async with ReparsePipeline(fetcher=fetcher, save_roster=...) as pipeline:
+            await pipeline.process_clan(clan_id=clan_id)
+    """
+
+    def __init__(self, fetcher: AsyncFetcher,
+                 save_roster: Callable[[int, List[PlayerSchem]], Tuple[int, int]],
+                 parse_workers: int = 0, queue_size: int = 32,
+                 metrics: Union[ReparseMetrics, None] = None):
+        """
+        Args:
+            fetcher: общий загрузчик страниц
+            save_roster: применение полного состава клана в БД (синхронное) с ID клана и списком его игроков
+                (только если состав клана изменился). Возвращает (записанных игроков, открепленных игроков)
+            parse_workers: количество процессов разбора. 0 - разбирать в потоке текущего процесса
+            queue_size: размер очередей между стадиями
+            metrics: сборщик замеров разбора и записи
+        """
+        self.fetcher = fetcher
+        self.parser = PlayerParser()
+        self.save_roster = sync_to_async(save_roster)
+        self.parse_workers = parse_workers
+        self.queue_size = queue_size
+        self.metrics = metrics
+        self.stats = {"fetch": StageStats(), "parse": StageStats(), "write": StageStats()}
+        self.pool: Union[ProcessPoolExecutor, None] = None
+        self._parse_queue: Union[asyncio.Queue, None] = None
+        self._write_queue: Union[asyncio.Queue, None] = None
+        self._tasks = []
+        self._started = 0.0
+
+    async def __aenter__(self):
+        if self.parse_workers:
+            # spawn: процесс сервера многопоточный, а fork потоков небезопасен
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.parse_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        self._parse_queue = asyncio.Queue(maxsize=self.queue_size)
+        self._write_queue = asyncio.Queue(maxsize=self.queue_size)
+        parsers = max(self.parse_workers, 1) * 2
+        self._tasks = [asyncio.create_task(self._parse_stage()) for _ in range(parsers)]
+        self._writer = asyncio.create_task(self._write_stage())
+        self._started = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        for _ in self._tasks:
+            await self._parse_queue.put(None)
+        await asyncio.gather(*self._tasks)
+        await self._write_queue.put(None)
+        await self._writer
+        if self.pool:
+            self.pool.shutdown()
+        logger.info(f"Конвейер перепарсинга: {self.report()}")
+
+    def report(self) -> dict:
+        """Пропускная способность стадий"""
+        elapsed = time.monotonic() - self._started
+        report = {"elapsed_sec": round(elapsed, 3)}
+        for name, stats in self.stats.items():
+            report[name] = stats.report(elapsed=elapsed)
+        return report
+
+    async def process_clan(self, clan_id: int) -> bool:
+        """Загружаем страницы клана и отдаем их на разбор.
+        Возвращает управление, когда игроки клана записаны в БД: True, если состав клана применен,
+        и False, если страницы клана не изменились. Ошибки загрузки и записи пробрасываются.
+
+        Если у загрузчика есть кэш и ни одна страница клана не изменилась с прошлого раза,
+        страницы не разбираются (число строк страницы берется из метаданных кэша)
+        """
+        cache = self.fetcher.cache
+        unchanged_pages = []
+        unchanged_rows = 0
+        submitted = []
+        # число строк разобранных страниц попадет в кэш только после записи состава клана
+        parsed_rows = []
+        clan_changed = cache is None
+        page = 1
+        try:
+            while True:
+                url = self.parser.get_page_url(clan_id=clan_id, page=page)
+                start = time.monotonic()
+                one_page = await self.fetcher.fetch_page(url=url)
+                self.stats["fetch"].add(busy=time.monotonic() - start)
+                rows = (await asyncio.to_thread(cache.get_meta, url=url)).get("rows") if cache else None
+                if not clan_changed and not one_page.changed and rows is not None:
+                    if rows == 0:
+                        logger.info(f"Страницы клана №{clan_id} не изменились")
+                        if self.metrics:
+                            self.metrics.record_rows(unchanged=unchanged_rows)
+                        break
+                    # отложим разбор, пока не станет понятно, изменился ли клан
+                    unchanged_pages.append(one_page)
+                    unchanged_rows += rows
+                    page += 1
+                    continue
+
+                clan_changed = True
+                for cached_page in unchanged_pages:
+                    submitted.append(await self._submit(clan_id=clan_id, page=cached_page))
+                unchanged_pages = []
+
+                # конец списка игроков виден только после разбора страницы - дожидаемся его
+                future = await self._submit(clan_id=clan_id, page=one_page)
+                submitted.append(future)
+                rows = await future
+                parsed_rows.append((url, rows))
+                if not rows:
+                    break
+                page += 1
+            # все страницы клана должны попасть к писателю раньше отметки о конце клана
+            await asyncio.gather(*submitted)
+        except BaseException:
+            for future in submitted:
+                future.cancel()
+            # писатель выбросит уже собранных игроков клана
+            await self._write_queue.put(("abort", clan_id))
+            raise
+
+        done = asyncio.get_running_loop().create_future()
+        await self._write_queue.put(("end", clan_id, clan_changed, done))
+        clan_changed = await done
+        if cache:
+            # если запись упала, метаданных у измененных страниц нет (PageCache.store их сбросил),
+            # и следующий запуск разберет клан заново, а не примет его за неизменившийся
+            for url, rows in parsed_rows:
+                await asyncio.to_thread(cache.set_meta, url=url, rows=rows)
+        return clan_changed
+
+    async def _submit(self, clan_id: int, page: PageSchem) -> asyncio.Future:
+        """Ставим страницу в очередь разбора. Future получит количество игроков на странице"""
+        future = asyncio.get_running_loop().create_future()
+        await self._parse_queue.put((clan_id, page.text, future))
+        return future
+
+    async def _parse_stage(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._parse_queue.get()
+            if item is None:
+                return
+            clan_id, html_data, future = item
+            if future.cancelled():
+                continue
+            start = time.monotonic()
+            try:
+                players, parse_time = await loop.run_in_executor(
+                    self.pool, timed_parse_players_page, html_data, clan_id
+                )
+            except Exception as _ex:
+                logger.error(f"Ошибка разбора страницы клана №{clan_id} -> {_ex!r}")
+                if not future.cancelled():
+                    future.set_exception(_ex)
+                continue
+            self.stats["parse"].add(busy=time.monotonic() - start, rows=len(players or []))
+            if self.metrics:
+                self.metrics.record_parse(seconds=parse_time, rows=len(players or []))
+            if players:
+                await self._write_queue.put(("players", clan_id, players, future))
+            if not future.cancelled():
+                future.set_result(len(players or []))
+
+    async def _write_stage(self):
+        rosters = defaultdict(list)
+
+        while True:
+            item = await self._write_queue.get()
+            if item is None:
+                return
+            if item[0] == "players":
+                _, clan_id, players, future = item
+                # страницы отмененного клана не копим: отметка о его конце уже не придет
+                if not future.cancelled():
+                    rosters[clan_id].extend(players)
+                continue
+            if item[0] == "abort":
+                _, clan_id = item
+                rosters.pop(clan_id, None)
+                continue
+
+            _, clan_id, clan_changed, done = item
+            players = rosters.pop(clan_id, [])
+            error = None
+            if clan_changed:
+                start = time.monotonic()
+                try:
+                    changed, detached = await self.save_roster(clan_id, players)
+                    if self.metrics:
+                        self.metrics.record_write(
+                            seconds=time.monotonic() - start, changed=changed, unchanged=len(players) - changed
+                        )
+                        self.metrics.record_rows(detached=detached)
+                except Exception as _ex:
+                    logger.error(f"Ошибка записи состава клана №{clan_id} -> {_ex!r}")
+                    error = _ex
+                self.stats["write"].add(busy=time.monotonic() - start, rows=len(players))
+            if done.cancelled():
+                continue
+            if error is not None:
+                done.set_exception(error)
+            else:
+                done.set_result(clan_changed)
@@ -17,8 +17,9 @@ logger = logging.getLogger(__name__)
 class Redis:
     """Объект для взаимодействия с redis"""
 
-    def __init__(self, port=os.getenv("REDIS_PORT"), password=os.getenv("REDIS_PASSWORD")):
-        self.redis = redis.from_url(f"redis://:{password}@localhost:{port}")
+    def __init__(self, port=os.getenv("REDIS_PORT"), password=os.getenv("REDIS_PASSWORD"),
+                 host=os.getenv("REDIS_HOST", "localhost")):
+        self.redis = redis.from_url(f"redis://:{password}@{host}:{port}")
 
     def get_data_from_cache(self, key: str, data_class: Type[BaseModel]) -> Union[BaseModel, None]:
         """Данный метод ищет данные в КЭШе по ключу и преобразует в pydantic"""
@@ -1,4 +1,4 @@
-from typing import Union
+from typing import List, Union
 
 from pydantic import BaseModel
 
@@ -18,4 +18,20 @@ class VoevodaAuthSchem(BaseModel):
     voevoda_id: int
     name: str
     clan_id: int
-    sub_person_id: Union[int, None] = None
\ No newline at end of file
+    sub_person_id: Union[int, None] = None
+
+class ReparseJobSchem(BaseModel):
+    """Состояние фоновой задачи перепарсинга кланов"""
+    job_id: str
+    run_id: Union[int, None] = None
+    state: str = "running"
+    started_at: float
+    finished_at: Union[float, None] = None
+    clans_total: int = 0
+    clans_done: int = 0
+    clans_failed: int = 0
+    pages_fetched: int = 0
+    errors: List[str] = []
+    eta: Union[float, None] = None
+    # пропускная способность стадий конвейера (загрузка, разбор, запись) по окончании перепарсинга
+    stages: dict = {}
@@ -1,20 +1,103 @@
 """Вся логика спрятана в данном модуле"""
+import asyncio
+import csv
 import datetime
-from typing import Union
+import hashlib
+import hmac
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+from typing import Union, List, Tuple
+from urllib.parse import urlsplit
 import logging
 
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import connections, transaction
 from django.db.utils import IntegrityError
-from django.db.models import Q
+from django.db.models import F, IntegerField, Max, OuterRef, Q, Subquery, Value
+from django.urls import reverse
+from django.utils import timezone
+from lxml import etree
 
 from .models import *
-from .parser import ClansParser,PlayerParser
+from .parser import BaseParser, ClansParser, PlayerParser, PlayerSchem, PLAYER_STATS_FIELDS
+from .parser import PLAYERS_PAGE_ADAPTER, parse_players_page
+from .db_writer import db_writer
+from .fetcher import AsyncFetcher, FetchError
+from .metrics import ReparseMetrics
+from .page_cache import PageCache
+from .pipeline import ReparsePipeline
 from .redis_core import Redis
 from . import schemas
 
 logger = logging.getLogger(__name__)
 
 
+def get_fetcher_settings(workers: int = 1) -> dict:
+    """Параметры AsyncFetcher из настроек проекта
+    Args:
+        workers: сколько процессов загружают страницы одновременно. Лимиты параллельности и частота
+            запросов к хосту из настроек делятся между ними, чтобы вместе они не превышали настроек
+    """
+    parser_settings = settings.PARSER_SETTINGS
+    min_delay = parser_settings["MIN_DELAY"] * workers
+    return {
+        "max_concurrency": max(parser_settings["MAX_CONCURRENCY"] // workers, 1),
+        "max_per_host": max(parser_settings["MAX_PER_HOST"] // workers, 1),
+        "start_delay": parser_settings["START_DELAY"] * workers,
+        "min_delay": min_delay,
+        "max_delay": max(parser_settings["MAX_DELAY"], min_delay),
+        "retries": parser_settings["RETRIES"],
+        "timeout": parser_settings["TIMEOUT"],
+    }
+
+
+def get_pipeline(fetcher: AsyncFetcher, parse_workers: Union[int, None] = None,
+                 metrics: Union[ReparseMetrics, None] = None) -> ReparsePipeline:
+    """Конвейер перепарсинга игроков с записью через PlayersLogic в потоке писателя db_writer
+    Args:
+        fetcher: загрузчик страниц
+        parse_workers: количество процессов разбора страниц. По умолчанию - из настроек
+        metrics: сборщик замеров запуска
+    """
+    parser_settings = settings.PARSER_SETTINGS
+    return ReparsePipeline(
+        fetcher=fetcher,
+        save_roster=partial(db_writer.call, PlayersLogic().save_roster),
+        parse_workers=parser_settings["PARSE_WORKERS"] if parse_workers is None else parse_workers,
+        queue_size=parser_settings["QUEUE_SIZE"],
+        metrics=metrics,
+    )
+
+
+def get_metrics(parse_workers: Union[int, None] = None, workers: int = 1) -> ReparseMetrics:
+    """Сборщик замеров перепарсинга с числом параллельных слотов сети и разбора из настроек
+    (слоты сети - как у get_fetcher_settings с тем же workers)
+    """
+    parser_settings = settings.PARSER_SETTINGS
+    if parse_workers is None:
+        parse_workers = parser_settings["PARSE_WORKERS"]
+    return ReparseMetrics(
+        network_slots=get_fetcher_settings(workers=workers)["max_concurrency"], cpu_slots=parse_workers
+    )
+
+
+def get_page_cache() -> Union[PageCache, None]:
+    """Дисковый кэш страниц сайта ГВД. Если каталог не задан - кэш выключен"""
+    cache_dir = settings.PARSER_SETTINGS["CACHE_DIR"]
+    return PageCache(path=cache_dir) if cache_dir else None
+
+
 class KeyLogic(Redis):
     """Логический класс с данными для генерации ключей доступа"""
     def generate_access_key(self, sub_key: str, data: dict) -> int:
@@ -101,6 +184,139 @@ class KeyLogic(Redis):
 
 
 
+class AllianceLogic(Redis):
+    """Альянсы кланов с кэшированием в Redis.
+    Кэшируется и отсутствие альянса, чтобы не запрашивать страницу клана каждый перепарсинг
+    """
+
+    key = "clan:alliance:{clan_id}"
+
+    async def async_get_alliance(self, fetcher: AsyncFetcher, clan_id: int) -> Union[int, None]:
+        """ID альянсового клана из КЭШа, а если его там нет - со страницы клана.
+        Клиент Redis синхронный, поэтому обращаемся к нему из потока, не блокируя цикл событий
+        """
+        key = self.key.format(clan_id=clan_id)
+        try:
+            alliance = await sync_to_async(self.redis.get, thread_sensitive=False)(key)
+            if alliance is not None:
+                return int(alliance) if alliance else None
+        except Exception as _ex:
+            logger.error(f"Ошибка чтения альянса клана №{clan_id} из КЭШа -> {_ex}")
+
+        alliance = await ClansParser().async_get_one_clan_allianse(fetcher=fetcher, clan_id=clan_id)
+        alliance = int(alliance) if alliance else None
+        try:
+            await sync_to_async(self.redis.set, thread_sensitive=False)(
+                key, alliance or "", ex=settings.PARSER_SETTINGS["ALLIANCE_TTL"]
+            )
+        except Exception as _ex:
+            logger.error(f"Ошибка сохранения альянса клана №{clan_id} в КЭШ -> {_ex}")
+        return alliance
+
+    @staticmethod
+    def save_alliances(clans_list_data: List[dict]) -> int:
+        """Записываем найденные альянсы в ClansModel одним bulk_update.
+        Альянс, которого нет среди известных кланов, сбрасывается
+        """
+        resolved = {clan["clan_id"]: clan["alliance"] for clan in clans_list_data if "alliance" in clan}
+        if not resolved:
+            return 0
+        known = set(ClansModel.objects.filter(
+            pk__in={alliance for alliance in resolved.values() if alliance}
+        ).values_list("id", flat=True))
+        clans = [
+            ClansModel(id=clan_id, alliance_id=alliance if alliance in known else None)
+            for clan_id, alliance in resolved.items()
+        ]
+        ClansModel.objects.bulk_update(clans, ["alliance"], batch_size=500)
+        logger.info(f"Сохранил альянсы {len(clans)} кланов")
+        return len(clans)
+
+
+class EmblemLogic:
+    """Локальное зеркало значков кланов.
+
+    Значки скачиваются с сайта ГВД во время перепарсинга и сохраняются под именем sha256
+    содержимого: одинаковые значки лежат на диске один раз, а файл с данным именем никогда
+    не меняется, поэтому его можно отдавать браузеру с кэшированием "навсегда"
+    """
+
+    name_pattern = re.compile(r"^[0-9a-f]{64}\.[a-z0-9]{1,5}$")
+    cache_max_age = 365 * 24 * 60 * 60
+
+    @staticmethod
+    def get_emblems_dir() -> Path:
+        return Path(settings.PARSER_SETTINGS["EMBLEMS_DIR"])
+
+    @staticmethod
+    def get_label(data: ClansModel) -> str:
+        """Адрес значка клана: локальная копия, если она уже скачана, иначе адрес на сайте ГВД"""
+        if data.emblem:
+            return reverse("emblem", kwargs={"name": data.emblem})
+        return data.label
+
+    def get_emblem_path(self, name: str) -> Union[Path, None]:
+        """Путь к файлу значка по его имени. None, если имя некорректное или файла нет"""
+        if not self.name_pattern.match(name):
+            return None
+        path = self.get_emblems_dir() / name
+        return path if path.is_file() else None
+
+    def store(self, url: str, body: bytes) -> str:
+        """Сохраняем значок под именем из хэша содержимого. Возвращает имя файла"""
+        extension = os.path.splitext(urlsplit(url).path)[1].lower() or ".gif"
+        name = f"{hashlib.sha256(body).hexdigest()}{extension}"
+        path = self.get_emblems_dir() / name
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            with os.fdopen(fd, "wb") as file:
+                file.write(body)
+            os.replace(tmp_path, path)
+        return name
+
+    @staticmethod
+    def get_clans_to_mirror(clans_id_list: Union[List[int], None] = None, force: bool = False) -> List[ClansModel]:
+        """Кланы, значок которых еще не скачан или сменил адрес"""
+        clans = ClansModel.objects.exclude(label="")
+        if clans_id_list is not None:
+            clans = clans.filter(pk__in=clans_id_list)
+        if not force:
+            clans = clans.filter(Q(emblem__isnull=True) | ~Q(emblem_url=F("label")))
+        return list(clans.only("id", "label"))
+
+    async def async_download(self, fetcher: AsyncFetcher, clan: ClansModel) -> Union[ClansModel, None]:
+        try:
+            body = await fetcher.fetch(url=clan.label, binary=True)
+        except FetchError as _ex:
+            logger.error(f"Не удалось скачать значок клана №{clan.id} -> {_ex}")
+            return None
+        clan.emblem = await sync_to_async(self.store)(url=clan.label, body=body)
+        clan.emblem_url = clan.label
+        return clan
+
+    async def async_mirror_emblems(self, fetcher: AsyncFetcher, clans_id_list: Union[List[int], None] = None,
+                                   force: bool = False) -> int:
+        """Параллельно скачиваем значки кланов и одним запросом записываем их имена в БД"""
+        clans = await sync_to_async(self.get_clans_to_mirror)(clans_id_list=clans_id_list, force=force)
+        if not clans:
+            return 0
+        downloaded = [
+            clan for clan in await asyncio.gather(*(self.async_download(fetcher=fetcher, clan=clan) for clan in clans))
+            if clan
+        ]
+        await sync_to_async(ClansModel.objects.bulk_update)(downloaded, ["emblem", "emblem_url"], batch_size=500)
+        logger.info(f"Скачал значки {len(downloaded)} кланов из {len(clans)}")
+        return len(downloaded)
+
+    def mirror_emblems(self, force: bool = False) -> int:
+        """Скачиваем значки всех кланов вне перепарсинга"""
+        async def mirror():
+            async with AsyncFetcher(headers=BaseParser.headers, **get_fetcher_settings()) as fetcher:
+                return await self.async_mirror_emblems(fetcher=fetcher, force=force)
+        return async_to_sync(mirror)()
+
+
 class ClansLogic:
     """Логика связанная со взаимодействием с кланами"""
 
@@ -109,7 +325,7 @@ class ClansLogic:
         try:
             data = ClansModel.objects.get(pk=clan_id)
             logger.info(f"Извлеченные данные о клане: №{data.id} {data.name}. Альянс с: {data.alliance}")
-            return {"id": data.id, "name": data.name, "label": data.label, "alliance": self.get_clan_data_without_alliance(data.alliance)}
+            return {"id": data.id, "name": data.name, "label": EmblemLogic.get_label(data), "alliance": self.get_clan_data_without_alliance(data.alliance)}
         except ObjectDoesNotExist:
             logger.error(f"Не найден клан с ID: {clan_id}")
             return None
@@ -119,7 +335,7 @@ class ClansLogic:
         try:
             data = ClansModel.objects.filter(Q(name__icontains=clan_name))
             return [
-                {"id": one_data.id, "name": one_data.name, "label": one_data.label, "alliance": self.get_clan_data_without_alliance(one_data.alliance)}
+                {"id": one_data.id, "name": one_data.name, "label": EmblemLogic.get_label(one_data), "alliance": self.get_clan_data_without_alliance(one_data.alliance)}
                 for one_data in data
             ]
         except ObjectDoesNotExist:
@@ -132,7 +348,7 @@ class ClansLogic:
             return None
         else:
             try:
-                return {"id": alliance_data.id, "name": alliance_data.name, "label": alliance_data.label}
+                return {"id": alliance_data.id, "name": alliance_data.name, "label": EmblemLogic.get_label(alliance_data)}
             except Exception as _ex:
                 logger.error(f"Ошибка с возвращением данных альянса клана: {alliance_data}")
                 return None
@@ -141,8 +357,8 @@ class ClansLogic:
         return {
             "id": data.id,
             "name": data.name,
-            "label": data.label,
-            "alliance": self.get_clan_data_wuthout_alliance(alliance_data=data.alliance)
+            "label": EmblemLogic.get_label(data),
+            "alliance": self.get_clan_data_without_alliance(alliance_data=data.alliance)
         }
 
     @staticmethod
@@ -179,45 +395,248 @@ class ClansLogic:
             logger.error(f"Ошибка при обновлении данных клана №{clan_id} name: {name} -> {_ex}")
             return False
 
-    def reparse_clan_data(self):
-        """Данный метод парсит данные обо всех кланах и обновляет их в БД"""
-        parser = ClansParser()
-        player_logic = PlayersLogic()
+    def reparse_clan_data(self, offline: bool = False, progress: Union["ReparseJobLogic", None] = None,
+                          resume: bool = True, retry_failed: bool = False):
+        """Данный метод парсит данные обо всех кланах и обновляет их в БД.
+        Для каждого клана сохраняется чекпоинт, поэтому прерванный запуск продолжается
+        с первого необработанного клана, а не начинается заново
+        Args:
+            offline: заполнить БД только из кэша страниц, не обращаясь к сайту
+            progress: фоновая задача, в которую сообщается прогресс перепарсинга
+            resume: продолжить последний незавершенный запуск, если он есть
+            retry_failed: повторить только кланы, завершившиеся ошибкой в последнем запуске
+        """
+        run_logic = ReparseRunLogic()
+        run, clans_list_data = self.prepare_run(offline=offline, resume=resume, retry_failed=retry_failed)
+        if progress:
+            progress.start(clans_total=len(clans_list_data), run_id=run.id)
 
-        clans_list_data = parser.pars_clans_data()
-        for i, clan in enumerate(clans_list_data):
-            logger.info(f"Обрабатываю {i + 1} клан из {len(clans_list_data)}")
-            clan["clan_id"] = int(clan["clan_id"])
+        async_to_sync(self.async_reparse_clans)(
+            clans_list_data=clans_list_data, offline=offline, progress=progress, run_id=run.id
+        )
+        run_logic.finish_run(run=run)
+        return {"success": True, "data": "clan data was reparse"}
 
-            self.add_clan(clan_id=clan["clan_id"], name=clan["name"], label=clan["label"])
+    def prepare_run(self, offline: bool = False, resume: bool = True,
+                    retry_failed: bool = False) -> Tuple[ReparseRunModel, List[dict]]:
+        """Определяем запуск перепарсинга и список кланов, которые в нем нужно обработать.
+        Продолжаем прерванный запуск (или повторяем упавшие кланы последнего),
+        иначе парсим список кланов с сайта и создаем новый запуск
+        """
+        run_logic = ReparseRunLogic()
+        if retry_failed:
+            run = run_logic.get_last_run()
+        elif resume:
+            run = run_logic.get_unfinished_run()
+        else:
+            run = None
 
-            clan["alliance"] = parser.get_one_clan_allianse(clan_id=clan["clan_id"])
+        if run:
+            run_logic.reopen_run(run=run)
+            clans_list_data = run_logic.get_run_clans(run=run, only_failed=retry_failed)
+            logger.info(f"Продолжаю запуск перепарсинга №{run.id}: осталось {len(clans_list_data)} кланов")
+        else:
+            parser = ClansParser(cache=get_page_cache(), offline=offline)
+            clans_list_data = parser.pars_clans_data()
+            for i, clan in enumerate(clans_list_data):
+                clan["clan_id"] = int(clan["clan_id"])
+                self.add_clan(clan_id=clan["clan_id"], name=clan["name"], label=clan["label"])
+            run = run_logic.create_run(clans_id_list=[clan["clan_id"] for clan in clans_list_data], offline=offline)
+        return run, clans_list_data
+
+    async def async_reparse_clans(self, clans_list_data: list, offline: bool = False,
+                                  progress: Union["ReparseJobLogic", None] = None, run_id: Union[int, None] = None,
+                                  parse_workers: Union[int, None] = None):
+        """Параллельно загружаем данные кланов и их игроков.
+        Игроки проходят через конвейер ReparsePipeline (загрузка -> разбор в пуле процессов -> запись),
+        а запись в БД выполняется в исходном синхронном потоке через sync_to_async
+        """
+        clans_semaphore = asyncio.Semaphore(settings.PARSER_SETTINGS["MAX_CLANS"])
+        alliances = AllianceLogic()
+        metrics = get_metrics(parse_workers=parse_workers)
+        fetcher = AsyncFetcher(
+            headers=BaseParser.headers, cache=get_page_cache(), offline=offline,
+            on_page=progress.page_fetched if progress else None, metrics=metrics, **get_fetcher_settings()
+        )
+        pipeline = get_pipeline(fetcher=fetcher, parse_workers=parse_workers, metrics=metrics)
+        async with fetcher, pipeline:
+            # значки лежат на другом хосте, поэтому качаются параллельно со страницами кланов
+            emblems = None if offline else asyncio.create_task(EmblemLogic().async_mirror_emblems(
+                fetcher=fetcher, clans_id_list=[clan["clan_id"] for clan in clans_list_data]
+            ))
+            done = await asyncio.gather(*(
+                self.async_reparse_one_clan(
+                    pipeline=pipeline, clan=clan, semaphore=clans_semaphore, progress=progress, run_id=run_id,
+                    alliances=alliances
+                )
+                for clan in clans_list_data
+            ))
+            if emblems:
+                await emblems
+        await asyncio.wrap_future(db_writer.submit(AllianceLogic.save_alliances, clans_list_data=clans_list_data))
+        report = ReparseRunLogic.build_report(metrics=metrics, pipeline=pipeline)
+        if run_id:
+            await sync_to_async(ReparseRunLogic.save_report)(run_id=run_id, report=report)
+        if progress:
+            progress.set_stages(stages=pipeline.report())
+        logger.info(f"Обработал {sum(done)} кланов из {len(clans_list_data)} по данным игроков")
 
-        for i, clan in enumerate(clans_list_data):
-            logger.info("=" * 80)
-            logger.info(f"Обработал {i} кланов из {len(clans_list_data)} по данным игроков")
-            logger.info("=" * 80)
-            player_logic.reparse_one_clan_players(clan_id=clan["clan_id"])
+    @staticmethod
+    async def async_reparse_one_clan(pipeline: ReparsePipeline, clan: dict, semaphore: asyncio.Semaphore,
+                                     progress: Union["ReparseJobLogic", None] = None,
+                                     run_id: Union[int, None] = None,
+                                     alliances: Union[AllianceLogic, None] = None) -> bool:
+        """Загружаем альянс и игроков одного клана.
+        Игроки сохраняются в БД конвейером, пока следующие страницы еще загружаются.
+        Найденный альянс кладется в clan["alliance"], в БД его записывает AllianceLogic.save_alliances
+        """
+        def write(func, **kwargs) -> asyncio.Future:
+            # все записи перепарсинга идут через поток писателя db_writer
+            return asyncio.wrap_future(db_writer.submit(func, **kwargs))
 
-        return {"success": True, "data": "clan data was reparse"}
+        set_clan_state = partial(write, ReparseRunLogic.set_clan_state)
+        alliance = None
+        async with semaphore:
+            try:
+                if run_id:
+                    await set_clan_state(run_id=run_id, clan_id=clan["clan_id"], state=1)
+                alliance = asyncio.create_task(
+                    (alliances or AllianceLogic()).async_get_alliance(fetcher=pipeline.fetcher, clan_id=clan["clan_id"])
+                )
+                await pipeline.process_clan(clan_id=clan["clan_id"])
+                if run_id:
+                    await set_clan_state(run_id=run_id, clan_id=clan["clan_id"], state=2)
+                clan["alliance"] = await alliance
+                await write(ClansModel.objects.filter(pk=clan["clan_id"]).update, refreshed_at=timezone.now())
+                if run_id:
+                    await set_clan_state(run_id=run_id, clan_id=clan["clan_id"], state=3)
+            except Exception as _ex:
+                if alliance and not alliance.done():
+                    alliance.cancel()
+                logger.error(f"Ошибка при обработке клана №{clan['clan_id']} -> {_ex!r}")
+                if run_id:
+                    try:
+                        await set_clan_state(run_id=run_id, clan_id=clan["clan_id"], state=4, error=repr(_ex))
+                    except Exception as _state_ex:
+                        logger.error(f"Не удалось отметить ошибку клана №{clan['clan_id']} -> {_state_ex!r}")
+                if progress:
+                    progress.clan_done(clan_id=clan["clan_id"], error=repr(_ex))
+                return False
+        if progress:
+            progress.clan_done(clan_id=clan["clan_id"])
+        return True
 
 
 class PlayersLogic:
-    parser = PlayerParser()
+    parser = PlayerParser(cache=get_page_cache())
 
     """Логика связанная со взаимодействием с игроками"""
+    # поля, которые перезаписываются у существующего игрока при upsert
+    upsert_fields = ["name", "level", "clan", *PLAYER_STATS_FIELDS, "fingerprint"]
+
     def reparse_one_clan_players(self, clan_id: int):
-        """Данный метод парсит данные всех игроков из одного клана и заносит их в БД/Обновляет существующих"""
-        total_list = []
-        clan = ClansModel.objects.get(pk=clan_id)
-        players_data = self.parser.parse_one_clan_data(clan_id=clan_id, total_list=total_list)
-        for player in players_data:
-            add = self.add_new_player(in_data=player.model_dump())
-            if not add:
-                self.update_player_data(in_data=player.model_dump())
-        players_id_list = [player.id for player in players_data]
-        players_not_in_list = PlayersModel.objects.filter(clan=clan).exclude(id__in=players_id_list).update(clan=None)
+        """Данный метод парсит данные всех игроков из одного клана и заносит их в БД/Обновляет существующих.
+        Страницы загружаются целиком, а состав клана записывается в БД одной транзакцией
+        """
+        players_data = []
+        for page_players in self.parser.iter_clan_pages(clan_id=clan_id):
+            players_data.extend(page_players)
+        self.save_roster(clan_id=clan_id, players_data=players_data)
+
+    def save_roster(self, clan_id: int, players_data: List[PlayerSchem]) -> Tuple[int, int]:
+        """Применяем полный состав клана одной короткой транзакцией: upsert изменившихся игроков,
+        история и открепление ушедших. Сравнение с сохраненными данными выполняется до транзакции,
+        поэтому блокировка записи держится только на время самих INSERT/UPDATE, а читатели видят
+        либо прежний, либо новый состав клана.
+        Возвращает (количество записанных игроков, количество открепленных игроков)
+        """
+        objects, history = self.prepare_players(players_data=players_data)
+        with transaction.atomic():
+            self.write_players(objects=objects, history=history)
+            detached = self.detach_players(clan_id=clan_id, players_id_list=[player.id for player in players_data])
+        return len(objects), detached
+
+    @staticmethod
+    def get_fingerprint(player: PlayerSchem) -> str:
+        """Отпечаток всех разобранных полей игрока"""
+        return hashlib.blake2b(json.dumps(player.model_dump(), sort_keys=True).encode(), digest_size=16).hexdigest()
+
+    def prepare_players(self, players_data: List[PlayerSchem]) -> Tuple[List[PlayersModel],
+                                                                        List[PlayerStatsHistoryModel]]:
+        """Строки игроков и истории, которые нужно записать: запрос на проверку кланов и запрос сохраненных данных.
+        Строки, отпечаток которых совпадает с сохраненным, не пишутся. Игроки кланов, которых нет в БД, пропускаются
+        """
+        if not players_data:
+            return [], []
+        # если игрок встретился дважды (перешел в другой клан во время загрузки), берем последнюю строку
+        players = {player.id: player for player in players_data}
+        clans = set(ClansModel.objects.filter(
+            pk__in={player.clan for player in players.values()}
+        ).values_list("id", flat=True))
+        stored = {
+            row.pop("id"): row
+            for row in PlayersModel.objects.filter(pk__in=players).values("id", *PlayerHistoryLogic.stored_fields)
+        }
+        objects = []
+        history = []
+        date = timezone.now()
+        skipped = 0
+        for player in players.values():
+            if player.clan not in clans:
+                skipped += 1
+                continue
+            fingerprint = self.get_fingerprint(player=player)
+            old = stored.get(player.id)
+            if old and old["fingerprint"] == fingerprint:
+                continue
+            objects.append(PlayersModel(
+                clan_id=player.clan, fingerprint=fingerprint, **player.model_dump(exclude={"clan"})
+            ))
+            changes = PlayerHistoryLogic.get_changes(old=old, new=player)
+            if changes:
+                history.append(PlayerStatsHistoryModel(player_id=player.id, date=date, changes=changes))
+        if skipped:
+            logger.error(f"Пропустил {skipped} игроков кланов, которых нет в БД")
+        logger.debug(f"К записи {len(objects)} игроков, без изменений {len(players) - skipped - len(objects)}")
+        return objects, history
+
+    def write_players(self, objects: List[PlayersModel], history: List[PlayerStatsHistoryModel]):
+        """INSERT ... ON CONFLICT DO UPDATE игроков и вставка истории: по запросу на каждые batch_size строк"""
+        if not objects:
+            return
+        PlayersModel.objects.bulk_create(
+            objects, update_conflicts=True, unique_fields=["id"], update_fields=self.upsert_fields
+        )
+        PlayerStatsHistoryModel.objects.bulk_create(history)
+
+    def upsert_players(self, players_data: List[PlayerSchem]) -> int:
+        """Заносим в БД новых игроков и обновляем данные уже существующих вместе с изменениями
+        в историю характеристик одной транзакцией. Возвращает количество записанных (изменившихся) игроков
+        """
+        objects, history = self.prepare_players(players_data=players_data)
+        if objects:
+            with transaction.atomic():
+                self.write_players(objects=objects, history=history)
+        return len(objects)
 
+    @staticmethod
+    def detach_players(clan_id: int, players_id_list: List[int]) -> int:
+        """Открепляем от клана одним UPDATE игроков, которых в нем больше нет, и в той же транзакции
+        записываем им в историю уход из клана ({"clan": None}).
+        Отпечаток сбрасывается (в нем учтен клан), иначе вернувшийся в клан игрок с прежними данными
+        был бы пропущен как неизменившийся
+        """
+        players = PlayersModel.objects.filter(clan_id=clan_id).exclude(id__in=players_id_list)
+        with transaction.atomic(savepoint=False):
+            detached_id_list = list(players.values_list("id", flat=True))
+            if not detached_id_list:
+                return 0
+            date = timezone.now()
+            PlayerStatsHistoryModel.objects.bulk_create([
+                PlayerStatsHistoryModel(player_id=player_id, date=date, changes={"clan": None})
+                for player_id in detached_id_list
+            ])
+            return players.update(clan=None, fingerprint="")
 
     def get_players_data(self, player_filter: dict) -> Union[list, dict, None]:
         """Данный метод извлекает данные об игроках или об одном игроке
@@ -232,11 +651,19 @@ class PlayersLogic:
     def get_player_data_by_filter(self, player_filter: dict, voevoda_id: Union[int, None] = None) -> Union[list, None]:
         """Данный метод возвращает данные об игроках по фильтру
         Например id клана и т.п.
+        Состав читается одним запросом через .values() (без создания моделей) в том же виде,
+        что и serialize_one_player_data: person_id игрока у воеводы подставляется подзапросом
         """
         clan_id = player_filter.get("clan_id")
         try:
             data = PlayersModel.objects.filter(clan_id=clan_id)
-            return [self.serialize_one_player_data(data=one_data, voevoda_id=voevoda_id) for one_data in data]
+            if voevoda_id:
+                data = data.annotate(person_id=Subquery(PersonsModel.objects.filter(
+                    player_id=OuterRef("pk"), voevoda_id=voevoda_id
+                ).order_by("id").values("id")[:1]))
+            else:
+                data = data.annotate(person_id=Value(None, output_field=IntegerField()))
+            return list(data.values("id", "name", "level", "clan", *PLAYER_STATS_FIELDS, "person_id"))
         except ObjectDoesNotExist:
             logger.error(f"Не игрока по фильтру: {player_filter}")
             return None
@@ -266,35 +693,16 @@ class PlayersLogic:
                     person_id = person_data.id
             except ObjectDoesNotExist:
                 person_id = None
-        return {
+        player_data = {
             "id": data.id,
             "name": data.name,
             "level": data.level,
             "clan": clan_id,
-            "umka_knight": data.umka_knight,
-            "umka_necro": data.umka_necro,
-            "umka_mag": data.umka_mag,
-            "umka_elf": data.umka_elf,
-            "umka_barbar": data.umka_barbar,
-            "umka_black_elf": data.umka_black_elf,
-            "umka_demon": data.umka_demon,
-            "umka_dwarf": data.umka_dwarf,
-            "umka_step_barb": data.umka_step_barb,
-            "umka_pharaon": data.umka_pharaon,
-            "gild_hunt": data.gild_hunt,
-            "gild_work": data.gild_work,
-            "gild_card": data.gild_card,
-            "gild_thief": data.gild_thief,
-            "gild_ranger": data.gild_ranger,
-            "gild_mers": data.gild_mers,
-            "gild_tactic": data.gild_tactic,
-            "gild_gard": data.gild_gard,
-            "gild_seekers": data.gild_seekers,
-            "gild_leader": data.gild_leader,
-            "gild_blacksmith": data.gild_blacksmith,
-            "gild_gunsmith": data.gild_gunsmith,
-            "person_id": person_id
         }
+        for field in PLAYER_STATS_FIELDS:
+            player_data[field] = getattr(data, field)
+        player_data["person_id"] = person_id
+        return player_data
 
     def add_new_player(self, in_data: dict) -> Union[dict, None]:
         """Данный метод заносит нового игрока в БД"""
@@ -317,7 +725,8 @@ class PlayersLogic:
             if in_data["clan"]:
                 in_data["clan"] = ClansModel.objects.get(pk=in_data["clan"])
 
-            PlayersModel.objects.filter(id=player_id).update(**in_data)
+            # данные изменены не парсером - следующий перепарсинг должен перезаписать строку
+            PlayersModel.objects.filter(id=player_id).update(fingerprint="", **in_data)
             logger.info(f"Обновил данные по игроку: {player_id} {in_data['name']}")
             return True
         except Exception as _ex:
@@ -325,6 +734,836 @@ class PlayersLogic:
             return False
 
 
+class PlayerHistoryLogic:
+    """История характеристик персонажей (PlayerStatsHistoryModel) и ряды значений по ней"""
+
+    # поля, изменения которых попадают в историю
+    history_fields = ["name", "level", "clan", *PLAYER_STATS_FIELDS]
+    # те же поля в PlayersModel (клан хранится в clan_id) и отпечаток строки
+    stored_fields = ["name", "level", "clan_id", *PLAYER_STATS_FIELDS, "fingerprint"]
+    # период по умолчанию, если начало не передано
+    default_period = datetime.timedelta(days=30)
+
+    @classmethod
+    def get_changes(cls, old: Union[dict, None], new: PlayerSchem) -> dict:
+        """Изменившиеся поля игрока. Для нового игрока (old is None) - все поля"""
+        new_data = new.model_dump(include=set(cls.history_fields))
+        if old is None:
+            return new_data
+        old = {**old, "clan": old.get("clan_id")}
+        return {field: value for field, value in new_data.items() if old.get(field) != value}
+
+    @staticmethod
+    def build_series(rows: List[Tuple[datetime.datetime, dict]], date_from: datetime.datetime) -> dict:
+        """Ряды значений полей {поле: [[timestamp, значение], ...]} из упорядоченных по дате изменений.
+        Первая точка каждого ряда - значение на date_from (если оно было известно),
+        далее только моменты изменения поля
+        """
+        state = {}
+        series = None
+        for date, changes in rows:
+            if date < date_from:
+                state.update(changes)
+                continue
+            if series is None:
+                series = {field: [[date_from.timestamp(), value]] for field, value in state.items()}
+            for field, value in changes.items():
+                series.setdefault(field, []).append([date.timestamp(), value])
+        if series is None:
+            series = {field: [[date_from.timestamp(), value]] for field, value in state.items()}
+        return series
+
+    @classmethod
+    def get_period(cls, date_from: Union[float, None] = None,
+                   date_to: Union[float, None] = None) -> Tuple[datetime.datetime, datetime.datetime]:
+        """Период запроса из timestamp. По умолчанию - последние default_period до текущего момента"""
+        date_to = datetime.datetime.fromtimestamp(float(date_to), tz=datetime.timezone.utc) if date_to \
+            else timezone.now()
+        date_from = datetime.datetime.fromtimestamp(float(date_from), tz=datetime.timezone.utc) if date_from \
+            else date_to - cls.default_period
+        return date_from, date_to
+
+    @classmethod
+    def get_players_series(cls, players_id_list: List[int], date_from: datetime.datetime,
+                           date_to: datetime.datetime) -> dict:
+        """Ряды значений нескольких игроков одним запросом по индексу (player, date)"""
+        rows = {player_id: [] for player_id in players_id_list}
+        history = PlayerStatsHistoryModel.objects.filter(
+            player_id__in=players_id_list, date__lte=date_to
+        ).order_by("player_id", "date").values_list("player_id", "date", "changes")
+        for player_id, date, changes in history:
+            rows[player_id].append((date, changes))
+        return {player_id: cls.build_series(rows=player_rows, date_from=date_from)
+                for player_id, player_rows in rows.items()}
+
+    def get_history(self, player_id: Union[int, None] = None, clan_id: Union[int, None] = None,
+                    date_from: Union[float, None] = None, date_to: Union[float, None] = None) -> Union[dict, None]:
+        """История одного игрока или всех текущих игроков клана за период"""
+        date_from, date_to = self.get_period(date_from=date_from, date_to=date_to)
+        if player_id:
+            players_id_list = [int(player_id)]
+        elif clan_id:
+            players_id_list = list(PlayersModel.objects.filter(clan_id=clan_id).values_list("id", flat=True))
+        else:
+            return None
+        series = self.get_players_series(players_id_list=players_id_list, date_from=date_from, date_to=date_to)
+        data = {
+            "date_from": date_from.timestamp(),
+            "date_to": date_to.timestamp(),
+        }
+        if player_id:
+            return {**data, "player_id": int(player_id), "series": series[int(player_id)]}
+        return {**data, "clan_id": int(clan_id), "players": series}
+
+
+class ReparseRunLogic:
+    """Запуски перепарсинга и чекпоинты обработки кланов внутри них"""
+
+    @staticmethod
+    def create_run(clans_id_list: List[int], offline: bool = False) -> ReparseRunModel:
+        """Новый запуск с чекпоинтами в состоянии "Ожидает" для всех кланов"""
+        run = ReparseRunModel.objects.create(offline=offline)
+        ReparseCheckpointModel.objects.bulk_create(
+            [ReparseCheckpointModel(run=run, clan_id=clan_id) for clan_id in clans_id_list]
+        )
+        logger.info(f"Создал запуск перепарсинга №{run.id} на {len(clans_id_list)} кланов")
+        return run
+
+    @staticmethod
+    def get_last_run() -> Union[ReparseRunModel, None]:
+        return ReparseRunModel.objects.order_by("-id").first()
+
+    def get_unfinished_run(self) -> Union[ReparseRunModel, None]:
+        """Последний запуск, если он был прерван (остался в состоянии "Выполняется")"""
+        run = self.get_last_run()
+        if run and run.state == 1:
+            return run
+        return None
+
+    @staticmethod
+    def get_run_clans(run: ReparseRunModel, only_failed: bool = False) -> List[dict]:
+        """Кланы запуска, которые еще нужно обработать, в исходном порядке"""
+        checkpoints = run.checkpoints.filter(state=4) if only_failed else run.checkpoints.exclude(state=3)
+        return [{"clan_id": clan_id} for clan_id in checkpoints.order_by("id").values_list("clan_id", flat=True)]
+
+    @staticmethod
+    def reopen_run(run: ReparseRunModel):
+        """Возвращаем запуск в работу, чтобы продолжить его или повторить упавшие кланы"""
+        ReparseRunModel.objects.filter(pk=run.pk).update(state=1, finished_at=None)
+
+    @staticmethod
+    def set_clan_state(run_id: int, clan_id: int, state: int, error: Union[str, None] = None):
+        ReparseCheckpointModel.objects.filter(run_id=run_id, clan_id=clan_id).update(
+            state=state, error=error, updated_at=timezone.now()
+        )
+
+    @staticmethod
+    def finish_run(run: ReparseRunModel):
+        """Закрываем запуск. Если какие-то кланы не сохранены - запуск завершен с ошибками"""
+        failed = run.checkpoints.exclude(state=3).count()
+        ReparseRunModel.objects.filter(pk=run.pk).update(state=3 if failed else 2, finished_at=timezone.now())
+        logger.info(f"Запуск перепарсинга №{run.id} завершен, кланов с ошибками: {failed}")
+
+    @staticmethod
+    def build_report(metrics: ReparseMetrics, pipeline: Union[ReparsePipeline, None] = None) -> dict:
+        """Отчет о работе процесса перепарсинга: замеры metrics и пропускная способность стадий конвейера"""
+        metrics.finish()
+        report = metrics.report()
+        if pipeline:
+            report["stages"] = pipeline.report()
+        logger.info(f"Отчет перепарсинга: {ReparseRunLogic.summarize_report(report=report)}")
+        return report
+
+    @staticmethod
+    def save_report(run_id: int, report: dict, worker_id: str = "main"):
+        """Сохраняем отчет процесса в запуск. Каждый воркер очереди пишет свой отчет под своим ID"""
+        with transaction.atomic():
+            run = ReparseRunModel.objects.select_for_update().get(pk=run_id)
+            reports = run.report or {}
+            # при продолжении запуска отчеты новых проходов добавляются к прежним
+            key = worker_id if worker_id not in reports else f"{worker_id}-{len(reports)}"
+            reports[key] = report
+            run.report = reports
+            run.save(update_fields=["report"])
+
+    @staticmethod
+    def summarize_report(report: dict) -> dict:
+        """Краткая сводка отчета одного процесса: во что уперлись и основные перцентили"""
+        latency = report["requests"]["latency"]
+        parse_time = report["parse"]["time"]
+        write_time = report["db"]["time"]
+        return {
+            "elapsed_sec": report["elapsed_sec"],
+            "bound": report["bound"],
+            "utilization": report["utilization"],
+            "requests": report["requests"]["count"],
+            "bytes": report["requests"]["bytes"],
+            "status": report["requests"]["status"],
+            "latency_p50": latency.get("p50"),
+            "latency_p99": latency.get("p99"),
+            "pages_parsed": report["parse"]["pages"],
+            "parse_p50": parse_time.get("p50"),
+            "parse_p99": parse_time.get("p99"),
+            "changed": report["db"]["changed"],
+            "unchanged": report["db"]["unchanged"],
+            "detached": report["db"]["detached"],
+            "write_p99": write_time.get("p99"),
+        }
+
+    def get_run_report(self, run_id: Union[int, None] = None) -> Union[dict, None]:
+        """Отчет запуска по ID, а без ID - последнего запуска, со сводкой по каждому процессу"""
+        run = ReparseRunModel.objects.filter(pk=run_id).first() if run_id else self.get_last_run()
+        if not run:
+            return None
+        reports = run.report or {}
+        summary = {worker_id: self.summarize_report(report=report) for worker_id, report in reports.items()}
+        return {
+            "run_id": run.id,
+            "state": run.state,
+            "started_at": run.started_at,
+            "finished_at": run.finished_at,
+            "totals": {
+                key: sum(worker[key] for worker in summary.values())
+                for key in ("requests", "bytes", "pages_parsed", "changed", "unchanged", "detached")
+            },
+            "summary": summary,
+            "reports": reports,
+        }
+
+
+class ReparseLock(Redis):
+    """Блокировка перепарсинга: одновременно идет не больше одного перепарсинга кланов -
+    фоновая задача API, manage.py reparse_clans или запуск очереди reparse_workers.
+
+    Владелец блокировки (ID задачи API, "cli:..." или "queue") лежит в Redis под ключом key
+    с ограниченным временем жизни: владелец продлевает его, пока работает, а блокировка
+    упавшего процесса освобождается сама
+    """
+
+    key = "reparse:active"
+    live_time = 300
+
+    def acquire(self, owner: str) -> Union[str, None]:
+        """Берем блокировку для owner (если она уже у owner - продлеваем).
+        Возвращает None, если блокировка у owner, иначе ее текущего владельца
+        """
+        while True:
+            if self.redis.set(self.key, owner, nx=True, ex=self.live_time):
+                return None
+            active = self.redis.get(self.key)
+            if active is None:
+                # блокировка истекла между командами - пробуем еще раз
+                continue
+            if active.decode() != owner:
+                return active.decode()
+            self.redis.expire(self.key, self.live_time)
+            return None
+
+    def get_owner(self) -> Union[str, None]:
+        active = self.redis.get(self.key)
+        return active.decode() if active else None
+
+    def release(self, owner: str):
+        """Снимаем блокировку, если она еще у owner"""
+        if self.redis.get(self.key) == owner.encode():
+            self.redis.delete(self.key)
+
+    @contextmanager
+    def hold(self, owner: str):
+        """Держим блокировку, пока выполняется блок (продлевается в отдельном потоке).
+        Если перепарсинг уже идет, выбрасывается RuntimeError
+        """
+        active = self.acquire(owner=owner)
+        if active:
+            raise RuntimeError(f"Перепарсинг уже выполняется: {active}")
+        stop = threading.Event()
+
+        def keep_alive():
+            while not stop.wait(self.live_time / 3):
+                if self.acquire(owner=owner):
+                    logger.error(f"Блокировку перепарсинга {owner} перехватил другой процесс")
+
+        thread = threading.Thread(target=keep_alive, name=f"reparse-lock-{owner}", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+            self.release(owner=owner)
+
+
+class ReparseJobLogic(Redis):
+    """Фоновая задача полного перепарсинга кланов.
+
+    Одновременно выполняется не более одной задачи: ее ID - владелец блокировки ReparseLock,
+    которая продлевается, пока задача сообщает о прогрессе. Пока блокировку держит reparse_clans
+    или очередь, задача не запускается.
+    Состояние задачи (ReparseJobSchem) хранится в Redis, поэтому его видит любой процесс сервера
+    """
+
+    job_live_time = 7 * 24 * 60 * 60
+    flush_interval = 1.0
+    max_errors = 50
+
+    def __init__(self, job_id: Union[str, None] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.job_id = job_id
+        self.job: Union[schemas.ReparseJobSchem, None] = None
+        self.lock = ReparseLock(**kwargs)
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+
+    @staticmethod
+    def job_key(job_id: str) -> str:
+        return f"reparse:job:{job_id}"
+
+    def start_job(self, offline: bool = False, retry_failed: bool = False) -> dict:
+        """Запускаем перепарсинг в фоновом потоке.
+        Если задача уже идет, новая не запускается - возвращается ID текущей.
+        Если перепарсинг идет вне API (reparse_clans или очередь), задачи нет: job_id = None,
+        а в active - владелец блокировки
+        """
+        job_id = uuid.uuid4().hex
+        active = self.lock.acquire(owner=job_id)
+        if active:
+            if self.get_job(job_id=active):
+                logger.info(f"Перепарсинг уже выполняется задачей {active}, подключаюсь к ней")
+                return {"job_id": active, "attached": True}
+            logger.info(f"Перепарсинг уже выполняется вне API: {active}")
+            return {"job_id": None, "attached": False, "active": active}
+
+        self.job_id = job_id
+        self.job = schemas.ReparseJobSchem(job_id=job_id, started_at=time.time())
+        self.flush(force=True)
+        threading.Thread(
+            target=self.run_job, kwargs={"offline": offline, "retry_failed": retry_failed},
+            name=f"reparse-{job_id}", daemon=True
+        ).start()
+        logger.info(f"Запустил фоновый перепарсинг кланов: {job_id}")
+        return {"job_id": job_id, "attached": False}
+
+    def run_job(self, offline: bool = False, retry_failed: bool = False):
+        """Тело фоновой задачи"""
+        try:
+            ClansLogic().reparse_clan_data(offline=offline, progress=self, retry_failed=retry_failed)
+            self.job.state = "done"
+        except Exception as _ex:
+            logger.error(f"Ошибка фонового перепарсинга {self.job_id} -> {_ex}")
+            self.job.state = "failed"
+            self.job.errors.append(str(_ex))
+        finally:
+            self.job.finished_at = time.time()
+            self.job.eta = None
+            self.flush(force=True)
+            self.lock.release(owner=self.job_id)
+            connections.close_all()
+
+    def get_job(self, job_id: Union[str, None] = None) -> Union[dict, None]:
+        """Состояние задачи по ID, а без ID - текущей выполняемой задачи"""
+        if not job_id:
+            job_id = self.lock.get_owner()
+            if not job_id:
+                return None
+        job = self.get_data_from_cache(key=self.job_key(job_id), data_class=schemas.ReparseJobSchem)
+        return job.model_dump() if job else None
+
+    def start(self, clans_total: int, run_id: Union[int, None] = None):
+        with self._lock:
+            self.job.clans_total = clans_total
+            self.job.run_id = run_id
+        self.flush(force=True)
+
+    def set_stages(self, stages: dict):
+        with self._lock:
+            self.job.stages = stages
+        self.flush(force=True)
+
+    def page_fetched(self, page=None):
+        with self._lock:
+            self.job.pages_fetched += 1
+        self.flush()
+
+    def clan_done(self, clan_id: int, error: Union[str, None] = None):
+        with self._lock:
+            self.job.clans_done += 1
+            if error:
+                self.job.clans_failed += 1
+                if len(self.job.errors) < self.max_errors:
+                    self.job.errors.append(f"Клан №{clan_id}: {error}")
+            elapsed = time.time() - self.job.started_at
+            self.job.eta = round(elapsed / self.job.clans_done * (self.job.clans_total - self.job.clans_done), 1)
+        self.flush()
+
+    def flush(self, force: bool = False):
+        """Сохраняем состояние задачи в Redis (не чаще раза в flush_interval) и продлеваем блокировку"""
+        now = time.monotonic()
+        if not force and now - self._last_flush < self.flush_interval:
+            return
+        self._last_flush = now
+        with self._lock:
+            job = self.job.model_copy(deep=True)
+        self.set_data_in_cache(key=self.job_key(self.job_id), value=job, live_time=self.job_live_time)
+        if job.state == "running":
+            self.lock.acquire(owner=self.job_id)
+
+
+class ReparseQueueLogic(Redis):
+    """Распределенная очередь перепарсинга кланов.
+
+    Запуск перепарсинга раскладывается на задания по одному клану в список pending_key.
+    Воркер забирает задание вместе с арендой: в сортированном множестве leases_key у клана
+    хранится время, до которого аренда действует. Пока клан обрабатывается, воркер продлевает
+    аренду (heartbeat), а задания с истекшей арендой (воркер упал или завис) любой воркер
+    возвращает в очередь. Воркеры могут работать в нескольких процессах и на разных машинах,
+    если у них общие Redis и БД.
+
+    workers - сколько воркеров запущено на машине: лимиты загрузки из настроек делятся между ними
+    (см. get_fetcher_settings), а страницы каждый воркер разбирает в parse_workers процессах
+    вместо PARSE_WORKERS - параллельность разбора дают сами воркеры.
+
+    Запуск очереди держит блокировку перепарсинга ReparseLock от имени lock_owner: ее берет
+    enqueue_run, продлевают воркеры и снимает воркер, закрывший запуск
+    """
+
+    pending_key = "reparse:queue:pending"
+    leases_key = "reparse:queue:leases"
+    attempts_key = "reparse:queue:attempts"
+    run_key = "reparse:queue:run"
+    lease_time = 120
+    heartbeat_interval = 20
+    poll_interval = 1.0
+    max_attempts = 3
+    parse_workers = 1
+    lock_owner = "queue"
+
+    # забираем задание и сразу берем его в аренду, чтобы оно не потерялось между командами
+    claim_script = """
+        local clan_id = redis.call('LPOP', KEYS[1])
+        if clan_id then
+            redis.call('ZADD', KEYS[2], ARGV[1], clan_id)
+            redis.call('HINCRBY', KEYS[3], clan_id, 1)
+        end
+        return clan_id
+    """
+    requeue_script = """
+        local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+        for _, clan_id in ipairs(expired) do
+            redis.call('ZREM', KEYS[1], clan_id)
+            redis.call('RPUSH', KEYS[2], clan_id)
+        end
+        return expired
+    """
+
+    def __init__(self, worker_id: Union[str, None] = None, workers: int = 1, **kwargs):
+        super().__init__(**kwargs)
+        self.worker_id = worker_id or uuid.uuid4().hex[:8]
+        self.workers = workers
+        self.lock = ReparseLock(**kwargs)
+        self._claim = self.redis.register_script(self.claim_script)
+        self._requeue = self.redis.register_script(self.requeue_script)
+
+    def enqueue_run(self, offline: bool = False, resume: bool = True, retry_failed: bool = False) -> dict:
+        """Раскладываем кланы запуска перепарсинга по заданиям очереди.
+        Если в очереди еще есть задания или перепарсинг идет вне очереди (в state["active"] - владелец
+        блокировки), новый запуск не создается
+        """
+        state = self.get_queue_state()
+        if state["pending"] or state["leased"]:
+            logger.info(f"Очередь перепарсинга еще не разобрана: {state}")
+            return state
+        active = self.lock.acquire(owner=self.lock_owner)
+        if active:
+            logger.info(f"Перепарсинг уже выполняется: {active}, запуск в очередь не ставлю")
+            return {**state, "active": active}
+
+        try:
+            run, clans_list_data = ClansLogic().prepare_run(
+                offline=offline, resume=resume, retry_failed=retry_failed
+            )
+        except Exception:
+            self.lock.release(owner=self.lock_owner)
+            raise
+        pipe = self.redis.pipeline()
+        pipe.delete(self.pending_key, self.leases_key, self.attempts_key)
+        pipe.hset(self.run_key, mapping={"run_id": run.id, "offline": int(offline)})
+        if clans_list_data:
+            pipe.rpush(self.pending_key, *[clan["clan_id"] for clan in clans_list_data])
+        pipe.execute()
+        logger.info(f"Поставил в очередь {len(clans_list_data)} кланов запуска перепарсинга №{run.id}")
+        return self.get_queue_state()
+
+    def get_queue_state(self) -> dict:
+        run = self.get_run()
+        return {
+            "run_id": run["run_id"] if run else None,
+            "pending": self.redis.llen(self.pending_key),
+            "leased": self.redis.zcard(self.leases_key),
+        }
+
+    def get_run(self) -> Union[dict, None]:
+        """Запуск перепарсинга, задания которого лежат в очереди"""
+        run = self.redis.hgetall(self.run_key)
+        if not run:
+            return None
+        return {"run_id": int(run[b"run_id"]), "offline": bool(int(run[b"offline"]))}
+
+    def claim(self) -> Union[int, None]:
+        """Забираем следующий клан из очереди в аренду"""
+        clan_id = self._claim(
+            keys=[self.pending_key, self.leases_key, self.attempts_key], args=[time.time() + self.lease_time]
+        )
+        return int(clan_id) if clan_id is not None else None
+
+    def heartbeat(self, clans_id_list: List[int]):
+        """Продлеваем аренду кланов, которые воркер еще обрабатывает"""
+        if clans_id_list:
+            expire_at = time.time() + self.lease_time
+            self.redis.zadd(self.leases_key, {clan_id: expire_at for clan_id in clans_id_list}, xx=True)
+
+    def complete(self, clan_id: int):
+        self.redis.zrem(self.leases_key, clan_id)
+
+    def requeue_expired(self) -> List[int]:
+        """Возвращаем в очередь задания, аренду которых перестали продлевать"""
+        expired = [int(clan_id) for clan_id in self._requeue(
+            keys=[self.leases_key, self.pending_key], args=[time.time()]
+        )]
+        if expired:
+            logger.warning(f"Истекла аренда кланов {expired}, возвращаю их в очередь")
+        return expired
+
+    def run_worker(self) -> int:
+        """Разбираем очередь, пока в ней есть задания. Возвращает число обработанных кланов"""
+        try:
+            return async_to_sync(self.async_run_worker)()
+        finally:
+            connections.close_all()
+
+    async def async_run_worker(self) -> int:
+        run = self.get_run()
+        if not run:
+            logger.info(f"Воркер {self.worker_id}: очередь перепарсинга пуста")
+            return 0
+
+        max_clans = settings.PARSER_SETTINGS["MAX_CLANS"]
+        semaphore = asyncio.Semaphore(max_clans)
+        held = set()
+        tasks = set()
+        processed = 0
+        # обработанные кланы с найденными альянсами - запишем их в БД одним запросом в конце
+        clans_list_data = []
+        alliances = AllianceLogic()
+        metrics = get_metrics(parse_workers=self.parse_workers, workers=self.workers)
+        fetcher = AsyncFetcher(
+            headers=BaseParser.headers, cache=get_page_cache(), offline=run["offline"], metrics=metrics,
+            **get_fetcher_settings(workers=self.workers)
+        )
+        pipeline = get_pipeline(fetcher=fetcher, parse_workers=self.parse_workers, metrics=metrics)
+        logger.info(f"Воркер {self.worker_id} разбирает очередь запуска перепарсинга №{run['run_id']}")
+        async with fetcher, pipeline:
+            heartbeat = asyncio.create_task(self.heartbeat_loop(held=held))
+            try:
+                while True:
+                    if len(tasks) >= max_clans:
+                        done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                        processed += self.collect(done=done)
+                        continue
+                    self.requeue_expired()
+                    clan_id = self.claim()
+                    if clan_id is not None:
+                        held.add(clan_id)
+                        clan = {"clan_id": clan_id}
+                        clans_list_data.append(clan)
+                        tasks.add(asyncio.create_task(self.process_clan(
+                            pipeline=pipeline, clan=clan, run_id=run["run_id"], semaphore=semaphore, held=held,
+                            alliances=alliances
+                        ), name=f"clan-{clan_id}"))
+                    elif tasks:
+                        done, tasks = await asyncio.wait(
+                            tasks, timeout=self.poll_interval, return_when=asyncio.FIRST_COMPLETED
+                        )
+                        processed += self.collect(done=done)
+                    elif self.redis.zcard(self.leases_key):
+                        # кланы в аренде у других воркеров - ждем, вдруг аренда истечет
+                        await asyncio.sleep(self.poll_interval)
+                    else:
+                        break
+            finally:
+                heartbeat.cancel()
+        await asyncio.wrap_future(db_writer.submit(AllianceLogic.save_alliances, clans_list_data=clans_list_data))
+        await sync_to_async(ReparseRunLogic.save_report)(
+            run_id=run["run_id"], report=ReparseRunLogic.build_report(metrics=metrics, pipeline=pipeline),
+            worker_id=self.worker_id
+        )
+
+        # запуск закрывает тот воркер, который первым увидел пустую очередь
+        if self.redis.delete(self.run_key):
+            await sync_to_async(ReparseRunLogic.finish_run)(
+                run=await sync_to_async(ReparseRunModel.objects.get)(pk=run["run_id"])
+            )
+            self.lock.release(owner=self.lock_owner)
+        logger.info(f"Воркер {self.worker_id} завершил работу, обработано кланов: {processed}")
+        return processed
+
+    def collect(self, done: set) -> int:
+        """Забираем результаты завершенных задач воркера. Возвращает число успешно обработанных кланов"""
+        processed = 0
+        for task in done:
+            try:
+                processed += bool(task.result())
+            except Exception as _ex:
+                logger.error(f"Воркер {self.worker_id}: задача {task.get_name()} упала -> {_ex!r}")
+        return processed
+
+    async def heartbeat_loop(self, held: set):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            self.heartbeat(clans_id_list=list(held))
+            # закрытый запуск блокировку уже снял - не берем ее заново
+            active = self.lock.acquire(owner=self.lock_owner) if self.redis.exists(self.run_key) else None
+            if active:
+                logger.error(f"Воркер {self.worker_id}: блокировку перепарсинга держит {active}")
+
+    async def process_clan(self, pipeline: ReparsePipeline, clan: dict, run_id: int,
+                           semaphore: asyncio.Semaphore, held: set, alliances: AllianceLogic) -> bool:
+        """Обрабатываем один клан из очереди. Возвращает True, если клан обработан успешно.
+        Если воркер прервут посреди обработки, аренда не снимается и клан вернется в очередь
+        """
+        clan_id = clan["clan_id"]
+        try:
+            attempts = int(self.redis.hget(self.attempts_key, clan_id) or 0)
+            if attempts > self.max_attempts:
+                logger.error(f"Клан №{clan_id} брали в работу {attempts} раз, пропускаю его")
+                await sync_to_async(ReparseRunLogic.set_clan_state)(
+                    run_id=run_id, clan_id=clan_id, state=4, error=f"Превышено число попыток: {attempts}"
+                )
+                done = False
+            else:
+                done = await ClansLogic.async_reparse_one_clan(
+                    pipeline=pipeline, clan=clan, semaphore=semaphore, run_id=run_id, alliances=alliances
+                )
+        finally:
+            held.discard(clan_id)
+        self.complete(clan_id=clan_id)
+        return done
+
+
+class ClansRefreshLogic(Redis):
+    """Обновление данных кланов по приоритету и устареванию.
+
+    Вместо полного перепарсинга регулярно обновляем только те кланы, данные которых нужны свежими:
+        1 - противники незавершенных боевых ивентов
+        2 - кланы воевод
+        3 - кланы из альянсов кланов воевод
+        4 - все остальные
+    Клан попадает в обновление, когда его данные старше REFRESH_MAX_AGE для его приоритета.
+    Во время обновления клан заблокирован в Redis, поэтому параллельные запросы на обновление
+    одного клана (планировщик, API) не загружают его повторно
+    """
+
+    lock_key = "refresh:clan:{clan_id}"
+    lock_live_time = 600
+    # данные, обновленные совсем недавно, по запросу не перезагружаем
+    fresh_time = 60
+    # ивенты, которые так и не закрыли, перестают быть "ближайшими" через сутки после даты
+    event_window = datetime.timedelta(days=1)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.reparse_lock = ReparseLock(**kwargs)
+
+    @classmethod
+    def get_clans_priority(cls) -> dict:
+        """Приоритеты важных кланов {ID клана: приоритет}"""
+        priority = {}
+        enemies = FightEventModel.objects.filter(
+            state__lt=4, date__gte=timezone.now() - cls.event_window, enemy__isnull=False
+        ).values_list("enemy_id", flat=True)
+        voevoda_clans = set(VoevodaModel.objects.filter(clan_id__isnull=False).values_list("clan_id", flat=True))
+        alliance_clans = ClansModel.objects.filter(
+            Q(alliance_id__in=voevoda_clans) | Q(pk__in=ClansModel.objects.filter(
+                pk__in=voevoda_clans, alliance__isnull=False
+            ).values("alliance_id"))
+        ).values_list("id", flat=True)
+        for level, clans_id_list in ((3, alliance_clans), (2, voevoda_clans), (1, enemies)):
+            priority.update(dict.fromkeys(clans_id_list, level))
+        return priority
+
+    @classmethod
+    def get_stale_clans(cls, limit: Union[int, None] = None) -> List[dict]:
+        """Устаревшие кланы: сначала по приоритету, внутри приоритета - самые давно обновленные"""
+        max_age = settings.PARSER_SETTINGS["REFRESH_MAX_AGE"]
+        now = timezone.now()
+        priority = cls.get_clans_priority()
+        stale = []
+        for clan_id, refreshed_at in ClansModel.objects.values_list("id", "refreshed_at"):
+            level = priority.get(clan_id, 4)
+            # для приоритетов без своего значения в REFRESH_MAX_AGE берем последнее
+            if refreshed_at is None or (now - refreshed_at).total_seconds() > max_age[min(level, len(max_age)) - 1]:
+                stale.append({"clan_id": clan_id, "priority": level, "refreshed_at": refreshed_at})
+        stale.sort(key=lambda clan: (clan["priority"], clan["refreshed_at"].timestamp() if clan["refreshed_at"] else 0))
+        return stale[:limit] if limit else stale
+
+    def lock_clan(self, clan_id: int) -> bool:
+        return bool(self.redis.set(self.lock_key.format(clan_id=clan_id), 1, nx=True, ex=self.lock_live_time))
+
+    def unlock_clan(self, clan_id: int):
+        self.redis.delete(self.lock_key.format(clan_id=clan_id))
+
+    def refresh_clans(self, clans_id_list: List[int]) -> List[int]:
+        """Обновляем кланы, которые сейчас никто другой не обновляет. Возвращает ID обновляемых кланов.
+        Во время перепарсинга не обновляем ничего: он и так загрузит эти кланы, а вместе с ним
+        мы бы превысили лимит запросов к сайту ГВД
+        """
+        active = self.reparse_lock.get_owner()
+        if active:
+            logger.info(f"Идет перепарсинг ({active}), обновление кланов {clans_id_list} пропускаю")
+            return []
+        locked = [clan_id for clan_id in clans_id_list if self.lock_clan(clan_id=clan_id)]
+        if not locked:
+            return []
+        self.reparse_locked(clans_id_list=locked)
+        return locked
+
+    def reparse_locked(self, clans_id_list: List[int]):
+        """Перепарсиваем кланы, которые заблокировали мы, и снимаем с них блокировку"""
+        try:
+            # несколько кланов быстрее разобрать на месте, чем запускать пул процессов
+            async_to_sync(ClansLogic().async_reparse_clans)(
+                clans_list_data=[{"clan_id": clan_id} for clan_id in clans_id_list], parse_workers=0
+            )
+        finally:
+            for clan_id in clans_id_list:
+                self.unlock_clan(clan_id=clan_id)
+
+    def refresh_stale(self) -> List[int]:
+        """Один проход планировщика: обновляем самые важные из устаревших кланов"""
+        stale = self.get_stale_clans(limit=settings.PARSER_SETTINGS["REFRESH_BATCH"])
+        if not stale:
+            logger.debug("Устаревших кланов нет")
+            return []
+        logger.info(f"Обновляю устаревшие кланы: {[(clan['clan_id'], clan['priority']) for clan in stale]}")
+        return self.refresh_clans(clans_id_list=[clan["clan_id"] for clan in stale])
+
+    def run_scheduler(self, once: bool = False):
+        """Планировщик обновления кланов. Работает, пока процесс не остановят"""
+        interval = settings.PARSER_SETTINGS["REFRESH_INTERVAL"]
+        while True:
+            try:
+                self.refresh_stale()
+            except Exception as _ex:
+                logger.error(f"Ошибка в проходе планировщика обновления кланов -> {_ex!r}")
+            finally:
+                connections.close_all()
+            if once:
+                return
+            time.sleep(interval)
+
+    def refresh_clan_now(self, clan_id: int) -> Union[dict, None]:
+        """Запускаем обновление клана по запросу, не дожидаясь загрузки.
+        В state возвращается состояние клана:
+            fresh - данные обновлены недавно, обновлять нечего
+            started - запустили обновление в фоне
+            running - клан уже обновляется (планировщиком или другим запросом)
+            reparse - идет перепарсинг (его владелец в active), клан обновится в нем
+        Окончание обновления клиент видит по изменению refreshed_at
+        """
+        clan = ClansModel.objects.filter(pk=clan_id).first()
+        if not clan:
+            logger.error(f"Не найден клан с ID: {clan_id}")
+            return None
+        data = {"clan_id": clan_id, "refreshed_at": clan.refreshed_at}
+        if clan.refreshed_at and (timezone.now() - clan.refreshed_at).total_seconds() < self.fresh_time:
+            return {**data, "state": "fresh"}
+        active = self.reparse_lock.get_owner()
+        if active:
+            return {**data, "state": "reparse", "active": active}
+        if not self.lock_clan(clan_id=clan_id):
+            logger.info(f"Клан №{clan_id} уже обновляется")
+            return {**data, "state": "running"}
+
+        threading.Thread(
+            target=self.run_refresh, kwargs={"clans_id_list": [clan_id]}, name=f"refresh-{clan_id}", daemon=True
+        ).start()
+        logger.info(f"Запустил обновление клана №{clan_id}")
+        return {**data, "state": "started"}
+
+    def run_refresh(self, clans_id_list: List[int]):
+        """Тело фонового обновления по запросу"""
+        try:
+            self.reparse_locked(clans_id_list=clans_id_list)
+        except Exception as _ex:
+            logger.error(f"Ошибка обновления кланов {clans_id_list} -> {_ex!r}")
+        finally:
+            connections.close_all()
+
+
+class RosterIngestLogic(Redis):
+    """Прием страниц состава клана, которые игроки уже открыли в браузере.
+
+    Вместо повторной загрузки парсером страница (HTML или уже разобранные строки) присылается на сервер,
+    разбирается тем же кодом, что и при перепарсинге, и записывается в БД через PlayersLogic.
+    Одинаковые страницы (по хэшу разобранных строк) в течение dedupe_time повторно не записываются
+    """
+
+    dedupe_time = 60 * 60
+
+    @staticmethod
+    def dedupe_key(digest: str) -> str:
+        return f"ingest:roster:{digest}"
+
+    @staticmethod
+    def check_token(token: Union[str, None]) -> bool:
+        """Проверка токена приема из настроек PARSER_SETTINGS["INGEST_TOKENS"]"""
+        if not token:
+            return False
+        return any(hmac.compare_digest(token, allowed) for allowed in settings.PARSER_SETTINGS["INGEST_TOKENS"])
+
+    @staticmethod
+    def parse_rows(clan_id: int, html: Union[str, None] = None,
+                   players: Union[List[dict], None] = None) -> List[PlayerSchem]:
+        """Игроки страницы клана из HTML или из готовых строк. Клан у всех строк - переданный clan_id.
+        Страница, которую не удалось разобрать (пустая, не HTML, строки с недостающими ячейками),
+        - ValueError, как и ошибка валидации строк
+        """
+        if html is not None:
+            try:
+                return parse_players_page(html_data=html, clan_id=clan_id) or []
+            except (etree.ParserError, IndexError, AttributeError) as _ex:
+                raise ValueError(f"Не удалось разобрать страницу клана №{clan_id}: {_ex!r}")
+        if players is not None:
+            return PLAYERS_PAGE_ADAPTER.validate_python([{**player, "clan": clan_id} for player in players])
+        raise ValueError("Нужно передать html или players")
+
+    @staticmethod
+    def get_digest(clan_id: int, players_data: List[PlayerSchem]) -> str:
+        """Хэш содержимого страницы, не зависящий от порядка строк и оформления HTML"""
+        rows = sorted((player.model_dump() for player in players_data), key=lambda row: row["id"])
+        return hashlib.sha256(json.dumps([clan_id, rows], sort_keys=True).encode()).hexdigest()
+
+    def ingest(self, clan_id: int, html: Union[str, None] = None,
+               players: Union[List[dict], None] = None) -> Union[dict, None]:
+        """Разбираем и записываем страницу клана. Если клана нет в БД - возвращаем None"""
+        if not ClansModel.objects.filter(pk=clan_id).exists():
+            return None
+        players_data = self.parse_rows(clan_id=clan_id, html=html, players=players)
+        if not players_data:
+            return {"clan_id": clan_id, "players": 0, "duplicate": False}
+        digest = self.get_digest(clan_id=clan_id, players_data=players_data)
+        if not self.redis.set(self.dedupe_key(digest), 1, nx=True, ex=self.dedupe_time):
+            logger.info(f"Страница клана №{clan_id} ({digest[:12]}) уже принята, пропускаю")
+            return {"clan_id": clan_id, "players": len(players_data), "duplicate": True}
+        try:
+            changed = db_writer.call(PlayersLogic().upsert_players, players_data=players_data)
+        except Exception:
+            # страница не записана - ее можно будет прислать повторно
+            self.redis.delete(self.dedupe_key(digest))
+            raise
+        logger.info(f"Принял страницу клана №{clan_id}: {len(players_data)} игроков, изменились {changed}")
+        return {"clan_id": clan_id, "players": len(players_data), "changed": changed, "duplicate": False}
+
+
 class VoevodaLogic(Redis):
     """Логика взаимодействия воеводы с интерфейсом"""
 
@@ -425,15 +1664,7 @@ class PresetsLogic(Redis):
             data.save()
             logger.info(f"Добавил новый пресет: {in_data}")
             in_data["voevoda_id"] = in_data["voevoda_id"].id
-
-            # извлекаем всех игроков относящихся к воеводе и добавляем им данный пресет
-            persons_list = PersonsLogic().get_person_data(filter={"voevoda_id": in_data["voevoda_id"], "person_id": None})
-            logger.info(f"Список игроков воеводы {data.voevoda_id.id}: {persons_list}")
-            for person in persons_list:
-                PersonPresetLogic().add_new_person_preset(in_data={
-                    "person_id": person["id"],
-                    "preset_id": data.id
-                })
+            # строки PersonPresetModel не создаем: у игроков воеводы пресет появится со значением по умолчанию
             return in_data
         except IntegrityError:
             logger.info(f"Пресет уже существует")
@@ -492,15 +1723,6 @@ class PersonsLogic(Redis):
         })
         self.delete_data_from_cache(key=f"person:{key}")
 
-        # извлекаем все пресеты, относящиеся к воеводе
-        presets_list = PresetsLogic().get_presets_data(data_filter={"voevoda_id": check_data_by_key.voevoda_id})
-
-        for preset in presets_list:
-            PersonPresetLogic().add_new_person_preset_data(in_data={
-                "person_id": new_person["id"],
-                "preset_id": preset["id"]
-            })
-
         return new_person
 
     def get_person_data(self, filter: dict):
@@ -522,12 +1744,15 @@ class PersonsLogic(Redis):
 
     def get_person_data_by_filter(self, filter: dict) -> Union[list, None]:
         """Данный метод возвращает данные об игроке по фильтру
+        Воевода и персонаж с кланом подтягиваются тем же запросом, а пресеты всех игроков -
+        через PersonPresetLogic.get_persons_presets, без запросов на каждого игрока
         """
         try:
-            data = PersonsModel.objects.filter(**filter)
+            data = list(PersonsModel.objects.filter(**filter).select_related("voevoda_id", "player_id__clan"))
+            presets = PersonPresetLogic.get_persons_presets(persons=data)
             return [self.serialize_one_person_data(
                 data=one_data,
-                presets_list=PersonPresetLogic().get_person_presets(person_id=one_data.id)
+                presets_list=presets[one_data.id]
             ) for one_data in data]
         except ObjectDoesNotExist:
             logger.error(f"Нет игроков по фильтру: {filter}")
@@ -592,42 +1817,94 @@ class PersonsLogic(Redis):
 class PersonPresetLogic(Redis):
     """Логика работы с пресетами персональными за игроками"""
 
-    def get_person_presets(self, person_id: int):
-        """Извлекаем список пресетов однового игрока"""
+    @staticmethod
+    def get_person_presets(person_id: int) -> Union[list, None]:
+        """Извлекаем список пресетов одного игрока: все пресеты его воеводы,
+        для пресетов без сохраненной строки подставляем значение по умолчанию (id = None)
+        """
         try:
-            data = PersonPresetModel.objects.filter(person_id=person_id)
-            return [self.serialize_one_person_preset_data(data=one_data) for one_data in data]
-        except ObjectDoesNotExist:
+            person = PersonsModel.objects.only("voevoda_id").get(pk=person_id)
+            return PersonPresetLogic.get_persons_presets(persons=[person])[person.id]
+        except (ObjectDoesNotExist, ValueError):
             logger.error(f"Не пресетов для игрока по person_id: {person_id}")
             return None
 
-    def serialize_one_person_preset_data(self, data: PersonPresetModel):
-        return {
-            "id": data.id,
-            "person_id": data.person_id.id,
-            "preset": PresetsLogic().serialize_one_preset_data(data=data.preset_id),
-            "play_preset": data.play_preset
-        }
+    @staticmethod
+    def get_persons_presets(persons: List[PersonsModel]) -> dict:
+        """Списки пресетов группы игроков по ID игрока (как у get_person_presets).
+        Сохраненные строки всех игроков и пресеты их воевод читаются двумя запросами,
+        а списки собираются в памяти
+        """
+        stored = {}
+        for person_preset_id, person_id, preset_id, play_preset in PersonPresetModel.objects.filter(
+            person_id__in=[person.id for person in persons]
+        ).values_list("id", "person_id", "preset_id", "play_preset"):
+            stored[(person_id, preset_id)] = (person_preset_id, play_preset)
+        voevodas_presets = {}
+        for preset in PresetsModel.objects.filter(
+            voevoda_id__in={person.voevoda_id_id for person in persons if person.voevoda_id_id is not None}
+        ).select_related("voevoda_id").order_by("id"):
+            voevodas_presets.setdefault(preset.voevoda_id_id, []).append(
+                (preset.id, PresetsLogic.serialize_one_preset_data(data=preset))
+            )
+
+        result = {}
+        for person in persons:
+            result[person.id] = []
+            for preset_id, preset_data in voevodas_presets.get(person.voevoda_id_id, []):
+                person_preset_id, play_preset = stored.get((person.id, preset_id), (None, False))
+                result[person.id].append({
+                    "id": person_preset_id,
+                    "person_id": person.id,
+                    "preset": preset_data,
+                    "play_preset": play_preset
+                })
+        return result
+
+    @staticmethod
+    def set_play_preset(person_id: int, preset_id: int, play_preset: bool) -> dict:
+        """Сохраняем отметку игры за пресет: строка хранится только для play_preset=True,
+        значение по умолчанию записывается удалением строки
+        """
+        if play_preset:
+            data, _ = PersonPresetModel.objects.update_or_create(
+                person_id_id=person_id, preset_id_id=preset_id, defaults={"play_preset": True}
+            )
+            person_preset_id = data.id
+        else:
+            PersonPresetModel.objects.filter(person_id=person_id, preset_id=preset_id).delete()
+            person_preset_id = None
+        return {"id": person_preset_id, "person_id": person_id, "preset_id": preset_id, "play_preset": play_preset}
 
     @staticmethod
     def add_new_person_preset(in_data: dict):
         try:
-            in_data["person_id"] = PersonsModel.objects.get(pk=in_data["person_id"])
-            in_data["preset_id"] = PresetsModel.objects.get(pk=in_data["preset_id"])
-            data = PersonPresetModel.objects.create(**in_data)
-            data.save()
+            PersonsModel.objects.get(pk=in_data["person_id"])
+            PresetsModel.objects.get(pk=in_data["preset_id"])
+            data = PersonPresetLogic.set_play_preset(
+                person_id=in_data["person_id"], preset_id=in_data["preset_id"],
+                play_preset=bool(in_data.get("play_preset", False))
+            )
             logger.info(f"Добавил новый пресет для игрока: {in_data}")
-            in_data["person_id"] = in_data["person_id"].id
-            in_data["preset_id"] = in_data["preset_id"].id
-            return in_data
+            return data
         except Exception as _ex:
             logger.error(f"Ошибка при добавления пресета игроку {in_data} -> {_ex}")
 
     @staticmethod
     def update_person_preset_data(in_data: dict) -> bool:
+        """Обновляем отметку игры за пресет по person_preset_id (только для сохраненных строк)
+        или по паре person_id и preset_id
+        """
         try:
-            person_preset_id = in_data.pop("person_preset_id")
-            PersonPresetModel.objects.filter(id=person_preset_id).update(**in_data)
+            person_preset_id = in_data.pop("person_preset_id", None)
+            if person_preset_id:
+                data = PersonPresetModel.objects.get(id=person_preset_id)
+                person_id, preset_id = data.person_id_id, data.preset_id_id
+            else:
+                person_id, preset_id = in_data["person_id"], in_data["preset_id"]
+            PersonPresetLogic.set_play_preset(
+                person_id=person_id, preset_id=preset_id, play_preset=bool(in_data["play_preset"])
+            )
             logger.info(f"Обновил данные: {in_data}")
             return True
         except Exception as _ex:
@@ -654,18 +1931,22 @@ class FightsLogic(Redis):
         return self.get_fight_by_filter(filter=in_data)
 
     def get_fight_by_id(self, fight_id: int):
-        """Извлечение данных по одному бою"""
+        """Извлечение данных по одному бою (если его нет в рабочей таблице - из архива)"""
         try:
-            data = FightsModel.objects.get(pk=fight_id)
+            data = FightsModel.objects.filter(pk=fight_id).first() or FightsArchiveModel.objects.get(pk=fight_id)
             return self.serialize_one_fight_data(data=data)
         except ObjectDoesNotExist:
             logger.error(f"Бой с ID: {fight_id} не обнаружен")
             return None
 
     def get_fight_by_filter(self, filter: dict):
-        """Извлечение данных о группе поев по фильтру"""
+        """Извлечение данных о группе поев по фильтру. Архив читается, только если период
+        (date__gte/date__lte) захватывает даты перенесенных в него боев
+        """
         try:
-            data = FightsModel.objects.filter(**filter)
+            data = list(FightsModel.objects.filter(**filter))
+            if ArchiveLogic.include_archive(archive_model=FightsArchiveModel, filter=filter):
+                data = list(FightsArchiveModel.objects.filter(**filter)) + data
             return [self.serialize_one_fight_data(data=one_data) for one_data in data]
         except ObjectDoesNotExist:
             logger.error(f"Нет данных о боях по фильтру: {filter}")
@@ -674,23 +1955,23 @@ class FightsLogic(Redis):
     @staticmethod
     def serialize_one_fight_data(data: FightsModel):
         """Сериализация данных об одном бое"""
-        return {
+        fight_data = {
             "id": data.id,
             "name": data.name,
             "type": data.type,
             "date": data.date.timestamp(),
             "voevoda_id": data.voevoda_id.id,
-            "attack_1_pers": PlayersLogic().serialize_one_player_data(data=data.attack_1_pers),
-            "attack_2_pers": PlayersLogic().serialize_one_player_data(data=data.attack_2_pers),
-            "defence_1_pers": PlayersLogic().serialize_one_player_data(data=data.defence_1_pers),
-            "defence_2_pers": PlayersLogic().serialize_one_player_data(data=data.defence_2_pers),
-            "attack_1_pers_preset": PresetsLogic().serialize_one_preset_data(data=data.attack_1_pers_preset),
-            "attack_2_pers_preset": PresetsLogic().serialize_one_preset_data(data=data.attack_2_pers_preset),
-            "defence_1_pers_preset": PresetsLogic().serialize_one_preset_data(data=data.defence_1_pers_preset),
-            "defence_2_pers_preset": PresetsLogic().serialize_one_preset_data(data=data.defence_2_pers_preset),
             "result": data.result,
             "description": data.description
         }
+        # игроки и пресеты боя необязательны (и обнуляются при их удалении)
+        for field in FightsImportLogic.player_fields:
+            player = getattr(data, field)
+            fight_data[field] = PlayersLogic().serialize_one_player_data(data=player) if player else None
+        for field in FightsImportLogic.preset_fields:
+            preset = getattr(data, field)
+            fight_data[field] = PresetsLogic().serialize_one_preset_data(data=preset) if preset else None
+        return fight_data
 
     def add_fight(self, in_data: dict):
         """Добавление нового боя"""
@@ -742,6 +2023,149 @@ class FightsLogic(Redis):
             return False
 
 
+class FightsImportLogic:
+    """Пакетная загрузка боев воеводы (запрос с массивом боев или файл CSV/JSON).
+
+    Все строки проверяются до записи: игроки и пресеты, на которые ссылаются бои, извлекаются
+    одним запросом на модель. Если хотя бы в одной строке есть ошибка, ничего не записывается
+    и возвращаются ошибки по строкам, иначе все бои вставляются одной транзакцией
+    """
+
+    player_fields = ["attack_1_pers", "attack_2_pers", "defence_1_pers", "defence_2_pers"]
+    preset_fields = ["attack_1_pers_preset", "attack_2_pers_preset", "defence_1_pers_preset", "defence_2_pers_preset"]
+    fight_types = {value for value, _ in FightsModel.FIGHT_TYPE_CHOICES}
+    results = {value for value, _ in FightsModel.RESULT_CHOICER}
+    name_length = FightsModel._meta.get_field("name").max_length
+    # максимальное количество боев в одной загрузке
+    max_rows = 10000
+
+    @staticmethod
+    def read_file(name: str, content: bytes) -> List[dict]:
+        """Строки боев из файла: CSV с заголовком или JSON (массив боев или {"fights": [...]})"""
+        text = content.decode("utf-8-sig")
+        if name.lower().endswith(".csv"):
+            try:
+                # таблицы часто сохраняют CSV с разделителем ";"
+                dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+            except csv.Error:
+                dialect = csv.excel
+            return list(csv.DictReader(io.StringIO(text), dialect=dialect))
+        data = json.loads(text)
+        if isinstance(data, dict):
+            data = data.get("fights")
+        if not isinstance(data, list):
+            raise ValueError("Ожидается массив боев")
+        return data
+
+    @staticmethod
+    def get_int(value) -> Union[int, None]:
+        """Целое из JSON или ячейки CSV. Пустое значение - None"""
+        if value is None or (isinstance(value, str) and not value.strip()):
+            return None
+        if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+            raise ValueError
+        return int(value)
+
+    @staticmethod
+    def get_date(value) -> datetime.datetime:
+        """Дата боя: timestamp или строка ISO 8601 (без часового пояса - UTC)"""
+        if value is None or (isinstance(value, str) and not value.strip()):
+            return timezone.now()
+        try:
+            return datetime.datetime.fromtimestamp(float(value), tz=datetime.timezone.utc)
+        except (TypeError, ValueError):
+            date = datetime.datetime.fromisoformat(str(value).strip())
+        return date if timezone.is_aware(date) else timezone.make_aware(date, datetime.timezone.utc)
+
+    @classmethod
+    def validate_row(cls, row: dict) -> Tuple[dict, dict]:
+        """Проверка одной строки без обращения к БД. Возвращает поля боя и ошибки {поле: текст}"""
+        fight, errors = {}, {}
+        if not isinstance(row, dict):
+            return fight, {"row": "ожидается объект"}
+
+        name = str(row.get("name") or "").strip()
+        if not name:
+            errors["name"] = "обязательное поле"
+        elif len(name) > cls.name_length:
+            errors["name"] = f"длиннее {cls.name_length} символов"
+        fight["name"] = name
+        fight["description"] = str(row.get("description") or "")
+
+        for field, allowed, default in (("type", cls.fight_types, 1), ("result", cls.results, None)):
+            try:
+                value = cls.get_int(row.get(field))
+            except (TypeError, ValueError):
+                errors[field] = "ожидается целое число"
+                continue
+            value = default if value is None else value
+            if value not in allowed:
+                errors[field] = f"допустимые значения: {sorted(allowed)}"
+            fight[field] = value
+
+        try:
+            fight["date"] = cls.get_date(row.get("date"))
+        except (TypeError, ValueError, OverflowError, OSError):
+            errors["date"] = "ожидается timestamp или дата ISO 8601"
+
+        for field in cls.player_fields + cls.preset_fields:
+            try:
+                fight[f"{field}_id"] = cls.get_int(row.get(field))
+            except (TypeError, ValueError):
+                errors[field] = "ожидается ID"
+        return fight, errors
+
+    @classmethod
+    def validate(cls, voevoda_id: int, rows: List[dict]) -> Tuple[List[FightsModel], List[dict]]:
+        """Проверка всех строк. Ссылки на игроков и пресеты воеводы проверяются одним запросом на модель.
+        Возвращает бои для вставки и ошибки [{"row": номер строки с 1, "errors": {поле: текст}}]
+        """
+        checked = [cls.validate_row(row=row) for row in rows]
+        player_ids = {fight.get(f"{field}_id") for fight, _ in checked for field in cls.player_fields}
+        preset_ids = {fight.get(f"{field}_id") for fight, _ in checked for field in cls.preset_fields}
+        player_ids.discard(None)
+        preset_ids.discard(None)
+        players = set(PlayersModel.objects.filter(id__in=player_ids).values_list("id", flat=True))
+        presets = set(PresetsModel.objects.filter(
+            voevoda_id=voevoda_id, id__in=preset_ids
+        ).values_list("id", flat=True))
+
+        fights, errors = [], []
+        for number, (fight, row_errors) in enumerate(checked, start=1):
+            for fields, known, message in ((cls.player_fields, players, "игрок не найден"),
+                                           (cls.preset_fields, presets, "пресет воеводы не найден")):
+                for field in fields:
+                    value = fight.get(f"{field}_id")
+                    if value is not None and value not in known:
+                        row_errors[field] = message
+            if row_errors:
+                errors.append({"row": number, "errors": row_errors})
+            else:
+                fights.append(FightsModel(voevoda_id_id=voevoda_id, **fight))
+        return fights, errors
+
+    @staticmethod
+    def save_fights(fights: List[FightsModel]) -> List[int]:
+        with transaction.atomic():
+            created = FightsModel.objects.bulk_create(fights)
+        return [fight.id for fight in created]
+
+    @classmethod
+    def import_fights(cls, voevoda_id: int, rows: List[dict]) -> dict:
+        """Загрузка боев воеводы. Возвращает {"created": количество, "ids": [...], "errors": [...]}"""
+        if not VoevodaModel.objects.filter(pk=voevoda_id).exists():
+            raise ValueError(f"Воевода с ID: {voevoda_id} не обнаружен")
+        if len(rows) > cls.max_rows:
+            raise ValueError(f"Больше {cls.max_rows} боев в одной загрузке")
+        fights, errors = cls.validate(voevoda_id=voevoda_id, rows=rows)
+        if errors:
+            logger.info(f"Загрузка боев воеводы №{voevoda_id} отклонена: ошибок в {len(errors)} строках")
+            return {"created": 0, "ids": [], "errors": errors}
+        ids = db_writer.call(cls.save_fights, fights) if fights else []
+        logger.info(f"Загрузил {len(ids)} боев воеводы №{voevoda_id}")
+        return {"created": len(ids), "ids": ids, "errors": []}
+
+
 class FightEventLogic(Redis):
     def get_events(self, in_data: dict):
         """Извлечения данных по боям
@@ -752,20 +2176,23 @@ class FightEventLogic(Redis):
         return self.get_event_by_filter(filter=in_data)
 
     def get_event_by_id(self, event_id: int):
-        """Извлечение данных по одному бою
+        """Извлечение данных по одному бою (если его нет в рабочей таблице - из архива)
         """
         try:
-            data = FightEventModel.objects.get(pk=event_id)
+            data = FightEventModel.objects.filter(pk=event_id).first() or FightEventArchiveModel.objects.get(pk=event_id)
             return self.serialize_one_event_data(data=data)
         except ObjectDoesNotExist:
             logger.error(f"Ивент с ID: {event_id} не обнаружен")
             return None
 
     def get_event_by_filter(self, filter: dict):
-        """Извлечение данных о ивентах по фильтру
+        """Извлечение данных о ивентах по фильтру. Архив читается, только если период
+        (date__gte/date__lte) захватывает даты перенесенных в него ивентов
         """
         try:
-            data = FightEventModel.objects.filter(**filter)
+            data = list(FightEventModel.objects.filter(**filter))
+            if ArchiveLogic.include_archive(archive_model=FightEventArchiveModel, filter=filter):
+                data = list(FightEventArchiveModel.objects.filter(**filter)) + data
             return [self.serialize_one_event_data(data=one_data) for one_data in data]
         except ObjectDoesNotExist:
             logger.error(f"Нет данных об ивентах по фильтру: {filter}")
@@ -827,7 +2254,7 @@ class InviteLogic(Redis):
         """Извлечение данных по одному бою
         """
         try:
-            data = InviteModel.objects.get(pk=invite_id)
+            data = InviteModel.objects.filter(pk=invite_id).first() or InviteArchiveModel.objects.get(pk=invite_id)
             return self.serialize_one_invite_data(data=data)
         except ObjectDoesNotExist:
             logger.error(f"Приглашение с ID: {invite_id} не обнаружен")
@@ -837,8 +2264,14 @@ class InviteLogic(Redis):
         """Извлечение данных о ивентах по фильтру
         """
         try:
-            filter["event_id"] = FightEventModel.objects.get(pk=filter["event_id"])
-            data = InviteModel.objects.filter(**filter)
+            event = FightEventModel.objects.filter(pk=filter["event_id"]).first()
+            if event is not None:
+                filter["event_id"] = event
+                data = InviteModel.objects.filter(**filter)
+            else:
+                # приглашения завершенного ивента лежат в архиве вместе с ним
+                filter["event_id"] = FightEventArchiveModel.objects.get(pk=filter["event_id"])
+                data = InviteArchiveModel.objects.filter(**filter)
             return [self.serialize_one_invite_data(data=one_data) for one_data in data]
         except ObjectDoesNotExist:
             logger.error(f"Нет данных об ивентах по фильтру: {filter}")
@@ -880,3 +2313,158 @@ class InviteLogic(Redis):
         except Exception as _ex:
             logger.info(f"Ошибка при обновлении данных: {in_data} -> {_ex}")
             return False
+
+    @staticmethod
+    def create_invites(event_id: int, person_ids: Union[List[int], None] = None, state: int = 1) -> dict:
+        """Приглашения на ивент одной вставкой. Без person_ids приглашаются все активные игроки воеводы ивента,
+        иначе - переданные игроки этого воеводы. Уже приглашенные на ивент пропускаются
+        """
+        if state not in dict(InviteModel.STATE_CHOICES):
+            raise ValueError(f"Неизвестное состояние приглашения: {state}")
+        event = FightEventModel.objects.only("voevoda_id").get(pk=event_id)
+        persons = PersonsModel.objects.filter(voevoda_id=event.voevoda_id_id)
+        if person_ids is None:
+            persons = persons.filter(activity=True)
+        else:
+            persons = persons.filter(id__in=person_ids)
+        with transaction.atomic():
+            candidates = list(persons.values_list("id", flat=True))
+            invited = set(InviteModel.objects.filter(
+                event_id=event_id, person_id__in=candidates
+            ).values_list("person_id", flat=True))
+            created = InviteModel.objects.bulk_create([
+                InviteModel(event_id_id=event_id, person_id_id=person_id, state=state)
+                for person_id in candidates if person_id not in invited
+            ])
+        logger.info(f"Добавил {len(created)} приглашений на ивент №{event_id}")
+        return {"event_id": event_id, "state": state, "created": len(created), "skipped": len(invited)}
+
+    @staticmethod
+    def update_invites_state(event_id: int, state: int, invite_ids: Union[List[int], None] = None,
+                             person_ids: Union[List[int], None] = None) -> dict:
+        """Перевод приглашений ивента в состояние state одним UPDATE по списку приглашений и/или игроков"""
+        if state not in dict(InviteModel.STATE_CHOICES):
+            raise ValueError(f"Неизвестное состояние приглашения: {state}")
+        if not invite_ids and not person_ids:
+            raise ValueError("Нужно передать invite_ids или person_ids")
+        updated = InviteModel.objects.filter(event_id=event_id).filter(
+            Q(id__in=invite_ids or []) | Q(person_id__in=person_ids or [])
+        ).update(state=state)
+        logger.info(f"Перевел {updated} приглашений ивента №{event_id} в состояние {state}")
+        return {"event_id": event_id, "state": state, "updated": updated}
+
+    @staticmethod
+    def add_invites(**kwargs) -> dict:
+        """create_invites в потоке писателя БД"""
+        return db_writer.call(InviteLogic.create_invites, **kwargs)
+
+    @staticmethod
+    def set_invites_state(**kwargs) -> dict:
+        """update_invites_state в потоке писателя БД"""
+        return db_writer.call(InviteLogic.update_invites_state, **kwargs)
+
+
+class ArchiveLogic:
+    """Перенос истории из рабочих таблиц в архивные.
+
+    Завершенные ивенты (вместе с приглашениями) и бои старше PARSER_SETTINGS["ARCHIVE_AGE_DAYS"]
+    переносятся в FightEventArchiveModel, InviteArchiveModel и FightsArchiveModel с теми же ID.
+    Рабочие таблицы и их индексы остаются маленькими, а чтение архива нужно только запросам
+    с периодом, захватывающим даты уже перенесенных записей. Граница архивации может меняться
+    (настройка, --age-days у archive_history), поэтому период сравнивается с самой поздней датой
+    в архиве, а не с текущей границей
+    """
+
+    batch_size = 500
+
+    @staticmethod
+    def get_cutoff(now: Union[datetime.datetime, None] = None) -> datetime.datetime:
+        """Граница архивации: записи старше нее переносятся в архив"""
+        return (now or timezone.now()) - datetime.timedelta(days=settings.PARSER_SETTINGS["ARCHIVE_AGE_DAYS"])
+
+    @staticmethod
+    def get_archived_until(archive_model) -> Union[datetime.datetime, None]:
+        """Самая поздняя дата записей в архивной таблице (None - архив пуст)"""
+        return archive_model.objects.aggregate(date=Max("date"))["date"]
+
+    @classmethod
+    def include_archive(cls, archive_model, filter: dict) -> bool:
+        """Нужно ли читать архивную таблицу для фильтра с периодом date__gte/date__lte.
+        Без периода читаются только рабочие таблицы
+        """
+        date_from = filter.get("date__gte")
+        if date_from is None and filter.get("date__lte") is None:
+            return False
+        archived_until = cls.get_archived_until(archive_model=archive_model)
+        return archived_until is not None and (date_from is None or date_from <= archived_until)
+
+    @staticmethod
+    def get_date_filter(date_from: Union[float, str, None] = None, date_to: Union[float, str, None] = None) -> dict:
+        """Фильтр по дате из timestamp'ов запроса"""
+        date_filter = {}
+        if date_from:
+            date_filter["date__gte"] = datetime.datetime.fromtimestamp(float(date_from), tz=datetime.timezone.utc)
+        if date_to:
+            date_filter["date__lte"] = datetime.datetime.fromtimestamp(float(date_to), tz=datetime.timezone.utc)
+        return date_filter
+
+    @staticmethod
+    def copy_rows(queryset, archive_model) -> int:
+        """Копируем строки queryset в архивную таблицу с такими же полями"""
+        fields = queryset.model._meta.concrete_fields
+        attnames = [field.attname for field in fields]
+        rows = queryset.values_list(*[field.name for field in fields])
+        return len(archive_model.objects.bulk_create([archive_model(**dict(zip(attnames, row))) for row in rows]))
+
+    @classmethod
+    def archive_events_batch(cls, cutoff: datetime.datetime, batch_size: int) -> Tuple[int, int]:
+        """Переносим пачку завершенных ивентов с приглашениями. Возвращает (ивентов, приглашений)"""
+        with transaction.atomic():
+            events_id_list = list(FightEventModel.objects.filter(
+                state=4, date__lt=cutoff
+            ).order_by("id").values_list("id", flat=True)[:batch_size])
+            if not events_id_list:
+                return 0, 0
+            events = FightEventModel.objects.filter(id__in=events_id_list)
+            invites = InviteModel.objects.filter(event_id__in=events_id_list)
+            events_count = cls.copy_rows(queryset=events, archive_model=FightEventArchiveModel)
+            invites_count = cls.copy_rows(queryset=invites, archive_model=InviteArchiveModel)
+            invites.delete()
+            events.delete()
+        return events_count, invites_count
+
+    @classmethod
+    def archive_fights_batch(cls, cutoff: datetime.datetime, batch_size: int) -> int:
+        """Переносим пачку боев старше cutoff. Возвращает количество боев"""
+        with transaction.atomic():
+            fights_id_list = list(FightsModel.objects.filter(
+                date__lt=cutoff
+            ).order_by("id").values_list("id", flat=True)[:batch_size])
+            if not fights_id_list:
+                return 0
+            fights = FightsModel.objects.filter(id__in=fights_id_list)
+            count = cls.copy_rows(queryset=fights, archive_model=FightsArchiveModel)
+            fights.delete()
+        return count
+
+    @classmethod
+    def archive(cls, cutoff: Union[datetime.datetime, None] = None, batch_size: Union[int, None] = None) -> dict:
+        """Архивация истории короткими транзакциями в потоке писателя БД,
+        чтобы запросы API не ждали перенос целиком
+        """
+        cutoff = cutoff or cls.get_cutoff()
+        batch_size = batch_size or cls.batch_size
+        result = {"events": 0, "invites": 0, "fights": 0}
+        while True:
+            events, invites = db_writer.call(cls.archive_events_batch, cutoff, batch_size)
+            if not events:
+                break
+            result["events"] += events
+            result["invites"] += invites
+        while True:
+            fights = db_writer.call(cls.archive_fights_batch, cutoff, batch_size)
+            if not fights:
+                break
+            result["fights"] += fights
+        logger.info(f"Перенес в архив данные старше {cutoff}: {result}")
+        return result
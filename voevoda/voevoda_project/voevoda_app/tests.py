@@ -1,3 +1,1265 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import math
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+import fakeredis
+from django.db import connection
+from django.db.utils import OperationalError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .benchmarks.parsers import ParserBenchmark, CORPUS_CLAN_ID
+from .benchmarks.sqlite import SqliteBenchmark
+from .db_writer import DbWriter
+from .fetcher import AdaptiveRateLimiter, AsyncFetcher, FetchError
+from .metrics import ReparseMetrics, summarize
+from .page_cache import PageCache, PageSchem
+from .pipeline import ReparsePipeline
+from .models import ClansModel, ReparseCheckpointModel, VoevodaModel, FightEventModel, PlayersModel
+from .models import PersonsModel, PersonPresetModel, FightsModel, InviteModel, PlayerStatsHistoryModel, PresetsModel
+from .models import FightsArchiveModel, FightEventArchiveModel, InviteArchiveModel
+from .parser import ClansParser, PlayerParser, PLAYER_STATS_FIELDS
+from .servises import ReparseRunLogic, ClansRefreshLogic, EmblemLogic, RosterIngestLogic, PlayersLogic
+from .servises import PlayerHistoryLogic, PersonPresetLogic, FightsImportLogic, InviteLogic, ArchiveLogic
+from .servises import FightsLogic, FightEventLogic, ReparseQueueLogic, PersonsLogic, get_fetcher_settings, get_metrics
+from .servises import AllianceLogic, ReparseLock, ReparseJobLogic, ClansLogic
+
+
+class ParsersCorpusTest(SimpleTestCase):
+    """Проверка парсеров на сохраненном корпусе страниц"""
+
+    def test_clans_list(self):
+        clans = ClansParser.parse_clans_html(html_data=ParserBenchmark.load_page("clans_list.html"))
+        self.assertEqual(len(clans), 300)
+        self.assertEqual(set(clans[0]), {"clan_id", "label", "name"})
+        self.assertTrue(all(clan["clan_id"].isdigit() for clan in clans))
+        self.assertTrue(all(clan["label"].startswith("https://") for clan in clans))
+
+    def test_clan_alliance(self):
+        alliance = ClansParser.parse_alliance_html(
+            html_data=ParserBenchmark.load_page("clan_info_alliance.html"), clan_id=CORPUS_CLAN_ID
+        )
+        self.assertEqual(alliance, "1709")
+        no_alliance = ClansParser.parse_alliance_html(
+            html_data=ParserBenchmark.load_page("clan_info_no_alliance.html"), clan_id=CORPUS_CLAN_ID
+        )
+        self.assertIsNone(no_alliance)
+
+    def test_players_pages(self):
+        players = PlayerParser().parse_page_html(
+            html_data=ParserBenchmark.load_page("players_full.html"), clan_id=CORPUS_CLAN_ID
+        )
+        self.assertEqual(len(players), 50)
+        self.assertEqual(players[0].id, 5706544)
+        self.assertEqual(players[0].name, "Мортарзе_")
+        self.assertEqual(players[0].level, 19)
+        self.assertEqual(players[0].clan, CORPUS_CLAN_ID)
+        self.assertEqual([getattr(players[0], field) for field in PLAYER_STATS_FIELDS[:3]], [3, 7, 7])
+
+        empty = PlayerParser().parse_page_html(
+            html_data=ParserBenchmark.load_page("players_empty.html"), clan_id=CORPUS_CLAN_ID
+        )
+        self.assertIsNone(empty)
+
+
+class ParserBenchmarkTest(SimpleTestCase):
+    def test_run_reports_every_case(self):
+        results = ParserBenchmark(repeat=1, min_time=0).run()
+        self.assertEqual([result["name"] for result in results], [case[0] for case in ParserBenchmark.cases])
+        for result in results:
+            self.assertGreater(result["pages_per_sec"], 0)
+            self.assertGreater(result["relative"], 0)
+            self.assertGreater(result["peak_memory_kb"], 0)
+
+    def test_find_regressions(self):
+        baseline = {"players_full": {"pages_per_sec": 100.0, "relative": 0.5}}
+        # машина вдвое медленнее, но относительно калибровки парсер не замедлился
+        ok = [{"name": "players_full", "pages_per_sec": 50.0, "relative": 0.4}]
+        slow = [{"name": "players_full", "pages_per_sec": 100.0, "relative": 0.35}]
+        self.assertEqual(ParserBenchmark.find_regressions(results=ok, baseline=baseline, threshold=0.25), [])
+        self.assertEqual(len(ParserBenchmark.find_regressions(results=slow, baseline=baseline, threshold=0.25)), 1)
+        # абсолютный базовый замер старого формата не сравнивается
+        self.assertEqual(ParserBenchmark.find_regressions(
+            results=slow, baseline={"players_full": {"pages_per_sec": 1000.0}}, threshold=0.25
+        ), [])
+
+
+class SqliteBenchmarkTest(SimpleTestCase):
+    def test_production_profile_has_no_lock_errors(self):
+        results = SqliteBenchmark(duration=0.3, readers=2, writers=2, clans=5, clan_size=20).run(
+            profiles=["production"]
+        )
+        self.assertEqual([result["name"] for result in results], ["production", "production + writer"])
+        for result in results:
+            self.assertGreater(result["reads_per_sec"], 0)
+            self.assertGreater(result["write_tx_per_sec"], 0)
+            self.assertEqual((result["read_errors"], result["write_errors"]), (0, 0))
+
+
+class DbWriterTest(SimpleTestCase):
+    def test_calls_run_one_by_one_in_writer_thread(self):
+        writer = DbWriter(name="test-writer")
+        calls = []
+
+        def write(value):
+            calls.append((value, threading.current_thread().name))
+            return value * 2
+
+        futures = [writer.submit(write, value) for value in range(5)]
+        self.assertEqual([future.result() for future in futures], [0, 2, 4, 6, 8])
+        self.assertEqual(calls, [(value, "test-writer") for value in range(5)])
+        # вложенная запись выполняется сразу, а не ждет сама себя в очереди
+        self.assertEqual(writer.call(lambda: writer.call(write, 10)), 20)
+        with self.assertRaises(ZeroDivisionError):
+            writer.call(lambda: 1 / 0)
+
+
+class ReparseRunLogicTest(TestCase):
+    def setUp(self):
+        ClansModel.objects.bulk_create([ClansModel(id=clan_id, name=f"Клан {clan_id}", label="") for clan_id in (3, 1, 2)])
+        self.logic = ReparseRunLogic()
+        self.run = self.logic.create_run(clans_id_list=[3, 1, 2])
+
+    def test_resume_from_first_incomplete_clan(self):
+        self.logic.set_clan_state(run_id=self.run.id, clan_id=3, state=3)
+        self.logic.set_clan_state(run_id=self.run.id, clan_id=1, state=2)
+        self.assertEqual(self.logic.get_unfinished_run(), self.run)
+        self.assertEqual(self.logic.get_run_clans(run=self.run), [{"clan_id": 1}, {"clan_id": 2}])
+
+    def test_retry_only_failed(self):
+        self.logic.set_clan_state(run_id=self.run.id, clan_id=3, state=3)
+        self.logic.set_clan_state(run_id=self.run.id, clan_id=1, state=4, error="timeout")
+        self.logic.set_clan_state(run_id=self.run.id, clan_id=2, state=3)
+        self.logic.finish_run(run=self.run)
+        self.run.refresh_from_db()
+        self.assertEqual(self.run.state, 3)
+        self.assertIsNone(self.logic.get_unfinished_run())
+        self.assertEqual(self.logic.get_run_clans(run=self.run, only_failed=True), [{"clan_id": 1}])
+        self.run.refresh_from_db()
+        self.assertEqual(self.run.state, 3)
+
+        run, clans_list_data = ClansLogic().prepare_run(retry_failed=True)
+        self.assertEqual((run, clans_list_data), (self.run, [{"clan_id": 1}]))
+        self.run.refresh_from_db()
+        self.assertEqual((self.run.state, self.run.finished_at), (1, None))
+
+    def test_finish_without_errors(self):
+        ReparseCheckpointModel.objects.filter(run=self.run).update(state=3)
+        self.logic.finish_run(run=self.run)
+        self.run.refresh_from_db()
+        self.assertEqual(self.run.state, 2)
+        self.assertIsNotNone(self.run.finished_at)
+
+
+class ClansRefreshLogicTest(TestCase):
+    def setUp(self):
+        ClansModel.objects.bulk_create([ClansModel(id=clan_id, name=f"Клан {clan_id}", label="") for clan_id in range(1, 8)])
+        ClansModel.objects.filter(pk=2).update(alliance=3)
+        voevoda = VoevodaModel.objects.create(name="Воевода", phone="", clan_id_id=2)
+        FightEventModel.objects.create(name="Бой", voevoda_id=voevoda, enemy_id=5)
+        FightEventModel.objects.create(name="Прошедший бой", voevoda_id=voevoda, enemy_id=6, state=4)
+
+    def test_clans_priority(self):
+        self.assertEqual(ClansRefreshLogic.get_clans_priority(), {5: 1, 2: 2, 3: 3})
+
+    @override_settings(PARSER_SETTINGS={"REFRESH_MAX_AGE": [900, 3600, 10800, 86400]})
+    def test_stale_clans_order(self):
+        now = timezone.now()
+        ClansModel.objects.filter(pk__in=[1, 2, 3]).update(refreshed_at=now)
+        ClansModel.objects.filter(pk=5).update(refreshed_at=now - datetime.timedelta(minutes=20))
+        ClansModel.objects.filter(pk=7).update(refreshed_at=now - datetime.timedelta(days=2))
+        stale = ClansRefreshLogic.get_stale_clans()
+        self.assertEqual([(clan["clan_id"], clan["priority"]) for clan in stale], [(5, 1), (4, 4), (6, 4), (7, 4)])
+        self.assertEqual(len(ClansRefreshLogic.get_stale_clans(limit=2)), 2)
+
+    @override_settings(PARSER_SETTINGS={"REFRESH_MAX_AGE": [900, 3600]})
+    def test_short_max_age_uses_last_value(self):
+        now = timezone.now()
+        ClansModel.objects.update(refreshed_at=now - datetime.timedelta(minutes=30))
+        ClansModel.objects.filter(pk=7).update(refreshed_at=now - datetime.timedelta(hours=2))
+        stale = ClansRefreshLogic.get_stale_clans()
+        self.assertEqual([(clan["clan_id"], clan["priority"]) for clan in stale], [(5, 1), (7, 4)])
+
+    def test_refresh_is_skipped_during_reparse(self):
+        redis = StubRedis()
+        with mock.patch("voevoda_app.redis_core.redis.from_url", return_value=redis):
+            logic = ClansRefreshLogic()
+        redis.set(ReparseLock.key, "queue")
+        with mock.patch.object(ClansLogic, "async_reparse_clans") as reparse:
+            self.assertEqual(logic.refresh_clans(clans_id_list=[1, 2]), [])
+        reparse.assert_not_called()
+        self.assertFalse(redis.exists(logic.lock_key.format(clan_id=1)))
+
+    def test_refresh_view_does_not_wait(self):
+        redis = StubRedis()
+        ClansModel.objects.filter(pk=1).update(refreshed_at=timezone.now())
+
+        def post(clan_id: int):
+            with mock.patch("voevoda_app.redis_core.redis.from_url", return_value=redis), \
+                    mock.patch("voevoda_app.servises.threading.Thread") as thread:
+                response = self.client.post(
+                    "/api/clans/refresh/", data={"clan_id": clan_id}, content_type="application/json"
+                )
+            data = response.json()["data"]
+            return response.status_code, data["state"] if response.status_code != 400 else data, thread.call_count
+
+        self.assertEqual(post(clan_id=1), (200, "fresh", 0))
+        self.assertEqual(post(clan_id=2), (202, "started", 1))
+        # блокировку клана снимет фоновое обновление, а пока повторный запрос его не запускает
+        self.assertEqual(post(clan_id=2), (202, "running", 0))
+        redis.set(ReparseLock.key, "queue")
+        self.assertEqual(post(clan_id=3), (202, "reparse", 0))
+        self.assertEqual(post(clan_id=100), (400, "clan not found", 0))
+
+
+class StubRedis:
+    """Redis в памяти для логики с КЭШем: значения хранятся байтами, как их отдает redis-py"""
+
+    def __init__(self):
+        self.data = {}
+        self.ttl = {}
+
+    def get(self, key: str):
+        return self.data.get(key)
+
+    def set(self, key: str, value, ex: int = None, nx: bool = False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = str(value).encode()
+        self.ttl[key] = ex
+        return True
+
+    def expire(self, key: str, ex: int):
+        self.ttl[key] = ex
+
+    def delete(self, *keys: str):
+        for key in keys:
+            self.data.pop(key, None)
+            self.ttl.pop(key, None)
+
+    def exists(self, key: str) -> int:
+        return int(key in self.data)
+
+
+@override_settings(PARSER_SETTINGS={"ALLIANCE_TTL": 600})
+class AllianceLogicTest(TestCase):
+    def setUp(self):
+        self.redis = StubRedis()
+        with mock.patch("voevoda_app.redis_core.redis.from_url", return_value=self.redis):
+            self.logic = AllianceLogic()
+
+    def get_alliance(self, clan_id: int, parsed) -> tuple:
+        """Альянс клана и количество обращений к странице клана"""
+        with mock.patch.object(ClansParser, "async_get_one_clan_allianse", return_value=parsed) as parser:
+            alliance = async_to_sync(self.logic.async_get_alliance)(fetcher=None, clan_id=clan_id)
+        return alliance, parser.await_count
+
+    def test_alliance_is_cached(self):
+        self.assertEqual(self.get_alliance(clan_id=1, parsed="7"), (7, 1))
+        self.assertEqual((self.redis.data["clan:alliance:1"], self.redis.ttl["clan:alliance:1"]), (b"7", 600))
+        self.assertEqual(self.get_alliance(clan_id=1, parsed="8"), (7, 0))
+
+    def test_missing_alliance_is_cached(self):
+        self.assertEqual(self.get_alliance(clan_id=2, parsed=None), (None, 1))
+        self.assertEqual((self.redis.data["clan:alliance:2"], self.redis.ttl["clan:alliance:2"]), (b"", 600))
+        self.assertEqual(self.get_alliance(clan_id=2, parsed="7"), (None, 0))
+
+    def test_cache_errors_fall_back_to_page(self):
+        with mock.patch.object(self.redis, "get", side_effect=ConnectionError("redis недоступен")):
+            self.assertEqual(self.get_alliance(clan_id=3, parsed="7"), (7, 1))
+
+    def test_cache_is_used_outside_event_loop(self):
+        loop_threads, redis_threads = [], []
+
+        async def parse(fetcher, clan_id):
+            loop_threads.append(threading.current_thread())
+            return "7"
+
+        def redis_call(*args, **kwargs):
+            redis_threads.append(threading.current_thread())
+
+        with mock.patch.object(self.redis, "get", side_effect=redis_call), \
+                mock.patch.object(self.redis, "set", side_effect=redis_call), \
+                mock.patch.object(ClansParser, "async_get_one_clan_allianse", side_effect=parse):
+            self.assertEqual(async_to_sync(self.logic.async_get_alliance)(fetcher=None, clan_id=4), 7)
+        self.assertEqual(len(redis_threads), 2)
+        self.assertNotIn(loop_threads[0], redis_threads)
+
+    def test_alliances_are_saved_with_one_update(self):
+        ClansModel.objects.bulk_create([ClansModel(id=clan_id, name=f"Клан {clan_id}", label="") for clan_id in range(1, 5)])
+        ClansModel.objects.filter(pk=4).update(alliance=1)
+        clans_list_data = [
+            {"clan_id": 1, "alliance": 2},
+            # альянса нет среди известных кланов
+            {"clan_id": 2, "alliance": 99},
+            {"clan_id": 3, "alliance": None},
+            # альянс не загружен (ошибка обработки клана) - клан не трогаем
+            {"clan_id": 4},
+        ]
+        # известные кланы-альянсы и один UPDATE
+        with self.assertNumQueries(2):
+            self.assertEqual(AllianceLogic.save_alliances(clans_list_data=clans_list_data), 3)
+        self.assertEqual(
+            dict(ClansModel.objects.values_list("id", "alliance_id")), {1: 2, 2: None, 3: None, 4: 1}
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(AllianceLogic.save_alliances(clans_list_data=[{"clan_id": 4}]), 0)
+
+
+class ReparseLockTest(SimpleTestCase):
+    def setUp(self):
+        self.redis = StubRedis()
+        patcher = mock.patch("voevoda_app.redis_core.redis.from_url", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.lock = ReparseLock()
+
+    def test_one_owner_at_a_time(self):
+        self.assertIsNone(self.lock.acquire(owner="cli:host:1"))
+        self.assertEqual(self.lock.acquire(owner="queue"), "cli:host:1")
+        # повторный захват владельцем продлевает блокировку
+        self.redis.ttl[ReparseLock.key] = 1
+        self.assertIsNone(self.lock.acquire(owner="cli:host:1"))
+        self.assertEqual(self.redis.ttl[ReparseLock.key], ReparseLock.live_time)
+        self.lock.release(owner="queue")
+        self.assertEqual(self.lock.get_owner(), "cli:host:1")
+        self.lock.release(owner="cli:host:1")
+        self.assertIsNone(self.lock.acquire(owner="queue"))
+
+    def test_hold(self):
+        with self.lock.hold(owner="cli:host:1"):
+            with self.assertRaises(RuntimeError):
+                with self.lock.hold(owner="cli:host:2"):
+                    pass
+            self.assertEqual(self.lock.get_owner(), "cli:host:1")
+        self.assertIsNone(self.lock.get_owner())
+
+    def test_api_job_is_not_started_while_cli_or_queue_runs(self):
+        self.lock.acquire(owner="queue")
+        with mock.patch("voevoda_app.servises.threading.Thread") as thread:
+            self.assertEqual(ReparseJobLogic().start_job(), {"job_id": None, "attached": False, "active": "queue"})
+            response = self.client.put("/api/clans/")
+        thread.assert_not_called()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.lock.get_owner(), "queue")
+
+
+class EmblemLogicTest(TestCase):
+    def setUp(self):
+        self.emblems_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.emblems_dir.cleanup)
+        emblems_settings = override_settings(PARSER_SETTINGS={"EMBLEMS_DIR": self.emblems_dir.name})
+        emblems_settings.enable()
+        self.addCleanup(emblems_settings.disable)
+
+    def test_store_deduplicates_by_content(self):
+        logic = EmblemLogic()
+        first = logic.store(url="https://dcdn.heroeswm.ru/i_clans/l_1.gif?v=2", body=b"GIF89a-1")
+        second = logic.store(url="https://dcdn.heroeswm.ru/i_clans/l_2.gif", body=b"GIF89a-1")
+        self.assertEqual(first, second)
+        self.assertTrue(first.endswith(".gif"))
+        self.assertIsNotNone(logic.get_emblem_path(name=first))
+        self.assertIsNone(logic.get_emblem_path(name="../settings.py"))
+
+    def test_api_label_and_serving(self):
+        name = EmblemLogic().store(url="https://dcdn.heroeswm.ru/i_clans/l_1.gif", body=b"GIF89a-1")
+        ClansModel.objects.create(id=1, name="С значком", label="https://dcdn.heroeswm.ru/i_clans/l_1.gif", emblem=name)
+        ClansModel.objects.create(id=2, name="Без значка", label="https://dcdn.heroeswm.ru/i_clans/l_2.gif")
+        self.assertEqual(
+            self.client.get("/api/clans/", {"clan_id": 2}).json()["data"]["label"],
+            "https://dcdn.heroeswm.ru/i_clans/l_2.gif"
+        )
+        label = self.client.get("/api/clans/", {"clan_id": 1}).json()["data"]["label"]
+        response = self.client.get(label)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertEqual(b"".join(response.streaming_content), b"GIF89a-1")
+
+
+class CorpusFetcher:
+    """Загрузчик, отдающий страницы игроков из корпуса: page_count полных страниц, затем пустая.
+    С cache страницы сохраняются в кэш, как в AsyncFetcher, на странице fail_page загрузка падает
+    """
+
+    def __init__(self, page_count: int, cache: PageCache = None, fail_page: int = None):
+        self.page_count = page_count
+        self.cache = cache
+        self.fail_page = fail_page
+        self.urls = []
+
+    async def fetch_page(self, url: str, use_cache: bool = True) -> PageSchem:
+        self.urls.append(url)
+        page = int(url.rsplit("/", 1)[1])
+        if page == self.fail_page:
+            raise ConnectionError(f"Не удалось загрузить {url}")
+        file_name = "players_full.html" if page <= self.page_count else "players_empty.html"
+        body = ParserBenchmark.load_page(file_name).encode()
+        changed = self.cache.store(url=url, body=body, encoding="utf-8") if self.cache else True
+        return PageSchem(url=url, body=body, encoding="utf-8", changed=changed)
+
+
+class StubResponse:
+    """Ответ aiohttp с заданным кодом, телом и заголовками"""
+
+    def __init__(self, status: int, body: bytes = b"", headers: dict = None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def read(self) -> bytes:
+        return self.body
+
+    def get_encoding(self) -> str:
+        return "utf-8"
+
+
+class StubSession:
+    """Сессия aiohttp, отдающая заготовленные ответы по очереди и запоминающая заголовки запросов"""
+
+    def __init__(self, *responses: StubResponse):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url: str, headers: dict, allow_redirects: bool) -> StubResponse:
+        self.requests.append(headers)
+        return self.responses.pop(0)
+
+
+class StubClock:
+    """Часы для ограничителя частоты: время идет только во время ожидания"""
+
+    def __init__(self, now: float = 100.0):
+        self.now = now
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class AdaptiveRateLimiterTest(SimpleTestCase):
+    def setUp(self):
+        self.clock = StubClock()
+        for target, stub in (("time.monotonic", self.clock.monotonic), ("asyncio.sleep", self.clock.sleep),
+                             ("random.uniform", lambda a, b: 0.0)):
+            patcher = mock.patch(f"voevoda_app.fetcher.{target}", side_effect=stub)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.limiter = AdaptiveRateLimiter(start_delay=1.0, min_delay=0.2, max_delay=30.0, step=0.5)
+
+    def wait(self, count: int = 1) -> list:
+        """Несколько запросов подряд - сколько ждал каждый"""
+        self.clock.sleeps = []
+        for _ in range(count):
+            async_to_sync(self.limiter.wait)()
+        return self.clock.sleeps
+
+    def test_requests_are_spaced_by_delay(self):
+        self.assertEqual(self.wait(count=3), [1.0, 1.0])
+        self.limiter.success()
+        self.assertEqual(self.limiter.delay, 0.5)
+        self.assertEqual(self.wait(count=2), [1.0, 0.5])
+
+    def test_success_decreases_to_min_delay(self):
+        for _ in range(5):
+            self.limiter.success()
+        self.assertEqual(self.limiter.delay, 0.2)
+
+    def test_failure_doubles_to_max_delay(self):
+        self.limiter.failure()
+        self.assertEqual(self.limiter.delay, 2.0)
+        # после ошибки следующий запрос ждет новый интервал, а не старый
+        self.assertEqual(self.wait(), [2.0])
+        for _ in range(10):
+            self.limiter.failure()
+        self.assertEqual(self.limiter.delay, 30.0)
+
+    def test_retry_after(self):
+        self.limiter.failure(retry_after=7.0)
+        self.assertEqual(self.limiter.delay, 7.0)
+        self.assertEqual(self.wait(), [7.0])
+        # Retry-After меньше текущего интервала не ускоряет, а больше максимума - ограничивается
+        self.limiter.failure(retry_after=3.0)
+        self.assertEqual(self.limiter.delay, 7.0)
+        self.limiter.failure(retry_after=120.0)
+        self.assertEqual(self.limiter.delay, 30.0)
+
+    def test_fetcher_follows_retry_after_header(self):
+        fetcher = AsyncFetcher(start_delay=1.0, min_delay=0.2, max_delay=30.0)
+        fetcher.session = StubSession(StubResponse(429, headers={"Retry-After": "5"}), StubResponse(200, body=b"ok"))
+        self.assertEqual(async_to_sync(fetcher.fetch)(url="https://example.com/"), "ok")
+        self.assertEqual(self.clock.sleeps, [5.0])
+        self.assertAlmostEqual(fetcher.get_limiter("example.com").delay, 4.95)
+
+
+class PageCacheTest(SimpleTestCase):
+    url = "https://example.com/clan/1/1"
+
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.cache = PageCache(path=cache_dir.name)
+
+    def fetch(self, *responses: StubResponse, offline: bool = False) -> tuple:
+        """Страница из AsyncFetcher с кэшем и заголовки запросов, которые он отправил"""
+        fetcher = AsyncFetcher(cache=self.cache, offline=offline, start_delay=0, min_delay=0)
+        fetcher.session = StubSession(*responses)
+        return async_to_sync(fetcher.fetch_page)(url=self.url), fetcher.session.requests
+
+    def test_identical_bodies_are_stored_once(self):
+        self.assertTrue(self.cache.store(url=self.url, body=b"<html></html>"))
+        self.assertTrue(self.cache.store(url=f"{self.url}0", body=b"<html></html>"))
+        self.cache.set_meta(url=self.url, rows=0)
+        self.assertFalse(self.cache.store(url=self.url, body=b"<html></html>"))
+        self.assertEqual(self.cache.get_meta(url=self.url), {"rows": 0})
+        self.assertEqual(len(list(self.cache.blobs_path.rglob("*.gz"))), 1)
+
+        self.assertTrue(self.cache.store(url=self.url, body=b"<html>new</html>"))
+        self.assertEqual(self.cache.get_meta(url=self.url), {})
+        self.assertEqual(len(list(self.cache.blobs_path.rglob("*.gz"))), 2)
+
+    def test_not_modified_is_served_from_cache(self):
+        page, requests = self.fetch(StubResponse(200, body=b"<html></html>", headers={"ETag": "v1"}))
+        self.assertEqual((page.body, page.changed, requests), (b"<html></html>", True, [{}]))
+
+        page, requests = self.fetch(StubResponse(304))
+        self.assertEqual((page.body, page.changed), (b"<html></html>", False))
+        self.assertEqual(requests, [{"If-None-Match": "v1"}])
+
+    def test_offline_miss_fails(self):
+        with self.assertRaises(FetchError):
+            self.fetch(offline=True)
+        self.cache.store(url=self.url, body=b"<html></html>")
+        page, requests = self.fetch(offline=True)
+        self.assertEqual((page.body, requests), (b"<html></html>", []))
+
+
+class ReparsePipelineTest(SimpleTestCase):
+    def run_pipeline(self, clans: dict, metrics: ReparseMetrics = None):
+        fetcher = CorpusFetcher(page_count=0)
+        saved = {}
+
+        def save_roster(clan_id, players):
+            saved[clan_id] = len(players)
+            return len(players), 0
+
+        async def run():
+            pipeline = ReparsePipeline(fetcher=fetcher, save_roster=save_roster, metrics=metrics)
+            async with pipeline:
+                for clan_id, page_count in clans.items():
+                    fetcher.page_count = page_count
+                    self.assertTrue(await pipeline.process_clan(clan_id=clan_id))
+            return pipeline.report()
+
+        return async_to_sync(run)(), saved, fetcher.urls
+
+    def test_clan_roster_is_saved_once(self):
+        report, saved, urls = self.run_pipeline(clans={CORPUS_CLAN_ID: 3})
+        self.assertEqual(len(urls), 4)
+        self.assertEqual(saved, {CORPUS_CLAN_ID: 150})
+        self.assertEqual((report["parse"]["items"], report["parse"]["rows"]), (4, 150))
+        self.assertEqual((report["write"]["items"], report["write"]["rows"]), (1, 150))
+
+    def test_empty_clan_is_detached(self):
+        report, saved, urls = self.run_pipeline(clans={1: 0})
+        self.assertEqual(saved, {1: 0})
+
+    def test_failed_clan_roster_is_dropped(self):
+        saved = []
+
+        def save_roster(clan_id, players):
+            saved.append(len(players))
+            return len(players), 0
+
+        async def run():
+            fetcher = CorpusFetcher(page_count=3, fail_page=3)
+            async with ReparsePipeline(fetcher=fetcher, save_roster=save_roster) as pipeline:
+                with self.assertRaises(ConnectionError):
+                    await pipeline.process_clan(clan_id=CORPUS_CLAN_ID)
+                fetcher.fail_page = None
+                await pipeline.process_clan(clan_id=CORPUS_CLAN_ID)
+
+        async_to_sync(run)()
+        # игроки первых страниц упавшего прохода не попадают в следующий состав клана
+        self.assertEqual(saved, [150])
+
+    def test_failed_write_is_not_cached_as_unchanged(self):
+        saved = []
+
+        def save_roster(clan_id, players):
+            if not saved:
+                saved.append(None)
+                raise RuntimeError("database is locked")
+            saved.append(len(players))
+            return len(players), 0
+
+        async def run(fetcher):
+            async with ReparsePipeline(fetcher=fetcher, save_roster=save_roster) as pipeline:
+                return await pipeline.process_clan(clan_id=CORPUS_CLAN_ID)
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            fetcher = CorpusFetcher(page_count=2, cache=PageCache(path=cache_dir))
+            with self.assertRaises(RuntimeError):
+                async_to_sync(run)(fetcher)
+            # страницы не изменились, но состав не записан - клан разбирается и записывается снова
+            self.assertTrue(async_to_sync(run)(fetcher))
+            self.assertEqual(saved, [None, 100])
+            self.assertFalse(async_to_sync(run)(fetcher))
+            self.assertEqual(saved, [None, 100])
+
+    def test_metrics(self):
+        metrics = ReparseMetrics()
+        self.run_pipeline(clans={CORPUS_CLAN_ID: 2}, metrics=metrics)
+        report = metrics.report()
+        self.assertEqual((report["parse"]["pages"], report["parse"]["rows"]), (3, 100))
+        self.assertEqual((report["db"]["writes"], report["db"]["changed"]), (1, 100))
+
+
+class ReparseOneClanTest(SimpleTestCase):
+    def test_failed_checkpoint_write_marks_clan_failed(self):
+        pipeline, alliances, progress = mock.Mock(), mock.Mock(), mock.Mock()
+        pipeline.process_clan = mock.AsyncMock(return_value=True)
+        alliances.async_get_alliance = mock.AsyncMock(return_value=None)
+        states = []
+
+        def set_clan_state(run_id, clan_id, state, error=None):
+            states.append(state)
+
+        with mock.patch.object(ReparseRunLogic, "set_clan_state", side_effect=set_clan_state), \
+                mock.patch.object(ClansModel.objects, "filter", side_effect=OperationalError("database is locked")):
+            done = async_to_sync(ClansLogic.async_reparse_one_clan)(
+                pipeline=pipeline, clan={"clan_id": 1}, semaphore=asyncio.Semaphore(1),
+                progress=progress, run_id=1, alliances=alliances
+            )
+        # ошибка записи не прерывает перепарсинг, а отмечает клан упавшим
+        self.assertFalse(done)
+        self.assertEqual(states, [1, 2, 4])
+        self.assertIn("database is locked", progress.clan_done.call_args.kwargs["error"])
+
+
+class ReparseMetricsTest(SimpleTestCase):
+    def test_summarize(self):
+        summary = summarize([i / 100 for i in range(1, 101)], buckets=(0.1, 0.5))
+        self.assertEqual((summary["count"], summary["p50"], summary["p90"], summary["p99"]), (100, 0.5, 0.9, 0.99))
+        self.assertEqual(summary["histogram"], {"<=0.1": 10, "<=0.5": 40, ">0.5": 50})
+        self.assertEqual(summarize([]), {"count": 0})
+
+    def test_report_bound(self):
+        metrics = ReparseMetrics(network_slots=4, cpu_slots=2)
+        metrics.record_request(latency=0.2, status=200, size=1000)
+        metrics.record_request(latency=0.1, status=503)
+        metrics.record_parse(seconds=0.5, rows=50)
+        metrics.record_write(seconds=0.05, changed=50)
+        metrics.record_rows(unchanged=20, detached=3)
+        metrics.finish()
+        report = metrics.report()
+        self.assertEqual(report["requests"]["status"], {"200": 1, "503": 1})
+        self.assertEqual(report["requests"]["bytes"], 1000)
+        self.assertEqual((report["db"]["changed"], report["db"]["unchanged"], report["db"]["detached"]), (50, 20, 3))
+        self.assertEqual(report["bound"], "cpu")
+
+
+@override_settings(PARSER_SETTINGS={
+    "MAX_CONCURRENCY": 8, "MAX_PER_HOST": 4, "START_DELAY": 1.0, "MIN_DELAY": 0.2, "MAX_DELAY": 30.0,
+    "RETRIES": 3, "TIMEOUT": 30.0, "PARSE_WORKERS": 8,
+})
+class FetcherSettingsTest(SimpleTestCase):
+    def test_limits_are_shared_between_workers(self):
+        fetcher_settings = get_fetcher_settings(workers=4)
+        self.assertEqual((fetcher_settings["max_concurrency"], fetcher_settings["max_per_host"]), (2, 1))
+        # вместе 4 воркера делают не больше запросов к хосту, чем один с настройками
+        self.assertEqual((fetcher_settings["start_delay"], fetcher_settings["min_delay"]), (4.0, 0.8))
+        self.assertEqual(get_fetcher_settings(workers=16)["max_per_host"], 1)
+        self.assertEqual(get_fetcher_settings(workers=200)["max_delay"], 40.0)
+        self.assertEqual(get_fetcher_settings()["max_per_host"], 4)
+
+    def test_queue_worker_parses_in_one_process(self):
+        self.assertEqual(ReparseQueueLogic.parse_workers, 1)
+        metrics = get_metrics(parse_workers=ReparseQueueLogic.parse_workers, workers=4)
+        self.assertEqual(metrics.slots, {"network": 2, "cpu": 1, "db": 1})
+
+
+class ReparseQueueTest(SimpleTestCase):
+    def setUp(self):
+        # очередь держится на Lua-скриптах, поэтому нужен Redis с их поддержкой, а не StubRedis
+        self.redis = fakeredis.FakeRedis()
+        with mock.patch("voevoda_app.redis_core.redis.from_url", return_value=self.redis):
+            self.logic = ReparseQueueLogic(worker_id="test")
+        self.redis.rpush(self.logic.pending_key, 1, 2)
+
+    def expire_lease(self, clan_id: int):
+        self.redis.zadd(self.logic.leases_key, {clan_id: time.time() - 1})
+
+    def test_claim_takes_lease(self):
+        claimed_at = time.time()
+        self.assertEqual(self.logic.claim(), 1)
+        self.assertAlmostEqual(
+            self.redis.zscore(self.logic.leases_key, 1), claimed_at + self.logic.lease_time, delta=5
+        )
+        self.assertEqual(self.redis.hget(self.logic.attempts_key, 1), b"1")
+        self.assertEqual(self.redis.lrange(self.logic.pending_key, 0, -1), [b"2"])
+        self.assertEqual((self.logic.claim(), self.logic.claim()), (2, None))
+        self.assertEqual(self.logic.get_queue_state()["leased"], 2)
+
+    def test_expired_lease_is_requeued(self):
+        self.assertEqual(self.logic.claim(), 1)
+        self.assertEqual(self.logic.requeue_expired(), [])
+        self.expire_lease(clan_id=1)
+        self.assertEqual(self.logic.requeue_expired(), [1])
+        self.assertEqual(self.redis.lrange(self.logic.pending_key, 0, -1), [b"2", b"1"])
+        self.assertEqual(self.redis.zcard(self.logic.leases_key), 0)
+        self.assertEqual((self.logic.claim(), self.logic.claim()), (2, 1))
+        self.assertEqual(self.redis.hget(self.logic.attempts_key, 1), b"2")
+        # продление не возвращает аренду уже обработанному клану
+        self.logic.complete(clan_id=1)
+        self.logic.heartbeat(clans_id_list=[1, 2])
+        self.assertEqual(self.redis.zrange(self.logic.leases_key, 0, -1), [b"2"])
+
+    def process_clan(self, clan_id: int) -> tuple:
+        """Обрабатываем клан из очереди: (результат, был ли перепарсинг, состояния клана в запуске)"""
+        held = {clan_id}
+        with mock.patch.object(ClansLogic, "async_reparse_one_clan", return_value=True) as reparse, \
+                mock.patch.object(ReparseRunLogic, "set_clan_state") as set_clan_state:
+            done = async_to_sync(self.logic.process_clan)(
+                pipeline=None, clan={"clan_id": clan_id}, run_id=1, semaphore=None, held=held, alliances=None
+            )
+        self.assertEqual(held, set())
+        return done, reparse.await_count, [call.kwargs["state"] for call in set_clan_state.call_args_list]
+
+    def test_clan_fails_after_max_attempts(self):
+        self.redis.lrem(self.logic.pending_key, 0, 2)
+        for _ in range(self.logic.max_attempts):
+            self.assertEqual(self.logic.claim(), 1)
+            self.expire_lease(clan_id=1)
+            self.assertEqual(self.logic.requeue_expired(), [1])
+        self.assertEqual(self.logic.claim(), 1)
+        self.assertEqual(self.redis.hget(self.logic.attempts_key, 1), str(self.logic.max_attempts + 1).encode())
+        self.assertEqual(self.process_clan(clan_id=1), (False, 0, [4]))
+        self.assertEqual(self.logic.get_queue_state(), {"run_id": None, "pending": 0, "leased": 0})
+
+        # последняя разрешенная попытка еще загружает клан
+        self.redis.hset(self.logic.attempts_key, 2, self.logic.max_attempts - 1)
+        self.redis.rpush(self.logic.pending_key, 2)
+        self.assertEqual(self.logic.claim(), 2)
+        self.assertEqual(self.process_clan(clan_id=2), (True, 1, []))
+
+    def test_only_successful_clans_are_counted(self):
+        async def fail():
+            raise RuntimeError("database is locked")
+
+        async def run():
+            tasks = [asyncio.create_task(coroutine) for coroutine in (
+                asyncio.sleep(0, result=True), asyncio.sleep(0, result=False), fail()
+            )]
+            done, _ = await asyncio.wait(tasks)
+            return self.logic.collect(done=done)
+
+        with self.assertLogs("voevoda_app.servises", level="ERROR") as logs:
+            self.assertEqual(async_to_sync(run)(), 1)
+        self.assertIn("database is locked", logs.output[0])
+
+
+class ReparseReportTest(TestCase):
+    def test_worker_reports_are_summarized(self):
+        ClansModel.objects.create(id=1, name="Клан", label="")
+        run = ReparseRunLogic.create_run(clans_id_list=[1])
+        for worker_id, changed in (("a", 10), ("b", 5)):
+            metrics = ReparseMetrics()
+            metrics.record_request(latency=0.1, status=200, size=100)
+            metrics.record_write(seconds=0.01, changed=changed)
+            ReparseRunLogic.save_report(run_id=run.id, report=ReparseRunLogic.build_report(metrics=metrics),
+                                        worker_id=worker_id)
+        data = self.client.get("/api/clans/reparse/report/").json()["data"]
+        self.assertEqual(data["run_id"], run.id)
+        self.assertEqual(set(data["summary"]), {"a", "b"})
+        self.assertEqual((data["totals"]["requests"], data["totals"]["changed"]), (2, 15))
+
+
+class RosterIngestLogicTest(SimpleTestCase):
+    def test_html_and_rows_give_same_digest(self):
+        from_html = RosterIngestLogic.parse_rows(
+            clan_id=CORPUS_CLAN_ID, html=ParserBenchmark.load_page("players_full.html")
+        )
+        rows = [player.model_dump() for player in reversed(from_html)]
+        from_rows = RosterIngestLogic.parse_rows(clan_id=CORPUS_CLAN_ID, players=rows)
+        self.assertEqual(len(from_html), 50)
+        self.assertEqual(
+            RosterIngestLogic.get_digest(clan_id=CORPUS_CLAN_ID, players_data=from_html),
+            RosterIngestLogic.get_digest(clan_id=CORPUS_CLAN_ID, players_data=from_rows),
+        )
+        # клан строк берется из запроса, а не из присланных данных
+        self.assertEqual(RosterIngestLogic.parse_rows(clan_id=1, players=rows)[0].clan, 1)
+        with self.assertRaises(ValueError):
+            RosterIngestLogic.parse_rows(clan_id=1)
+
+    @override_settings(PARSER_SETTINGS={"INGEST_TOKENS": ["secret"]})
+    def test_endpoint_requires_auth(self):
+        self.assertTrue(RosterIngestLogic.check_token("secret"))
+        self.assertFalse(RosterIngestLogic.check_token(None))
+        response = self.client.post(
+            "/api/players/ingest/", data={"clan_id": 1, "players": []}, content_type="application/json",
+            headers={"X-Ingest-Token": "wrong"}
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(PARSER_SETTINGS={"INGEST_TOKENS": ["secret"]})
+class RosterIngestViewTest(TestCase):
+    def setUp(self):
+        ClansModel.objects.create(id=1, name="Клан", label="")
+
+    def post(self, data) -> int:
+        with mock.patch("voevoda_app.redis_core.redis.from_url"):
+            response = self.client.post(
+                "/api/players/ingest/", data=data, content_type="application/json", headers={"X-Ingest-Token": "secret"}
+            )
+        return response.status_code
+
+    def test_bad_page_is_rejected(self):
+        short_row = "<table><tbody><tr><td>-</td></tr></tbody><tbody><tr><td>1</td></tr></tbody></table>"
+        for html in ("", "   ", short_row):
+            self.assertEqual(self.post({"clan_id": 1, "html": html}), 400, html)
+
+    def test_bad_rows_are_rejected(self):
+        for players in ("игроки", [{"id": "x"}], [None], [{"id": 1, "name": "Игрок"}]):
+            self.assertEqual(self.post({"clan_id": 1, "players": players}), 400, players)
+        self.assertEqual(self.post({"html": ""}), 400)
+
+
+class PlayersUpsertTest(TestCase):
+    def setUp(self):
+        ClansModel.objects.bulk_create([ClansModel(id=clan_id, name=f"Клан {clan_id}", label="") for clan_id in (1, 2)])
+        self.players = PlayerParser.parse_page_html(html_data=ParserBenchmark.load_page("players_full.html"), clan_id=1)
+
+    def test_roster_is_written_with_fixed_number_of_queries(self):
+        logic = PlayersLogic()
+        fields = PlayersModel._meta.concrete_fields
+        batch_size = connection.ops.bulk_batch_size(fields, self.players)
+        for players in (self.players[:10], self.players):
+            # проверка кланов и сохраненные данные до транзакции, затем SAVEPOINT, INSERT ... ON CONFLICT
+            # на каждую пачку новых игроков, INSERT истории, открепление, RELEASE SAVEPOINT
+            new_players = len(players) - PlayersModel.objects.count()
+            with self.assertNumQueries(6 + math.ceil(new_players / batch_size)):
+                self.assertEqual(logic.save_roster(clan_id=1, players_data=players), (new_players, 0))
+        self.assertEqual(PlayersModel.objects.filter(clan=1).count(), 50)
+
+    def test_update_move_and_detach(self):
+        logic = PlayersLogic()
+        logic.save_roster(clan_id=1, players_data=self.players)
+        moved = self.players[0].model_copy(update={"clan": 2, "level": 20})
+        unknown_clan = self.players[1].model_copy(update={"clan": 3})
+        self.assertEqual(logic.upsert_players(players_data=[moved, unknown_clan]), 1)
+        self.assertEqual(logic.save_roster(clan_id=1, players_data=self.players[2:]), (0, 1))
+        player = PlayersModel.objects.get(pk=moved.id)
+        self.assertEqual((player.clan_id, player.level), (2, 20))
+        self.assertIsNone(PlayersModel.objects.get(pk=self.players[1].id).clan_id)
+        self.assertEqual(PlayersModel.objects.filter(clan=1).count(), 48)
+
+    def test_player_rejoins_clan(self):
+        logic = PlayersLogic()
+        logic.save_roster(clan_id=1, players_data=self.players)
+        self.assertEqual(logic.save_roster(clan_id=1, players_data=self.players[1:]), (0, 1))
+        self.assertEqual(logic.save_roster(clan_id=1, players_data=self.players), (1, 0))
+        self.assertEqual(PlayersModel.objects.get(pk=self.players[0].id).clan_id, 1)
+        # уход и возвращение видны в истории
+        changes = list(PlayerStatsHistoryModel.objects.filter(player=self.players[0].id).order_by("id").values_list(
+            "changes", flat=True
+        ))
+        self.assertEqual(changes[1:], [{"clan": None}, {"clan": 1}])
+
+    def test_unchanged_players_are_not_written(self):
+        logic = PlayersLogic()
+        self.assertEqual(logic.upsert_players(players_data=self.players), 50)
+        changed = self.players[5].model_copy(update={"umka_mag": 11})
+        # проверка кланов и сохраненных данных, затем в транзакции INSERT только изменившегося игрока и его истории
+        with self.assertNumQueries(6):
+            self.assertEqual(logic.upsert_players(players_data=self.players[:5] + [changed]), 1)
+        self.assertEqual(PlayersModel.objects.get(pk=changed.id).umka_mag, 11)
+        with self.assertNumQueries(2):
+            self.assertEqual(logic.upsert_players(players_data=self.players[:5]), 0)
+
+
+class PlayersRosterTest(TestCase):
+    def test_roster_is_read_with_one_query(self):
+        ClansModel.objects.create(id=1, name="Клан", label="")
+        PlayersLogic().upsert_players(players_data=PlayerParser.parse_page_html(
+            html_data=ParserBenchmark.load_page("players_full.html"), clan_id=1
+        ))
+        voevoda = VoevodaModel.objects.create(id=1, name="Воевода", telegram_id=1)
+        players = list(PlayersModel.objects.order_by("id")[:3])
+        for number, player in enumerate(players):
+            PersonsModel.objects.create(telegram_id=number, telegram_username=f"person{number}", player_id=player,
+                                        voevoda_id=voevoda)
+        logic = PlayersLogic()
+        for voevoda_id in (None, 1):
+            with self.assertNumQueries(1):
+                data = logic.get_players_data(player_filter={"clan_id": 1, "voevoda_id": voevoda_id})
+            self.assertEqual(len(data), 50)
+            # тот же вид, что и у сериализации одного игрока
+            expected = [logic.serialize_one_player_data(data=player, voevoda_id=voevoda_id)
+                        for player in PlayersModel.objects.filter(clan_id=1)]
+            self.assertEqual(data, expected)
+        self.assertEqual(sum(1 for player in data if player["person_id"]), 3)
+
+
+class PlayerHistoryTest(TestCase):
+    def setUp(self):
+        ClansModel.objects.bulk_create([ClansModel(id=clan_id, name=f"Клан {clan_id}", label="") for clan_id in (1, 2)])
+        self.players = PlayerParser.parse_page_html(
+            html_data=ParserBenchmark.load_page("players_full.html"), clan_id=1
+        )[:3]
+        self.start = timezone.now()
+
+    def upsert_at(self, players: list, days: int):
+        with mock.patch("voevoda_app.servises.timezone.now", return_value=self.start + datetime.timedelta(days=days)):
+            PlayersLogic().upsert_players(players_data=players)
+
+    def test_only_changes_are_stored(self):
+        player = self.players[0]
+        self.upsert_at(self.players, days=0)
+        self.upsert_at(self.players, days=1)
+        self.upsert_at([player.model_copy(update={"umka_mag": player.umka_mag + 1})], days=2)
+        self.upsert_at([player.model_copy(update={"umka_mag": player.umka_mag + 1, "clan": 2})], days=3)
+        changes = list(PlayerStatsHistoryModel.objects.filter(player=player.id).order_by("date").values_list(
+            "changes", flat=True
+        ))
+        self.assertEqual(len(changes), 3)
+        self.assertEqual(len(changes[0]), len(PlayerHistoryLogic.history_fields))
+        self.assertEqual(changes[1:], [{"umka_mag": player.umka_mag + 1}, {"clan": 2}])
+        self.assertEqual(PlayerStatsHistoryModel.objects.count(), 5)
+
+    def test_series(self):
+        player = self.players[0]
+        self.upsert_at(self.players, days=0)
+        self.upsert_at([player.model_copy(update={"level": player.level + 1})], days=2)
+        self.upsert_at([player.model_copy(update={"level": player.level + 2})], days=5)
+        date_from = (self.start + datetime.timedelta(days=1)).timestamp()
+        date_to = (self.start + datetime.timedelta(days=3)).timestamp()
+        with self.assertNumQueries(1):
+            data = PlayerHistoryLogic().get_history(player_id=player.id, date_from=date_from, date_to=date_to)
+        self.assertEqual(
+            [value for _, value in data["series"]["level"]], [player.level, player.level + 1]
+        )
+        self.assertEqual(data["series"]["umka_mag"], [[date_from, player.umka_mag]])
+
+        response = self.client.get("/api/players/history/", {
+            "clan_id": 1, "date_from": date_from, "date_to": (self.start + datetime.timedelta(days=6)).timestamp()
+        })
+        players = response.json()["data"]["players"]
+        self.assertEqual(len(players), 3)
+        self.assertEqual([value for _, value in players[str(player.id)]["level"]], [player.level, player.level + 1,
+                                                                                     player.level + 2])
+
+    def test_bad_period(self):
+        for date_from in ("вчера", "1e20", "nan"):
+            response = self.client.get("/api/players/history/", {"player_id": self.players[0].id, "date_from": date_from})
+            self.assertEqual(response.status_code, 400)
+
+
+class PersonPresetLogicTest(TestCase):
+    def setUp(self):
+        voevoda = VoevodaModel.objects.create(id=1, name="Воевода", telegram_id=1)
+        self.person = PersonsModel.objects.create(telegram_id=1, telegram_username="person", voevoda_id=voevoda)
+        self.presets = PresetsModel.objects.bulk_create([
+            PresetsModel(voevoda_id=voevoda, fraction=fraction, name=f"Пресет {fraction}", description="") for fraction in range(3)
+        ])
+
+    def test_defaults_are_not_stored(self):
+        with self.assertNumQueries(3):
+            data = PersonPresetLogic.get_person_presets(person_id=self.person.id)
+        self.assertEqual([one["preset"]["id"] for one in data], [preset.id for preset in self.presets])
+        self.assertEqual({(one["id"], one["play_preset"]) for one in data}, {(None, False)})
+        self.assertEqual(PersonPresetModel.objects.count(), 0)
+
+    def test_persons_presets_are_read_in_bulk(self):
+        voevoda = self.person.voevoda_id
+        ClansModel.objects.create(id=1, name="Клан", label="")
+        PlayersModel.objects.bulk_create([PlayersModel(id=number, name=f"Игрок {number}", clan_id=1)
+                                          for number in range(1, 4)])
+        PersonsModel.objects.filter(pk=self.person.id).update(player_id=1)
+        for number in (2, 3):
+            PersonsModel.objects.create(telegram_id=number, telegram_username=f"person{number}", player_id_id=number,
+                                        voevoda_id=voevoda)
+        person = PersonsModel.objects.get(telegram_id=2)
+        PersonPresetLogic.set_play_preset(person_id=person.id, preset_id=self.presets[2].id, play_preset=True)
+
+        # игроки (с воеводой и персонажем), сохраненные строки и пресеты воеводы - без запросов на игрока
+        with mock.patch("voevoda_app.redis_core.redis.from_url"), self.assertNumQueries(3):
+            data = PersonsLogic().get_person_data(filter={"person_id": None, "voevoda_id": voevoda.id})
+        self.assertEqual(len(data), 3)
+        for one in data:
+            self.assertEqual(one["presets"], PersonPresetLogic.get_person_presets(person_id=one["id"]))
+        self.assertEqual([preset["play_preset"] for preset in data[1]["presets"]], [False, False, True])
+
+    def test_play_preset_round_trip(self):
+        preset_id = self.presets[1].id
+        self.assertTrue(PersonPresetLogic.update_person_preset_data(
+            in_data={"person_id": self.person.id, "preset_id": preset_id, "play_preset": True}
+        ))
+        data = PersonPresetLogic.get_person_presets(person_id=self.person.id)
+        person_preset_id = PersonPresetModel.objects.get().id
+        self.assertEqual([(one["id"], one["play_preset"]) for one in data],
+                         [(None, False), (person_preset_id, True), (None, False)])
+
+        self.assertTrue(PersonPresetLogic.update_person_preset_data(
+            in_data={"person_preset_id": person_preset_id, "play_preset": False}
+        ))
+        self.assertEqual(PersonPresetModel.objects.count(), 0)
+
+
+class FightsImportTest(TestCase):
+    def setUp(self):
+        self.voevoda = VoevodaModel.objects.create(id=1, name="Воевода", telegram_id=1)
+        other = VoevodaModel.objects.create(id=2, name="Другой воевода", telegram_id=2)
+        PlayersModel.objects.bulk_create([PlayersModel(id=player_id, name=f"Игрок {player_id}") for player_id in range(1, 5)])
+        self.preset = PresetsModel.objects.create(voevoda_id=self.voevoda, fraction=0, name="Пресет", description="")
+        self.other_preset = PresetsModel.objects.create(voevoda_id=other, fraction=0, name="Чужой", description="")
+
+    def make_row(self, **kwargs) -> dict:
+        row = {
+            "name": "Бой", "type": 1, "date": 1700000000, "result": 1,
+            "attack_1_pers": 1, "attack_2_pers": 2, "defence_1_pers": 3, "defence_2_pers": 4,
+            "attack_1_pers_preset": self.preset.id,
+        }
+        row.update(kwargs)
+        return row
+
+    def test_rows_are_resolved_with_one_query_per_model(self):
+        rows = [self.make_row(name=f"Бой {number}") for number in range(200)]
+        with self.assertNumQueries(2):
+            fights, errors = FightsImportLogic.validate(voevoda_id=1, rows=rows)
+        self.assertEqual((len(fights), errors), (200, []))
+        ids = FightsImportLogic.save_fights(fights=fights)
+        self.assertEqual(FightsModel.objects.filter(id__in=ids, voevoda_id=1, attack_1_pers=1).count(), 200)
+
+    def test_errors_are_reported_per_row(self):
+        rows = [
+            self.make_row(),
+            self.make_row(name="", result=3, attack_2_pers=99),
+            self.make_row(date="2024-05-01T18:00:00", defence_2_pers_preset=self.other_preset.id),
+            "бой",
+        ]
+        fights, errors = FightsImportLogic.validate(voevoda_id=1, rows=rows)
+        self.assertEqual(len(fights), 1)
+        self.assertEqual(errors, [
+            {"row": 2, "errors": {"name": "обязательное поле", "result": "допустимые значения: [1, 2]",
+                                  "attack_2_pers": "игрок не найден"}},
+            {"row": 3, "errors": {"defence_2_pers_preset": "пресет воеводы не найден"}},
+            {"row": 4, "errors": {"row": "ожидается объект"}},
+        ])
+
+        response = self.client.post(
+            "/api/fights/batch/", data={"voevoda_id": 1, "fights": rows}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.json()["data"]["errors"]), 3)
+        self.assertEqual(FightsModel.objects.count(), 0)
+
+    def test_read_csv(self):
+        content = "name;type;date;result;attack_1_pers;attack_1_pers_preset\nБой;2;2024-05-01 18:00;2;1;\n"
+        rows = FightsImportLogic.read_file(name="fights.csv", content=content.encode("utf-8-sig"))
+        fights, errors = FightsImportLogic.validate(voevoda_id=1, rows=rows)
+        self.assertEqual(errors, [])
+        self.assertEqual((fights[0].type, fights[0].attack_1_pers_id, fights[0].attack_1_pers_preset_id), (2, 1, None))
+        self.assertEqual(fights[0].date.isoformat(), "2024-05-01T18:00:00+00:00")
+
+
+class InviteBulkTest(TestCase):
+    def setUp(self):
+        voevoda = VoevodaModel.objects.create(id=1, name="Воевода", telegram_id=1)
+        other = VoevodaModel.objects.create(id=2, name="Другой воевода", telegram_id=2)
+        self.event = FightEventModel.objects.create(name="Сбор", voevoda_id=voevoda)
+        self.persons = PersonsModel.objects.bulk_create([
+            PersonsModel(telegram_id=number, telegram_username=f"person{number}", voevoda_id=voevoda,
+                         activity=number % 4 != 0)
+            for number in range(1, 41)
+        ])
+        self.stranger = PersonsModel.objects.create(telegram_id=100, telegram_username="stranger", voevoda_id=other,
+                                                    activity=True)
+
+    def test_invite_active_persons_once(self):
+        # ивент, игроки, уже приглашенные, SAVEPOINT, INSERT, RELEASE SAVEPOINT
+        with self.assertNumQueries(6):
+            data = InviteLogic.create_invites(event_id=self.event.id)
+        self.assertEqual((data["created"], data["skipped"]), (30, 0))
+        data = InviteLogic.create_invites(event_id=self.event.id, person_ids=[self.persons[3].id, self.stranger.id])
+        self.assertEqual((data["created"], data["skipped"]), (1, 0))
+        self.assertEqual(InviteLogic.create_invites(event_id=self.event.id)["created"], 0)
+        self.assertEqual(InviteModel.objects.filter(event_id=self.event).count(), 31)
+        self.assertFalse(InviteModel.objects.filter(person_id=self.stranger).exists())
+
+    def test_state_is_updated_with_one_query(self):
+        InviteLogic.create_invites(event_id=self.event.id)
+        invites = list(InviteModel.objects.filter(event_id=self.event).order_by("id").values_list("id", flat=True))
+        with self.assertNumQueries(1):
+            data = InviteLogic.update_invites_state(
+                event_id=self.event.id, state=4, invite_ids=invites[:3], person_ids=[self.persons[5].id]
+            )
+        self.assertEqual(data["updated"], 4)
+        self.assertEqual(InviteModel.objects.filter(state=4).count(), 4)
+        with self.assertRaises(ValueError):
+            InviteLogic.update_invites_state(event_id=self.event.id, state=7, invite_ids=invites)
+        with self.assertRaises(ValueError):
+            InviteLogic.update_invites_state(event_id=self.event.id, state=4)
+
+
+@override_settings(PARSER_SETTINGS={"ARCHIVE_AGE_DAYS": 30})
+class ArchiveTest(TestCase):
+    def setUp(self):
+        voevoda = VoevodaModel.objects.create(id=1, name="Воевода", telegram_id=1)
+        person = PersonsModel.objects.create(telegram_id=1, telegram_username="person", voevoda_id=voevoda)
+        old = timezone.now() - datetime.timedelta(days=40)
+        self.cutoff = ArchiveLogic.get_cutoff()
+        # завершенный старый, незавершенный старый и завершенный свежий ивенты
+        self.events = [
+            FightEventModel.objects.create(name=f"Ивент {state}", voevoda_id=voevoda, state=state, date=date)
+            for state, date in ((4, old), (2, old), (4, timezone.now()))
+        ]
+        for event in self.events:
+            InviteModel.objects.create(event_id=event, person_id=person, state=4)
+        for date in (old, timezone.now()):
+            FightsModel.objects.create(name="Бой", voevoda_id=voevoda, date=date, result=1, description="")
+
+    def test_archive_moves_only_old_finished_rows(self):
+        self.assertEqual(ArchiveLogic.archive_events_batch(cutoff=self.cutoff, batch_size=10), (1, 1))
+        self.assertEqual(ArchiveLogic.archive_events_batch(cutoff=self.cutoff, batch_size=10), (0, 0))
+        self.assertEqual(ArchiveLogic.archive_fights_batch(cutoff=self.cutoff, batch_size=10), 1)
+
+        archived = FightEventArchiveModel.objects.get()
+        self.assertEqual((archived.id, archived.name, archived.state), (self.events[0].id, "Ивент 4", 4))
+        self.assertEqual(InviteArchiveModel.objects.get().event_id_id, self.events[0].id)
+        self.assertEqual(
+            sorted(FightEventModel.objects.values_list("id", flat=True)), [self.events[1].id, self.events[2].id]
+        )
+        self.assertEqual(InviteModel.objects.count(), 2)
+        self.assertEqual((FightsModel.objects.count(), FightsArchiveModel.objects.count()), (1, 1))
+
+    def test_archive_is_read_only_for_archived_periods(self):
+        week_ago = {"date__gte": timezone.now() - datetime.timedelta(days=7)}
+        self.assertFalse(ArchiveLogic.include_archive(archive_model=FightsArchiveModel, filter=week_ago))
+        ArchiveLogic.archive_fights_batch(cutoff=self.cutoff, batch_size=10)
+        self.assertFalse(ArchiveLogic.include_archive(archive_model=FightsArchiveModel, filter={}))
+        self.assertFalse(ArchiveLogic.include_archive(archive_model=FightsArchiveModel, filter=week_ago))
+        self.assertTrue(ArchiveLogic.include_archive(
+            archive_model=FightsArchiveModel, filter={"date__gte": timezone.now() - datetime.timedelta(days=60)}
+        ))
+        self.assertTrue(ArchiveLogic.include_archive(
+            archive_model=FightsArchiveModel, filter={"date__lte": timezone.now() - datetime.timedelta(days=35)}
+        ))
+        date_filter = ArchiveLogic.get_date_filter(date_from="1700000000", date_to=None)
+        self.assertEqual(list(date_filter), ["date__gte"])
+        with self.assertRaises(ValueError):
+            ArchiveLogic.get_date_filter(date_from="вчера")
+        for url in ("/api/fights/", "/api/events/"):
+            response = self.client.get(url, {"voevoda_id": 1, "date_from": "1e20"})
+            self.assertEqual(response.json(), {"success": False, "data": "bad date"})
+
+
+    @mock.patch("voevoda_app.redis_core.redis.from_url")
+    def test_rows_archived_with_a_shorter_age_are_read(self, from_url):
+        # как archive_history --age-days 0: в архив уходят и свежие записи
+        cutoff = timezone.now() + datetime.timedelta(minutes=1)
+        ArchiveLogic.archive_events_batch(cutoff=cutoff, batch_size=10)
+        ArchiveLogic.archive_fights_batch(cutoff=cutoff, batch_size=10)
+        self.assertEqual(FightsModel.objects.count(), 0)
+
+        week_ago = timezone.now() - datetime.timedelta(days=7)
+        fights = FightsLogic().get_fight_by_filter(filter={"date__gte": week_ago})
+        self.assertEqual(len(fights), 1)
+        # противника у ивентов теста нет - сериализацию кланов подменяем
+        with mock.patch("voevoda_app.servises.ClansLogic"):
+            events = FightEventLogic().get_event_by_filter(filter={"date__gte": week_ago})
+        self.assertEqual([event["id"] for event in events], [self.events[2].id])
+        # период, заканчивающийся раньше границы архивации
+        month_ago = {"date__lte": timezone.now() - datetime.timedelta(days=35)}
+        self.assertEqual(len(FightsLogic().get_fight_by_filter(filter=month_ago)), 1)
+        with mock.patch("voevoda_app.servises.ClansLogic"):
+            events = FightEventLogic().get_event_by_filter(filter=month_ago)
+        self.assertEqual(sorted(event["id"] for event in events), [self.events[0].id, self.events[1].id])
+
+
+class QueryPlanTest(TestCase):
+    """Запросы API должны идти по индексам, а не полным перебором таблицы.
+    Проверяются планы всех SELECT, которые выполняют настоящие запросы к API
+    """
+
+    def setUp(self):
+        ClansModel.objects.create(id=1, name="Клан", label="")
+        voevoda = VoevodaModel.objects.create(id=1, name="Воевода", telegram_id=1)
+        player = PlayersModel.objects.create(id=1, name="Игрок", level=10, clan_id=1)
+        person = PersonsModel.objects.create(telegram_id=1, telegram_username="person", player_id=player,
+                                             voevoda_id=voevoda, activity=True)
+        preset = PresetsModel.objects.create(voevoda_id=voevoda, fraction=0, name="Пресет", description="")
+        PersonPresetModel.objects.create(person_id=person, preset_id=preset)
+        self.event = FightEventModel.objects.create(name="Сбор", voevoda_id=voevoda, enemy_id=1)
+        InviteModel.objects.create(event_id=self.event, person_id=person, state=1)
+        FightsModel.objects.create(name="Бой", voevoda_id=voevoda, date=timezone.now(), result=1, description="")
+
+    def get_plans(self, url: str, params: dict) -> list:
+        """Выполняем запрос к API и возвращаем планы всех его SELECT"""
+        with mock.patch("voevoda_app.redis_core.redis.from_url"), CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                if not query["sql"].startswith("SELECT"):
+                    continue
+                cursor.execute(f"EXPLAIN QUERY PLAN {query['sql']}")
+                plans.append((query["sql"], [row[-1] for row in cursor.fetchall()]))
+        return plans
+
+    def assertUsesIndexes(self, url: str, params: dict, index_names: list):
+        plans = self.get_plans(url=url, params=params)
+        for sql, plan in plans:
+            full_scans = [step for step in plan if step.startswith("SCAN") and "USING" not in step]
+            self.assertEqual(full_scans, [], f"Полный перебор таблицы в {sql}: {plan}")
+        steps = [step for _, plan in plans for step in plan]
+        for index_name in index_names:
+            self.assertTrue(any(index_name in step for step in steps), f"Индекс {index_name} не используется: {steps}")
+
+    def test_persons(self):
+        self.assertUsesIndexes(
+            "/api/persons/", {"voevoda_id": 1, "activity": "1"},
+            ["persons_voevoda_activity_idx", "voevoda_app_personpresetmodel_person_id"]
+        )
+        # telegram_id приходит вместе с voevoda_id: планировщик выбирает между persons_telegram_id_idx
+        # и persons_voevoda_activity_idx по статистике, важно только отсутствие перебора
+        self.assertUsesIndexes("/api/persons/", {"voevoda_id": 1, "telegram_id": 1}, [])
+
+    def test_players(self):
+        # person_id игроков состава - подзапросом PlayersLogic.get_player_data_by_filter
+        self.assertUsesIndexes(
+            "/api/players/", {"clan_id": 1, "voevoda_id": 1},
+            ["voevoda_app_playersmodel_clan_id", "persons_player_voevoda_idx"]
+        )
+
+    def test_fights_and_events(self):
+        self.assertUsesIndexes("/api/fights/", {"voevoda_id": 1}, ["fights_voevoda_date_idx"])
+        # с периодом проверяется и архив
+        self.assertUsesIndexes(
+            "/api/fights/", {"voevoda_id": 1, "date_from": timezone.now().timestamp() - 3600},
+            ["fights_voevoda_date_idx", "fights_arch_date_idx"]
+        )
+        self.assertUsesIndexes(
+            "/api/events/", {"voevoda_id": 1, "state__in": [1, 2, 3]}, ["events_voevoda_state_idx"]
+        )
+        self.assertUsesIndexes(
+            "/api/invites/", {"event_id": self.event.id, "state__in": [1, 2]}, ["invites_event_state_idx"]
+        )
+        self.assertUsesIndexes("/api/players/history/", {"player_id": 1}, ["stats_history_player_date_idx"])
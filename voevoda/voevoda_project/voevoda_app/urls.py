@@ -1,16 +1,27 @@
 from django.urls import path
 from .views import ClansView, PlayerView, VoevodaView, KeyView, PersonsView, FightsEventsView
-from .views import PresetsView, FightsView, PersonsPresetsView, InviteView
+from .views import PresetsView, FightsView, PersonsPresetsView, InviteView, ReparseJobView, ClansRefreshView
+from .views import EmblemView, ReparseReportView, RosterIngestView, PlayerHistoryView
+from .views import FightsBatchView, FightsImportView, InviteBulkView
 
 urlpatterns = [
     path("clans/", ClansView.as_view(), name="clans"),
+    path("clans/reparse/", ReparseJobView.as_view(), name="clans_reparse"),
+    path("clans/reparse/report/", ReparseReportView.as_view(), name="clans_reparse_report"),
+    path("clans/refresh/", ClansRefreshView.as_view(), name="clans_refresh"),
+    path("clans/emblems/<str:name>", EmblemView.as_view(), name="emblem"),
     path("players/", PlayerView.as_view(), name="player"),
+    path("players/ingest/", RosterIngestView.as_view(), name="players_ingest"),
+    path("players/history/", PlayerHistoryView.as_view(), name="players_history"),
     path("voevoda/", VoevodaView.as_view(), name="voevoda"),
     path("keys/", KeyView.as_view(), name="keys"),
     path("presets/", PresetsView.as_view(), name="presets"),
     path("persons/", PersonsView.as_view(), name="persons"),
     path("persons_presets/", PersonsPresetsView.as_view(), name="persons_presets"),
     path("fights/", FightsView.as_view(), name="fights"),
+    path("fights/batch/", FightsBatchView.as_view(), name="fights_batch"),
+    path("fights/import/", FightsImportView.as_view(), name="fights_import"),
     path("events/", FightsEventsView.as_view(), name="fights_event"),
     path("invites/", InviteView.as_view(), name="invites"),
+    path("invites/bulk/", InviteBulkView.as_view(), name="invites_bulk"),
 ]
\ No newline at end of file
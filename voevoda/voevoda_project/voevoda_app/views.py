@@ -1,12 +1,17 @@
+import csv
 import json
+import mimetypes
 
-from django.http import JsonResponse
+from django.core.exceptions import ObjectDoesNotExist
+from django.http import FileResponse, JsonResponse
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 
 from .servises import ClansLogic, PlayersLogic, VoevodaLogic, KeyLogic, PresetsLogic, FightsLogic, logger
-from .servises import PersonPresetLogic, PersonsLogic, FightEventLogic, InviteLogic
+from .servises import PersonPresetLogic, PersonsLogic, FightEventLogic, InviteLogic, ReparseJobLogic
+from .servises import ClansRefreshLogic, EmblemLogic, ReparseRunLogic, RosterIngestLogic, PlayerHistoryLogic
+from .servises import FightsImportLogic, ArchiveLogic
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -52,9 +57,95 @@ class ClansView(View):
 
     @staticmethod
     def put(request, *args, **kwargs):
-        obj = ClansLogic()
-        data = obj.reparse_clan_data()
-        return JsonResponse(data=data)
+        """Запуск фонового перепарсинга всех кланов. Возвращает ID задачи.
+        Прерванный запуск продолжается с первого необработанного клана,
+        а с {"retry_failed": true} повторяются только кланы с ошибками
+        """
+        json_data = json.loads(request.body) if request.body else {}
+        data = ReparseJobLogic().start_job(retry_failed=bool(json_data.get("retry_failed")))
+        if not data["job_id"]:
+            # перепарсинг идет вне API (reparse_clans или очередь воркеров)
+            return JsonResponse(data={"success": False, "data": data}, status=409)
+        return JsonResponse(data={"success": True, "data": data}, status=202)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ReparseJobView(View):
+    """Состояние фоновой задачи перепарсинга кланов"""
+
+    @staticmethod
+    def get(request, *args, **kwargs):
+        data = ReparseJobLogic().get_job(job_id=request.GET.get('job_id'))
+        if data:
+            return JsonResponse(data={"success": True, "data": data}, status=200)
+        else:
+            return JsonResponse(data={"success": False, "data": "job not found"}, status=400)
+
+
+class ReparseReportView(View):
+    """Отчет о запуске перепарсинга: сеть, разбор, запись в БД и во что уперся запуск"""
+
+    @staticmethod
+    def get(request, *args, **kwargs):
+        data = ReparseRunLogic().get_run_report(run_id=request.GET.get('run_id'))
+        if data:
+            return JsonResponse(data={"success": True, "data": data}, status=200)
+        else:
+            return JsonResponse(data={"success": False, "data": "run not found"}, status=400)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ClansRefreshView(View):
+    """Обновление данных одного клана с сайта ГВД по запросу"""
+
+    @staticmethod
+    def post(request, *args, **kwargs):
+        """Запускаем обновление клана. Пока оно идет, отвечаем 202 - о его окончании говорит новый refreshed_at"""
+        json_data = json.loads(request.body)
+        data = ClansRefreshLogic().refresh_clan_now(clan_id=json_data["clan_id"])
+        if data:
+            return JsonResponse(data={"success": True, "data": data}, status=200 if data["state"] == "fresh" else 202)
+        else:
+            return JsonResponse(data={"success": False, "data": "clan not found"}, status=400)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class RosterIngestView(View):
+    """Прием страницы состава клана от клиента (HTML страницы или разобранные строки игроков)"""
+
+    @staticmethod
+    def post(request, *args, **kwargs):
+        """Доступ - по сессии воеводы или по токену в заголовке X-Ingest-Token"""
+        if not request.session.get("voevoda_id") and not RosterIngestLogic.check_token(
+                request.headers.get("X-Ingest-Token")):
+            return JsonResponse(data={"success": False, "data": "forbidden"}, status=403)
+        try:
+            json_data = json.loads(request.body)
+            data = RosterIngestLogic().ingest(
+                clan_id=int(json_data["clan_id"]), html=json_data.get("html"), players=json_data.get("players")
+            )
+        except (KeyError, TypeError, ValueError) as _ex:
+            logger.info(f"Некорректная страница состава клана -> {_ex!r}")
+            return JsonResponse(data={"success": False, "data": "bad request"}, status=400)
+        if data:
+            return JsonResponse(data={"success": True, "data": data}, status=200)
+        else:
+            return JsonResponse(data={"success": False, "data": "clan not found"}, status=400)
+
+
+class EmblemView(View):
+    """Значок клана из локального зеркала.
+    Имя файла - хэш содержимого, поэтому браузер может кэшировать его бессрочно
+    """
+
+    @staticmethod
+    def get(request, name, *args, **kwargs):
+        path = EmblemLogic().get_emblem_path(name=name)
+        if not path:
+            return JsonResponse(data={"success": False, "data": "emblem not found"}, status=404)
+        response = FileResponse(open(path, "rb"), content_type=mimetypes.guess_type(name)[0] or "image/gif")
+        response["Cache-Control"] = f"public, max-age={EmblemLogic.cache_max_age}, immutable"
+        return response
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -101,6 +192,28 @@ class PlayerView(View):
             return JsonResponse(data={"success": False}, status=400)
 
 
+class PlayerHistoryView(View):
+    """История характеристик игрока или клана за период"""
+
+    @staticmethod
+    def get(request, *args, **kwargs):
+        """Период задается timestamp'ами date_from и date_to, по умолчанию - последние 30 дней"""
+        try:
+            data = PlayerHistoryLogic().get_history(
+                player_id=request.GET.get('player_id'),
+                clan_id=request.GET.get('clan_id'),
+                date_from=request.GET.get('date_from'),
+                date_to=request.GET.get('date_to'),
+            )
+        except (ValueError, OverflowError) as _ex:
+            logger.info(f"Некорректный запрос истории -> {_ex!r}")
+            data = None
+        if data:
+            return JsonResponse(data={"success": True, "data": data}, status=200)
+        else:
+            return JsonResponse(data={"success": False, "data": "history not found"}, status=400)
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class VoevodaView(View):
     """Представление для работы с данными воеводы"""
@@ -225,6 +338,10 @@ class PersonsView(View):
             "person_id": request.GET.get('person_id'),
             "voevoda_id": request.GET.get('voevoda_id')
         }
+        if request.GET.get('activity'):
+            filter["activity"] = request.GET.get('activity') in ("1", "true", "True")
+        if request.GET.get('telegram_id'):
+            filter["telegram_id"] = request.GET.get('telegram_id')
         obj = PersonsLogic()
         data = obj.get_person_data(filter=filter)
 
@@ -331,10 +448,17 @@ class FightsView(View):
 
     @staticmethod
     def get(request, *args, **kwargs):
+        """Бои воеводы. С периодом date_from/date_to (timestamp) в выборку попадает и архив"""
         filter = {
             "fight_id": request.GET.get('fight_id'),
             "voevoda_id": request.GET.get('voevoda_id')
         }
+        try:
+            filter.update(ArchiveLogic.get_date_filter(
+                date_from=request.GET.get('date_from'), date_to=request.GET.get('date_to')
+            ))
+        except (ValueError, OverflowError):
+            return JsonResponse(data={"success": False, "data": "bad date"}, status=400)
         data = FightsLogic().get_fights(in_data=filter)
         if data:
             return JsonResponse(data={"success": True, "data": data}, status=200)
@@ -359,6 +483,52 @@ class FightsView(View):
         else:
             return JsonResponse(data={"success": False}, status=400)
 
+def fights_import_response(voevoda_id, rows) -> JsonResponse:
+    """Ответ пакетной загрузки боев: 200 с ID созданных боев или 400 с ошибками по строкам"""
+    try:
+        data = FightsImportLogic.import_fights(voevoda_id=int(voevoda_id), rows=rows)
+    except (TypeError, ValueError) as _ex:
+        logger.info(f"Некорректная загрузка боев -> {_ex!r}")
+        return JsonResponse(data={"success": False, "data": str(_ex)}, status=400)
+    if data["errors"]:
+        return JsonResponse(data={"success": False, "data": data}, status=400)
+    return JsonResponse(data={"success": True, "data": data}, status=200)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class FightsBatchView(View):
+    """Пакетное добавление боев: {"voevoda_id": ..., "fights": [{...}, ...]}"""
+
+    @staticmethod
+    def post(request, *args, **kwargs):
+        try:
+            json_data = json.loads(request.body)
+            rows = json_data["fights"]
+            if not isinstance(rows, list):
+                raise TypeError("fights должен быть массивом")
+        except (KeyError, TypeError, ValueError) as _ex:
+            logger.info(f"Некорректный пакет боев -> {_ex!r}")
+            return JsonResponse(data={"success": False, "data": "bad request"}, status=400)
+        return fights_import_response(voevoda_id=json_data.get("voevoda_id"), rows=rows)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class FightsImportView(View):
+    """Загрузка боев из файла CSV или JSON (multipart: поля voevoda_id и file)"""
+
+    @staticmethod
+    def post(request, *args, **kwargs):
+        upload = request.FILES.get("file")
+        if upload is None:
+            return JsonResponse(data={"success": False, "data": "file is required"}, status=400)
+        try:
+            rows = FightsImportLogic.read_file(name=upload.name, content=upload.read())
+        except (csv.Error, UnicodeDecodeError, ValueError) as _ex:
+            logger.info(f"Некорректный файл боев {upload.name} -> {_ex!r}")
+            return JsonResponse(data={"success": False, "data": "bad file"}, status=400)
+        return fights_import_response(voevoda_id=request.POST.get("voevoda_id"), rows=rows)
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class FightsEventsView(View):
     """Представление для работы боевых ивентов"""
@@ -375,11 +545,18 @@ class FightsEventsView(View):
 
     @staticmethod
     def get(request, *args, **kwargs):
+        """Ивенты. С периодом date_from/date_to (timestamp) в выборку попадает и архив"""
         filter = {"event_id": request.GET.get('event_id')}
         if request.GET.get('voevoda_id'):
             filter["voevoda_id"] = request.GET.get('voevoda_id')
         if request.GET.get('state__in'):
             filter["state__in"] = request.GET.getlist('state__in')
+        try:
+            filter.update(ArchiveLogic.get_date_filter(
+                date_from=request.GET.get('date_from'), date_to=request.GET.get('date_to')
+            ))
+        except (ValueError, OverflowError):
+            return JsonResponse(data={"success": False, "data": "bad date"}, status=400)
 
         data = FightEventLogic().get_events(in_data=filter)
         if data:
@@ -432,4 +609,39 @@ class InviteView(View):
         if data:
             return JsonResponse(data={"success": True}, status=200)
         else:
-            return JsonResponse(data={"success": False}, status=400)
\ No newline at end of file
+            return JsonResponse(data={"success": False}, status=400)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class InviteBulkView(View):
+    """Пакетная работа с приглашениями ивента: одним запросом вместо запроса на каждого игрока"""
+
+    @staticmethod
+    def post(request, *args, **kwargs):
+        """Приглашение игроков: {"event_id": ..., "person_ids": [...] (без них - все активные), "state": 1}"""
+        try:
+            json_data = json.loads(request.body)
+            data = InviteLogic.add_invites(
+                event_id=int(json_data["event_id"]), person_ids=json_data.get("person_ids"),
+                state=int(json_data.get("state", 1))
+            )
+        except ObjectDoesNotExist:
+            return JsonResponse(data={"success": False, "data": "event not found"}, status=400)
+        except (KeyError, TypeError, ValueError) as _ex:
+            logger.info(f"Некорректный пакет приглашений -> {_ex!r}")
+            return JsonResponse(data={"success": False, "data": "bad request"}, status=400)
+        return JsonResponse(data={"success": True, "data": data}, status=200)
+
+    @staticmethod
+    def patch(request, *args, **kwargs):
+        """Смена состояния: {"event_id": ..., "state": 4, "invite_ids": [...] и/или "person_ids": [...]}"""
+        try:
+            json_data = json.loads(request.body)
+            data = InviteLogic.set_invites_state(
+                event_id=int(json_data["event_id"]), state=int(json_data["state"]),
+                invite_ids=json_data.get("invite_ids"), person_ids=json_data.get("person_ids")
+            )
+        except (KeyError, TypeError, ValueError) as _ex:
+            logger.info(f"Некорректная смена состояния приглашений -> {_ex!r}")
+            return JsonResponse(data={"success": False, "data": "bad request"}, status=400)
+        return JsonResponse(data={"success": True, "data": data}, status=200)
@@ -83,6 +83,32 @@ DATABASES = {
     }
 }
 
+# Профиль SQLite: "production" - режим для одновременной работы API и перепарсинга,
+# "default" - настройки SQLite по умолчанию
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "production")
+# PRAGMA, выполняемые на каждом соединении в профиле production
+SQLITE_PRAGMAS = {
+    # читатели не ждут писателя, а писатель - читателей
+    "journal_mode": "WAL",
+    # в режиме WAL fsync только при чекпоинте, данные не портятся при падении процесса
+    "synchronous": "NORMAL",
+    # кэш страниц 64 МБ на соединение (отрицательное значение - в КБ) и чтение файла БД через mmap
+    "cache_size": -64000,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+# сколько секунд ждать освобождения блокировки записи вместо ошибки "database is locked"
+SQLITE_TIMEOUT = float(os.getenv("SQLITE_TIMEOUT", 20))
+
+if SQLITE_PROFILE == "production":
+    DATABASES['default']['OPTIONS'] = {
+        'init_command': ";".join(f"PRAGMA {name}={value}" for name, value in SQLITE_PRAGMAS.items()),
+        # блокировка записи берется в начале транзакции, а не при первой записи:
+        # иначе транзакция, начавшаяся с чтения, получает "database is locked" без ожидания
+        'transaction_mode': 'IMMEDIATE',
+        'timeout': SQLITE_TIMEOUT,
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -162,4 +188,41 @@ LOGGING = {
     },
 }
 
-SESSION_COOKIE_AGE = 1440
\ No newline at end of file
+SESSION_COOKIE_AGE = 1440
+
+# Параметры загрузки страниц с сайта ГВД при перепарсинге кланов
+PARSER_SETTINGS = {
+    # сколько запросов выполняется одновременно всего и к одному хосту
+    "MAX_CONCURRENCY": int(os.getenv("PARSER_MAX_CONCURRENCY", 8)),
+    "MAX_PER_HOST": int(os.getenv("PARSER_MAX_PER_HOST", 4)),
+    # сколько кланов обрабатывается одновременно
+    "MAX_CLANS": int(os.getenv("PARSER_MAX_CLANS", 16)),
+    # интервал между запросами к одному хосту в секундах (подстраивается под ответы сервера)
+    "START_DELAY": float(os.getenv("PARSER_START_DELAY", 1.0)),
+    "MIN_DELAY": float(os.getenv("PARSER_MIN_DELAY", 0.2)),
+    "MAX_DELAY": float(os.getenv("PARSER_MAX_DELAY", 30.0)),
+    "RETRIES": int(os.getenv("PARSER_RETRIES", 3)),
+    "TIMEOUT": float(os.getenv("PARSER_TIMEOUT", 30.0)),
+    # конвейер перепарсинга: процессы разбора страниц и размер очередей между стадиями
+    "PARSE_WORKERS": int(os.getenv("PARSER_PARSE_WORKERS", os.cpu_count() or 1)),
+    "QUEUE_SIZE": int(os.getenv("PARSER_QUEUE_SIZE", 32)),
+    # каталог сжатого кэша страниц (пустая строка выключает кэш)
+    "CACHE_DIR": os.getenv("PARSER_CACHE_DIR", str(BASE_DIR / "parser_cache")),
+    # каталог локального зеркала значков кланов (файлы именуются по sha256 содержимого)
+    "EMBLEMS_DIR": os.getenv("PARSER_EMBLEMS_DIR", os.path.join(BASE_DIR, "static", "voevoda_app", "clans")),
+    # сколько секунд хранить в Redis найденный альянс клана (альянсы меняются редко)
+    "ALLIANCE_TTL": int(os.getenv("PARSER_ALLIANCE_TTL", 24 * 60 * 60)),
+    # планировщик обновления: пауза между проходами и сколько кланов обновлять за проход (секунды/штуки)
+    "REFRESH_INTERVAL": float(os.getenv("PARSER_REFRESH_INTERVAL", 60)),
+    "REFRESH_BATCH": int(os.getenv("PARSER_REFRESH_BATCH", 16)),
+    # через сколько секунд данные клана устаревают для приоритетов 1-4:
+    # противники ближайших ивентов, кланы воевод, их альянсы, все остальные
+    # (если значений меньше четырех, для остальных приоритетов берется последнее)
+    "REFRESH_MAX_AGE": [
+        int(age) for age in os.getenv("PARSER_REFRESH_MAX_AGE", "900,3600,10800,86400").split(",") if age.strip()
+    ] or [86400],
+    # токены для приема страниц состава кланов от клиентов (через запятую), помимо сессии воеводы
+    "INGEST_TOKENS": [token for token in os.getenv("PARSER_INGEST_TOKENS", "").split(",") if token],
+    # через сколько дней завершенные ивенты с приглашениями и бои переносятся в архивные таблицы
+    "ARCHIVE_AGE_DAYS": int(os.getenv("PARSER_ARCHIVE_AGE_DAYS", 90)),
+}